@@ -0,0 +1,181 @@
+"""
+Benchmark for driving many counting orchestrators from one process.
+
+Runs N orchestrators against the real counting service on the in-process broker stand-in (see
+local_broker.py), in one of two ways:
+
+- lifecycle: N SampleOrchestrators from counting_client.py, each with its own client and broker
+  connection, and a thread per orchestrator calling waiting_callback like
+  default_intersect_lifecycle_loop does. The get_count chain sleeps inside the reply callback.
+- asyncio: N AsyncCountingOrchestrators from async_runner.py sharing one AsyncIntersectClient
+  and one connection, all on a single event loop.
+
+Reports the counts observed, skipped counts, the threads each runner added and the CPU time used
+by the process for each.
+
+Example:
+    python benchmarks/bench_async_clients.py --orchestrators 10 100 300 --duration 20
+"""
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+from bench_stats import format_table, write_json
+from local_broker import LocalCluster, LocalConnection, LocalIntersectClient, LocalIntersectService
+from repo_modules import load_client_module, load_service_module
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+
+
+def run_lifecycle(cluster: LocalCluster, orchestrators: int, duration: float) -> Dict[str, Any]:
+    """SampleOrchestrators, one client, connection and lifecycle thread each."""
+    counting_client = load_client_module()
+    stop = threading.Event()
+    threads_before = set(threading.enumerate())
+    started = time.monotonic()
+    cpu_started = time.process_time()
+
+    running = []
+    for _ in range(orchestrators):
+        orchestrator = counting_client.SampleOrchestrator()
+        counts = {'counts': 0, 'skipped': 0}
+        record_count = orchestrator.record_count
+
+        def counting_record(count_value, rtt=None, orchestrator=orchestrator, record_count=record_count, counts=counts):
+            counts['counts'] += 1
+            if orchestrator.last_count >= 0 and count_value > orchestrator.last_count + 1:
+                counts['skipped'] += count_value - orchestrator.last_count - 1
+            record_count(count_value, rtt)
+
+        orchestrator.record_count = counting_record
+        client = LocalIntersectClient(
+            LocalConnection(cluster),
+            user_callback=orchestrator.client_callback,
+            initial_messages=[orchestrator.start_count_message],
+        ).startup()
+
+        def lifecycle(orchestrator=orchestrator, client=client):
+            while not stop.wait(1.0):
+                orchestrator.waiting_callback(client)
+
+        thread = threading.Thread(target=lifecycle, daemon=True)
+        thread.start()
+        running.append((orchestrator, client, counts))
+
+    time.sleep(duration)
+    threads = len(set(threading.enumerate()) - threads_before)
+    cpu = time.process_time() - cpu_started
+    elapsed = time.monotonic() - started
+    stop.set()
+    for _, client, _ in running:
+        client.shutdown()
+    return {
+        'counts': sum(counts['counts'] for _, _, counts in running),
+        'skipped': sum(counts['skipped'] for _, _, counts in running),
+        'threads': threads,
+        'cpu_seconds': cpu,
+        'elapsed': elapsed,
+    }
+
+
+async def _run_asyncio(cluster: LocalCluster, orchestrators: int, duration: float) -> Dict[str, Any]:
+    async_runner = load_client_module('async_runner')
+    client = async_runner.AsyncIntersectClient(
+        lambda user_callback, event_callback: LocalIntersectClient(LocalConnection(cluster), user_callback=user_callback),
+        destination=SERVICE_DESTINATION,
+    )
+    threads_before = set(threading.enumerate())
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    await client.start()
+    running = [
+        async_runner.AsyncCountingOrchestrator(client, name=f'client-{i}', log_counts=False)
+        for i in range(orchestrators)
+    ]
+    tasks = [asyncio.create_task(orchestrator.run()) for orchestrator in running]
+    await asyncio.sleep(duration)
+    threads = len(set(threading.enumerate()) - threads_before)
+    cpu = time.process_time() - cpu_started
+    elapsed = time.monotonic() - started
+    for task in tasks:
+        task.cancel()
+    await client.stop()
+    return {
+        'counts': sum(o.counts for o in running),
+        'skipped': sum(o.skipped for o in running),
+        'threads': threads,
+        'cpu_seconds': cpu,
+        'elapsed': elapsed,
+    }
+
+
+def run_asyncio(cluster: LocalCluster, orchestrators: int, duration: float) -> Dict[str, Any]:
+    """AsyncCountingOrchestrators sharing one client and connection on one event loop."""
+    return asyncio.run(_run_asyncio(cluster, orchestrators, duration))
+
+
+RUNNERS = {
+    'lifecycle': run_lifecycle,
+    'asyncio': run_asyncio,
+}
+
+
+def run_benchmark(orchestrator_counts: List[int], duration: float, broker_latency: float, runners: List[str]) -> Dict[str, Any]:
+    counting_service = load_service_module()
+    trials = []
+    for orchestrators in orchestrator_counts:
+        for runner in runners:
+            # a fresh cluster and service per trial, so nothing left over from the last one competes
+            cluster = LocalCluster(['rabbitmq1', 'rabbitmq2'], latency=broker_latency)
+            capability = counting_service.CountingServiceCapabilityImplementation()
+            service = LocalIntersectService([capability], SERVICE_DESTINATION, LocalConnection(cluster)).startup()
+            result = RUNNERS[runner](cluster, orchestrators, duration)
+            service.shutdown()
+            capability.state.counting = False
+            trials.append({
+                'runner': runner,
+                'orchestrators': orchestrators,
+                'counts': result['counts'],
+                'counts_per_orchestrator_s': result['counts'] / orchestrators / result['elapsed'],
+                'skipped': result['skipped'],
+                'threads': result['threads'],
+                'cpu_percent': 100.0 * result['cpu_seconds'] / result['elapsed'],
+                'service_requests': service.requests_handled,
+            })
+    return {
+        'config': {
+            'orchestrators': orchestrator_counts,
+            'duration': duration,
+            'broker_latency_ms': broker_latency * 1000.0,
+        },
+        'trials': trials,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['trials'], [
+        'runner', 'orchestrators', 'counts', 'counts_per_orchestrator_s', 'skipped', 'threads', 'cpu_percent', 'service_requests',
+    ]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orchestrators', type=int, nargs='+', default=[10, 100], help='orchestrator counts to try (default: 10 100)')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds per trial (default: 15)')
+    parser.add_argument('--broker-latency', type=float, default=0.0, help='one-way broker latency in ms (default: 0)')
+    parser.add_argument('--runner', choices=sorted(RUNNERS), action='append', help='only run these runners (default: both)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    # every orchestrator logs each count at INFO, keep the benchmark output readable
+    # (configured before the client module's own basicConfig call, which then does nothing)
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args.orchestrators, args.duration, args.broker_latency / 1000.0, args.runner or list(RUNNERS))
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
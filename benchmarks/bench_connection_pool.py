@@ -0,0 +1,214 @@
+"""
+Broker connections and failover time as the number of services in one process grows, with and
+without the shared connection pool (clustering_common/connection_pool.py).
+
+Each trial runs N real IntersectServices in this process, each hosting a counting service
+capability under its own hierarchy name, plus one IntersectClient which gathers get_count from all
+of them (client/scatter_gather.py). Their broker clients come from a ConnectionPool whose
+connections run over the in-process broker stand-in (see local_broker.py):
+
+- sdk: max_channels=1, every service and the client open their own connection, which is what the
+  SDK does on its own
+- pooled: max_channels=--max-channels, the services and the client share connections
+
+Opening a connection costs --connect-ms, spent one connection at a time per node, which stands in
+for the TCP and AMQP/MQTT handshakes a broker serves. Once everything runs, rabbitmq1 is killed and
+the trial measures how long it takes until every connection failed over to rabbitmq2 and until
+every service answers the client again.
+
+Example:
+    python benchmarks/bench_connection_pool.py --services 1,8,32,64 --connect-ms 5
+"""
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from intersect_sdk import IntersectClient, IntersectClientCallback, IntersectDirectMessageParams
+
+from bench_stats import format_table, write_json
+from local_broker import LocalCluster, LocalConnection, LocalMessage
+from repo_modules import load_client_module, load_service_module
+
+from clustering_common.connection_pool import ConnectionPool
+
+
+class LocalTransport:
+    """A pooled connection's transport over a LocalCluster, pinned to one node like a real socket."""
+
+    channel_per_lease = False
+
+    def __init__(
+        self,
+        cluster: LocalCluster,
+        connect_cost: float,
+        node_locks: Dict[str, threading.Lock],
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        client_id: str,
+        on_message: Callable[[Any, str, bytes], None],
+        on_lost: Callable[[Any, str], None],
+        max_channels: int,
+    ) -> None:
+        self.cluster = cluster
+        self.connect_cost = connect_cost
+        self.node_lock = node_locks.setdefault(host, threading.Lock())
+        self.on_message = on_message
+        self.connection = LocalConnection(cluster, node_order=[host], auto_reconnect=False)
+        node_lost = self.connection._on_node_lost
+
+        def lost() -> None:
+            node_lost()
+            on_lost(self, f'{host} went away')
+
+        self.connection._on_node_lost = lost
+
+    def open(self, timeout: float) -> None:
+        with self.node_lock:
+            time.sleep(self.connect_cost)
+        self.connection.connect()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def open_channel(self, lease: Any) -> None:
+        pass
+
+    def close_channel(self, lease: Any) -> None:
+        pass
+
+    def publish(self, lease: Any, topic: str, payload: bytes, persist: bool) -> None:
+        self.connection.publish(topic, LocalMessage('', '', '', payload))
+
+    def subscribe(self, lease: Any, topic: str, persist: bool) -> None:
+        self.connection.subscribe(topic, lambda topic, message: self.on_message(None, topic, message.payload))
+
+    def unsubscribe(self, lease: Any, topic: str) -> None:
+        self.connection.unsubscribe(topic)
+
+
+def start_services(counting_service: Any, names: List[str]) -> List[Any]:
+    config = counting_service.SERVICE_CONFIG
+    services = []
+    for name in names:
+        hierarchy = config.hierarchy.model_validate({**config.hierarchy.model_dump(), 'service': name})
+        capability = counting_service.CountingServiceCapabilityImplementation()
+        with counting_service.schema_source(multi_counter=False):
+            service = counting_service.IntersectService([capability], config.model_copy(update={'hierarchy': hierarchy}))
+        service.startup()
+        services.append((service, capability))
+    return services
+
+
+async def gather_until_complete(scatter: Any, deadline: float, timeout: float) -> float:
+    """Gather get_count until every service answered, return when that was (time.monotonic())."""
+    give_up = time.monotonic() + timeout
+    while time.monotonic() < give_up:
+        result = await scatter.gather('CountingExample.get_count')
+        if result.complete:
+            return time.monotonic()
+    raise TimeoutError(f'services still missing after {timeout}s: {result.missing}')
+
+
+async def _failover(args: argparse.Namespace, cluster: LocalCluster, pool: ConnectionPool, services: List[Any], destinations: List[str]) -> Dict[str, Any]:
+    async_runner = load_client_module('async_runner')
+    scatter_gather = load_client_module('scatter_gather')
+    client_config = load_client_module('config').CLIENT_CONFIG.model_copy(update={
+        'initial_message_event_config': IntersectClientCallback(messages_to_send=[
+            IntersectDirectMessageParams(destination=destination, operation='CountingExample.start_count', payload=None)
+            for destination in destinations
+        ]),
+    })
+    client = async_runner.AsyncIntersectClient(
+        lambda user_callback, event_callback: IntersectClient(config=client_config, user_callback=user_callback, event_callback=event_callback),
+        destination=destinations[0],
+        # the benchmark measures the pool's failover, not the client's own restarts
+        reconnect_after=3600.0,
+    )
+    scatter = scatter_gather.ScatterGatherClient(client, destinations, deadline=args.deadline_ms / 1000.0)
+    await client.start()
+    try:
+        await gather_until_complete(scatter, args.deadline_ms / 1000.0, args.timeout)
+        row: Dict[str, Any] = {
+            'connections': pool.connection_count(),
+            'broker_sessions': cluster.connection_count(),
+        }
+        killed = time.monotonic()
+        await asyncio.to_thread(cluster.kill, 'rabbitmq1')
+        while not all(service.is_connected() for service, _ in services) or not client.client.is_connected():
+            if time.monotonic() - killed > args.timeout:
+                raise TimeoutError(f'not reconnected after {args.timeout}s')
+            await asyncio.sleep(0.001)
+        row['reconnect_ms'] = (time.monotonic() - killed) * 1000
+        row['answering_ms'] = (await gather_until_complete(scatter, args.deadline_ms / 1000.0, args.timeout) - killed) * 1000
+        row['failovers'] = sum(connection.failovers for connection in pool.connections())
+        return row
+    finally:
+        await client.stop()
+
+
+def run_trial(args: argparse.Namespace, mode: str, count: int) -> Dict[str, Any]:
+    counting_service = load_service_module()
+    scatter_gather = load_client_module('scatter_gather')
+    cluster = LocalCluster(['rabbitmq1', 'rabbitmq2'])
+    node_locks: Dict[str, threading.Lock] = {}
+    pool = ConnectionPool(
+        max_channels=1 if mode == 'sdk' else args.max_channels,
+        transport_factory=lambda protocol, *transport_args: LocalTransport(cluster, args.connect_ms / 1000.0, node_locks, *transport_args),
+        retry_delay=args.retry_delay,
+    ).install()
+    names = [f'counting-service-{i}' for i in range(1, count + 1)]
+    threads_before = threading.active_count()
+    started = time.monotonic()
+    services = start_services(counting_service, names)
+    startup_ms = (time.monotonic() - started) * 1000
+    try:
+        destinations = scatter_gather.expand_destinations(','.join(names))
+        row = {'mode': mode, 'services': count, 'startup_ms': startup_ms}
+        result = asyncio.run(_failover(args, cluster, pool, services, destinations))
+        row.update(result)
+        row['threads'] = threading.active_count() - threads_before
+        return row
+    finally:
+        for service, capability in services:
+            service.shutdown()
+            capability.stop_count()
+        pool.close()
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    counts = [int(count) for count in args.services.split(',')]
+    return {
+        'config': vars(args),
+        'trials': [run_trial(args, mode, count) for count in counts for mode in ('sdk', 'pooled')],
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['trials'], [
+        'mode', 'services', 'connections', 'broker_sessions', 'threads', 'startup_ms', 'failovers', 'reconnect_ms', 'answering_ms',
+    ]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', default='1,8,32,64', help='comma-separated services per trial (default: 1,8,32,64)')
+    parser.add_argument('--max-channels', type=int, default=64, help='leases per pooled connection (default: 64)')
+    parser.add_argument('--connect-ms', type=float, default=5.0, help='cost of opening one connection in ms (default: 5)')
+    parser.add_argument('--retry-delay', type=float, default=0.5, help='seconds between rounds over the brokers (default: 0.5)')
+    parser.add_argument('--deadline-ms', type=float, default=200.0, help='per-service deadline of a gather in ms (default: 200)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds a trial may take to recover (default: 60)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
@@ -0,0 +1,307 @@
+"""
+Failover recovery-time benchmark.
+
+Runs the real counting service and the real client orchestrator (SampleOrchestrator from
+counting_client.py, in whichever polling mode is selected) against a two-node stand-in cluster,
+then repeatedly kills and restores the node the client is connected to, like running
+``docker-compose stop rabbitmq1`` by hand. For every kill it measures:
+
+- time to first successful reply: from the kill until the client next records a count
+- skipped counts: gaps in the counts the client saw, the same thing the client's
+  "Skipped N count(s)" warning reports
+- reconnect attempts: broker connection attempts by the client and the service, and how often
+  the orchestrator had to restart its chain
+
+With --hot-standby the client runs the real HotStandbyClient from hot_standby_client.py, with one
+stand-in connection pinned to each node. The service side always uses a single reconnecting
+connection.
+
+With --clock-sync the client computes counts locally from a get_clock lease (clock_sync.py), so a
+kill only matters if it happens while the client is syncing.
+
+Example:
+    python benchmarks/bench_failover.py --trials 20 --down 3 --pipeline-window 4 --json failover.json
+
+Results are reported per trial and as a distribution (p50/p99/max) over all trials.
+"""
+
+import argparse
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench_stats import format_table, summarize, write_json
+from local_broker import LocalCluster, LocalConnection, LocalIntersectClient, LocalIntersectService
+from repo_modules import load_client_module, load_service_module
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+NODES = ['rabbitmq1', 'rabbitmq2']
+
+
+class CountObserver:
+    """Timestamps every count the orchestrator records, by wrapping its record_count method."""
+
+    def __init__(self, orchestrator: Any) -> None:
+        self.samples: List[Tuple[float, int]] = []
+        self._lock = threading.Lock()
+        original = orchestrator.record_count
+
+        def record_count(count_value: int, rtt: Optional[float] = None, request_id: Optional[int] = None) -> None:
+            with self._lock:
+                self.samples.append((time.monotonic(), count_value))
+            original(count_value, rtt, request_id)
+
+        orchestrator.record_count = record_count
+
+    def since(self, t: float) -> List[Tuple[float, int]]:
+        with self._lock:
+            return [s for s in self.samples if s[0] > t]
+
+    def last_count(self) -> Optional[int]:
+        with self._lock:
+            return max((count for _, count in self.samples), default=None)
+
+
+def skipped_counts(previous: Optional[int], counts: List[int]) -> int:
+    """Sum of the gaps in a sequence of observed counts, as the client's skip detector sees them."""
+    skipped = 0
+    last = previous
+    for count in counts:
+        if last is not None and count > last + 1:
+            skipped += count - last - 1
+        if last is None or count > last:
+            last = count
+    return skipped
+
+
+class FailoverHarness:
+    """The service, the client and the lifecycle loop driving the client, on one stand-in cluster."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        counting_service = load_service_module()
+        counting_client = load_client_module()
+
+        self.cluster = LocalCluster(NODES, latency=args.broker_latency / 1000.0)
+
+        self.service_connection = LocalConnection(self.cluster, NODES, reconnect_delay=args.reconnect_delay)
+        self.service = LocalIntersectService(
+            [counting_service.CountingServiceCapabilityImplementation()],
+            SERVICE_DESTINATION,
+            self.service_connection,
+        )
+
+        pipeline = None
+        if args.pipeline_window > 0:
+            pipeline = counting_client.RequestPipeline(
+                args.pipeline_window,
+                timeout=counting_client.PIPELINE_TIMEOUT,
+                send_interval=counting_client.PIPELINE_INTERVAL,
+            )
+        clock = None
+        if args.clock_sync:
+            clock = counting_client.ClockSync(samples=counting_client.CLOCK_SAMPLES, lease=args.clock_lease)
+        self.orchestrator = counting_client.SampleOrchestrator(pipeline, tick_events=args.tick_events, clock=clock)
+        self.observer = CountObserver(self.orchestrator)
+
+        start_message = counting_client.IntersectDirectMessageParams(
+            destination=SERVICE_DESTINATION,
+            operation='CountingExample.start_count',
+            payload=None,
+        )
+        event_callback = self.orchestrator.event_callback if args.tick_events else None
+        subscribe_to_events = [SERVICE_DESTINATION] if args.tick_events else []
+
+        self.client_connections: List[LocalConnection] = []
+        if args.hot_standby:
+            def client_factory(config: Any, user_callback: Any, event_callback: Any) -> LocalIntersectClient:
+                # one connection per node, pinned to it like the split configs
+                node = NODES[len(self.client_connections)]
+                connection = LocalConnection(self.cluster, [node], reconnect_delay=args.reconnect_delay)
+                self.client_connections.append(connection)
+                return LocalIntersectClient(
+                    connection,
+                    user_callback=user_callback,
+                    event_callback=event_callback,
+                    initial_messages=config.initial_message_event_config.messages_to_send,
+                    subscribe_to_events=subscribe_to_events,
+                    resend_initial_messages=True,
+                )
+
+            config = counting_client.CLIENT_CONFIG.model_copy(
+                update={
+                    'initial_message_event_config': counting_client.IntersectClientCallback(messages_to_send=[start_message]),
+                }
+            )
+            self.client = counting_client.HotStandbyClient(
+                counting_client.split_client_config(config)[:len(NODES)],
+                user_callback=self.orchestrator.client_callback,
+                event_callback=event_callback,
+                probe_destination=SERVICE_DESTINATION,
+                heartbeat_timeout=counting_client.HEARTBEAT_TIMEOUT,
+                client_factory=client_factory,
+            )
+        else:
+            connection = LocalConnection(self.cluster, NODES, reconnect_delay=args.reconnect_delay)
+            self.client_connections.append(connection)
+            self.client = LocalIntersectClient(
+                connection,
+                user_callback=self.orchestrator.client_callback,
+                event_callback=event_callback,
+                initial_messages=[start_message],
+                subscribe_to_events=subscribe_to_events,
+                resend_initial_messages=True,
+            )
+        # same pacing as counting_client.py's lifecycle loop
+        fine_pacing = pipeline is not None or args.hot_standby or args.clock_sync
+        self.loop_delay = min(1.0, counting_client.PIPELINE_INTERVAL / 4) if fine_pacing else 1.0
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self.service.startup()
+        self.client.startup()
+        threading.Thread(target=self._lifecycle_loop, daemon=True, name='lifecycle_loop').start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.client.shutdown()
+        self.service.shutdown()
+
+    def _lifecycle_loop(self) -> None:
+        while not self._stop.wait(self.loop_delay):
+            self.orchestrator.waiting_callback(self.client)
+
+    def client_node(self) -> Optional[str]:
+        """The node the client's traffic currently goes through."""
+        if isinstance(self.client, LocalIntersectClient):
+            return self.client.connection.node
+        return self.client.active.connection.node
+
+    def client_connect_attempts(self) -> int:
+        return sum(connection.connect_attempts for connection in self.client_connections)
+
+    def wait_for_counts(self, timeout: float) -> bool:
+        """Wait until the client has recorded a count within the last two seconds."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.observer.since(time.monotonic() - 2.0):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def run_trial(self, down: float, recovery_timeout: float, settle: float) -> Dict[str, Any]:
+        """Kill the client's current node for `down` seconds and measure the recovery."""
+        node = self.client_node()
+        client_attempts = self.client_connect_attempts()
+        service_attempts = self.service_connection.connect_attempts
+        chain_restarts = self.orchestrator.reconnections
+        last_before = self.observer.last_count()
+
+        killed_at = time.monotonic()
+        self.cluster.kill(node)
+        restore_at = killed_at + down
+
+        time_to_first_reply = None
+        restored = False
+        deadline = killed_at + recovery_timeout
+        while time.monotonic() < deadline:
+            if not restored and time.monotonic() >= restore_at:
+                self.cluster.restore(node)
+                restored = True
+            after = self.observer.since(killed_at)
+            if after:
+                time_to_first_reply = after[0][0] - killed_at
+                if restored:
+                    break
+            time.sleep(0.01)
+        if not restored:
+            self.cluster.restore(node)
+        time.sleep(settle)
+
+        counts = [count for _, count in self.observer.since(killed_at)]
+        return {
+            'killed_node': node,
+            'recovered': time_to_first_reply is not None,
+            'time_to_first_reply': time_to_first_reply,
+            'skipped_counts': skipped_counts(last_before, counts),
+            'client_connect_attempts': self.client_connect_attempts() - client_attempts,
+            'service_connect_attempts': self.service_connection.connect_attempts - service_attempts,
+            'chain_restarts': self.orchestrator.reconnections - chain_restarts,
+            'client_node_after': self.client_node(),
+        }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run every trial and return the report."""
+    harness = FailoverHarness(args)
+    harness.start()
+    trials = []
+    try:
+        for _ in range(args.trials):
+            if not harness.wait_for_counts(args.recovery_timeout):
+                logging.warning('Client is not receiving counts, running the trial anyway')
+            trials.append(harness.run_trial(args.down, args.recovery_timeout, args.settle))
+    finally:
+        harness.stop()
+
+    recovered = [t for t in trials if t['recovered']]
+    distributions = {
+        key: summarize([float(t[key]) for t in recovered])
+        for key in ('time_to_first_reply', 'skipped_counts', 'client_connect_attempts', 'service_connect_attempts', 'chain_restarts')
+    }
+    return {
+        'config': {
+            'trials': args.trials,
+            'down_seconds': args.down,
+            'reconnect_delay': args.reconnect_delay,
+            'broker_latency_ms': args.broker_latency,
+            'pipeline_window': args.pipeline_window,
+            'tick_events': args.tick_events,
+            'hot_standby': args.hot_standby,
+            'clock_sync': args.clock_sync,
+            'clock_lease': args.clock_lease if args.clock_sync else None,
+        },
+        'recovered': len(recovered),
+        'failed': len(trials) - len(recovered),
+        'trials': trials,
+        'distributions': distributions,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(
+        [dict(trial=i + 1, **t) for i, t in enumerate(report['trials'])],
+        ['trial', 'killed_node', 'time_to_first_reply', 'skipped_counts', 'client_connect_attempts',
+         'service_connect_attempts', 'chain_restarts', 'client_node_after'],
+    ))
+    print()
+    print(format_table(
+        [dict(metric=key, **value) for key, value in report['distributions'].items()],
+        ['metric', 'count', 'mean', 'min', 'p50', 'p99', 'max'],
+    ))
+    print(f"\nrecovered {report['recovered']}/{report['recovered'] + report['failed']} trials")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trials', type=int, default=5, help='number of kill/restore cycles (default: 5)')
+    parser.add_argument('--down', type=float, default=3.0, help='seconds the killed node stays down (default: 3)')
+    parser.add_argument('--settle', type=float, default=3.0, help='seconds to keep observing after recovery (default: 3)')
+    parser.add_argument('--recovery-timeout', type=float, default=30.0, help='give up on a trial after this many seconds (default: 30)')
+    parser.add_argument('--reconnect-delay', type=float, default=1.0, help='broker client reconnect delay in seconds (default: 1)')
+    parser.add_argument('--broker-latency', type=float, default=0.0, help='one-way broker latency in ms (default: 0)')
+    parser.add_argument('--pipeline-window', type=int, default=0, help='run the client in pipelined mode with this window (default: chain mode)')
+    parser.add_argument('--tick-events', action='store_true', help='run the client in count_tick event mode')
+    parser.add_argument('--hot-standby', action='store_true', help='run the client with a hot-standby connection per node')
+    parser.add_argument('--clock-sync', action='store_true', help='run the client in clock-synced local count mode')
+    parser.add_argument('--clock-lease', type=float, default=30.0, help='clock lease in seconds with --clock-sync (default: 30)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    # keep the per-count log lines of the service and client out of the report
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
@@ -0,0 +1,211 @@
+"""
+Load generator and latency benchmark for the counting service.
+
+Starts the real CountingServiceCapabilityImplementation behind the in-process broker stand-in
+(see local_broker.py) and drives it with M simulated clients. Each client sends every operation
+at its own fixed rate (open loop, so a slow service shows up as latency rather than as a lower
+request rate) and matches replies to requests by message ID.
+
+Example:
+    python benchmarks/bench_load.py --clients 20 --duration 30 --rate get_count=50 --json report.json
+
+Reports throughput and p50/p99/p999 latency per operation as a table, and optionally as JSON.
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from bench_stats import format_table, summarize, write_json
+from local_broker import LocalCluster, LocalConnection, LocalIntersectService, LocalMessage
+from repo_modules import load_service_module
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+SERVICE_TOPIC = 'intersect/resilience/clustering-demo/-/counting-service/request'
+
+# Requests per second per client, for each operation
+DEFAULT_RATES = {
+    'get_count': 20.0,
+    'status': 1.0,
+    'start_count': 0.1,
+    'stop_count': 0.1,
+}
+
+
+class LoadClient:
+    """One simulated client sending every operation at a fixed rate."""
+
+    def __init__(self, index: int, cluster: LocalCluster, rates: Dict[str, float]) -> None:
+        self.hierarchy = f'intersect.resilience.clustering-demo.load-{index}'
+        self.rates = {op: rate for op, rate in rates.items() if rate > 0}
+        self.connection = LocalConnection(cluster)
+        self.connection.subscribe(self.hierarchy.replace('.', '/') + '/response', self._on_reply)
+
+        self.sent: Dict[str, int] = {op: 0 for op in self.rates}
+        self.errors: Dict[str, int] = {op: 0 for op in self.rates}
+        self.latencies: Dict[str, List[float]] = {op: [] for op in self.rates}
+        self._pending: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def lost(self) -> Dict[str, int]:
+        """Requests which never got a reply, per operation."""
+        counts = {op: 0 for op in self.rates}
+        with self._lock:
+            for operation, _ in self._pending.values():
+                counts[operation] += 1
+        return counts
+
+    def run(self, stop_at: float) -> None:
+        """Send requests on schedule until stop_at (a time.monotonic() value)."""
+        self.connection.connect()
+        now = time.monotonic()
+        # random phase so clients don't all fire in lockstep
+        next_send = {op: now + random.random() / rate for op, rate in self.rates.items()}
+        while True:
+            operation, due = min(next_send.items(), key=lambda item: item[1])
+            if due >= stop_at:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            message = LocalMessage(
+                operation=f'CountingExample.{operation}',
+                source=self.hierarchy,
+                destination=SERVICE_DESTINATION,
+                payload=b'null',
+            )
+            with self._lock:
+                self._pending[message.message_id] = (operation, time.monotonic())
+            self.connection.publish(SERVICE_TOPIC, message)
+            self.sent[operation] += 1
+            next_send[operation] = due + 1.0 / self.rates[operation]
+
+    def _on_reply(self, topic: str, message: LocalMessage) -> None:
+        received = time.monotonic()
+        with self._lock:
+            pending = self._pending.pop(message.correlation_id, None)
+        if pending is None:
+            return
+        operation, sent_at = pending
+        self.latencies[operation].append(received - sent_at)
+        if message.has_error:
+            self.errors[operation] += 1
+
+
+def run_benchmark(clients: int, duration: float, rates: Dict[str, float], broker_latency: float, drain: float) -> dict:
+    """Run one load test and return the report as a dict (latencies in milliseconds)."""
+    counting_service = load_service_module()
+    cluster = LocalCluster(['rabbitmq1', 'rabbitmq2'], latency=broker_latency)
+    capability = counting_service.CountingServiceCapabilityImplementation()
+    service = LocalIntersectService([capability], SERVICE_DESTINATION, LocalConnection(cluster)).startup()
+
+    load_clients = [LoadClient(i, cluster, rates) for i in range(clients)]
+    started = time.monotonic()
+    stop_at = started + duration
+    threads = [threading.Thread(target=c.run, args=(stop_at,), daemon=True) for c in load_clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # give in-flight requests a chance to come back before counting them as lost
+    time.sleep(drain)
+    elapsed = time.monotonic() - started
+
+    operations = {}
+    all_latencies: List[float] = []
+    for operation in rates:
+        if rates[operation] <= 0:
+            continue
+        latencies = [l for c in load_clients for l in c.latencies[operation]]
+        all_latencies.extend(latencies)
+        summary = summarize([l * 1000.0 for l in latencies])
+        operations[operation] = {
+            'sent': sum(c.sent[operation] for c in load_clients),
+            'completed': len(latencies),
+            'errors': sum(c.errors[operation] for c in load_clients),
+            'lost': sum(c.lost()[operation] for c in load_clients),
+            'throughput': len(latencies) / duration,
+            'latency_ms': summary,
+        }
+    service.shutdown()
+
+    return {
+        'config': {
+            'clients': clients,
+            'duration': duration,
+            'rates': rates,
+            'broker_latency_ms': broker_latency * 1000.0,
+        },
+        'elapsed': elapsed,
+        'service_requests_handled': service.requests_handled,
+        'operations': operations,
+        'total': {
+            'throughput': len(all_latencies) / duration,
+            'latency_ms': summarize([l * 1000.0 for l in all_latencies]),
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    """Print the per-operation table."""
+    rows = []
+    for operation, result in list(report['operations'].items()) + [('TOTAL', report['total'])]:
+        latency = result['latency_ms']
+        rows.append({
+            'operation': operation,
+            'sent': result.get('sent'),
+            'ok': latency['count'],
+            'err': result.get('errors'),
+            'lost': result.get('lost'),
+            'req/s': result['throughput'],
+            'p50 ms': latency['p50'],
+            'p99 ms': latency['p99'],
+            'p999 ms': latency['p999'],
+            'max ms': latency['max'],
+        })
+    print(format_table(rows, ['operation', 'sent', 'ok', 'err', 'lost', 'req/s', 'p50 ms', 'p99 ms', 'p999 ms', 'max ms']))
+
+
+def parse_rates(values: List[str]) -> Dict[str, float]:
+    rates = dict(DEFAULT_RATES)
+    for value in values:
+        operation, _, rate = value.partition('=')
+        if operation not in DEFAULT_RATES:
+            raise argparse.ArgumentTypeError(f'unknown operation {operation}, expected one of {list(DEFAULT_RATES)}')
+        rates[operation] = float(rate)
+    return rates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10, help='number of simulated clients (default: 10)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to generate load for (default: 10)')
+    parser.add_argument(
+        '--rate',
+        action='append',
+        default=[],
+        metavar='OP=PER_SECOND',
+        help=f'per-client request rate of an operation, may be repeated (defaults: {DEFAULT_RATES})',
+    )
+    parser.add_argument('--broker-latency', type=float, default=0.0, help='one-way broker latency in ms (default: 0)')
+    parser.add_argument('--drain', type=float, default=1.0, help='seconds to wait for outstanding replies (default: 1)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    # the service logs every 10th count at INFO, keep the benchmark output readable
+    # (configured before the service module's own basicConfig call, which then does nothing)
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(
+        clients=args.clients,
+        duration=args.duration,
+        rates=parse_rates(args.rate),
+        broker_latency=args.broker_latency / 1000.0,
+        drain=args.drain,
+    )
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
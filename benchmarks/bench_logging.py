@@ -0,0 +1,119 @@
+"""
+Caller-side cost of logging, synchronous versus through clustering_common/log_pipeline.py.
+
+Logs from several threads as fast as they can, like request handlers under load, to a stream whose
+write() takes a fixed time, standing in for a container runtime reading stdout/stderr. Reports
+the latency of each logger.info call as seen by the caller, and how many records were written,
+rate limited or dropped because the queue was full.
+
+- sync: a plain StreamHandler, what logging.basicConfig sets up
+- queued: build_handler with rate limiting off, formatting and writing happen on the writer thread
+- limited: build_handler with the default rate limit and sampling
+
+Example:
+    python benchmarks/bench_logging.py --threads 4 --records 5000 --write-latency 0.2
+"""
+
+import argparse
+import io
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+from bench_stats import format_table, summarize, write_json
+import repo_modules  # noqa: F401, puts clustering_common on sys.path
+
+from clustering_common.log_pipeline import QUEUE_FULL, RATE_LIMITED, build_handler
+
+
+class SlowStream(io.TextIOBase):
+    """Discards text, taking latency seconds per write like a busy pipe."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        time.sleep(self.latency)
+        self.lines += text.count('\n')
+        return len(text)
+
+
+def run_trial(mode: str, threads: int, records: int, write_latency: float) -> Dict[str, Any]:
+    stream = SlowStream(write_latency)
+    listener = None
+    if mode == 'sync':
+        handler: logging.Handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    else:
+        handler, listener = build_handler(stream, rate=10.0 if mode == 'limited' else 0)
+    logger = logging.getLogger(f'bench_logging.{mode}')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+    rate_limited_before = RATE_LIMITED.value
+    queue_full_before = QUEUE_FULL.value
+    latencies: List[List[float]] = [[] for _ in range(threads)]
+
+    def log(samples: List[float]) -> None:
+        for i in range(records):
+            started = time.perf_counter()
+            logger.info("Client requested count: %d", i)
+            samples.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=log, args=(samples,)) for samples in latencies]
+    started = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+    if listener is not None:
+        listener.stop()
+    logger.removeHandler(handler)
+
+    stats = summarize([latency * 1e6 for samples in latencies for latency in samples])
+    return {
+        'mode': mode,
+        'records': threads * records,
+        'records_per_second': threads * records / elapsed,
+        'p50_us': stats['p50'],
+        'p99_us': stats['p99'],
+        'max_us': stats['max'],
+        'written': stream.lines,
+        'rate_limited': int(RATE_LIMITED.value - rate_limited_before),
+        'queue_full': int(QUEUE_FULL.value - queue_full_before),
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        'config': {
+            'threads': args.threads,
+            'records': args.records,
+            'write_latency_ms': args.write_latency,
+        },
+        'trials': [run_trial(mode, args.threads, args.records, args.write_latency / 1000.0) for mode in ('sync', 'queued', 'limited')],
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['trials'], [
+        'mode', 'records', 'records_per_second', 'p50_us', 'p99_us', 'max_us', 'written', 'rate_limited', 'queue_full',
+    ]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=4, help='logging threads (default: 4)')
+    parser.add_argument('--records', type=int, default=5000, help='records per thread (default: 5000)')
+    parser.add_argument('--write-latency', type=float, default=0.2, help='ms per write to the stream (default: 0.2)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
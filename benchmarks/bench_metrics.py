@@ -0,0 +1,130 @@
+"""
+Overhead benchmark for the metrics the service and client record (clustering_common/metrics.py).
+
+Two parts:
+
+- primitives: the cost of one Counter.inc, Histogram.observe, labels() lookup and TimedLock
+  acquire/release, against a plain threading.Lock
+- service: requests per second through the service's real request path (the same in-process
+  setup as bench_workers.py's single mode), with and without instrument_service
+
+Example:
+    python benchmarks/bench_metrics.py --requests 20000 --json metrics.json
+"""
+
+import argparse
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from bench_stats import format_table, write_json
+from bench_workers import QueueProvider, make_requests
+from repo_modules import load_service_module
+
+from clustering_common.metrics import FAST_BUCKETS, Registry, TimedLock
+
+
+def time_call(function: Callable[[], Any], iterations: int) -> float:
+    """Nanoseconds per call of function, loop overhead included."""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def bench_primitives(iterations: int) -> List[Dict[str, Any]]:
+    registry = Registry()
+    counter = registry.counter('bench_counter', 'bench')
+    histogram = registry.histogram('bench_histogram', 'bench', buckets=FAST_BUCKETS)
+    family = registry.counter('bench_labelled', 'bench', ['operation'])
+    family.labels('get_count')
+    plain_lock = threading.Lock()
+    timed_lock = TimedLock(registry.histogram('bench_lock_wait', 'bench', buckets=FAST_BUCKETS))
+
+    def plain_locked() -> None:
+        with plain_lock:
+            pass
+
+    def timed_locked() -> None:
+        with timed_lock:
+            pass
+
+    cases = [
+        ('noop', lambda: None),
+        ('Counter.inc', counter.inc),
+        ('Histogram.observe', lambda: histogram.observe(0.0003)),
+        ('labels() + inc', lambda: family.labels('get_count').inc()),
+        ('threading.Lock', plain_locked),
+        ('TimedLock', timed_locked),
+    ]
+    return [{'operation': name, 'ns_per_call': time_call(function, iterations)} for name, function in cases]
+
+
+def bench_service(raw_requests: List[bytes], instrumented: bool, repeats: int) -> Dict[str, Any]:
+    """Push every request through one in-process service, best of repeats."""
+    counting_service = load_service_module()
+    capability = counting_service.CountingServiceCapabilityImplementation()
+    service = counting_service.IntersectService([capability], counting_service.SERVICE_CONFIG)
+    if instrumented:
+        counting_service.instrument_service(service)
+    provider = QueueProvider(None)
+    provider.flush = lambda: None
+    service._control_plane_manager._control_providers = [provider]
+    service._control_plane_manager._ready = True
+
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for raw in raw_requests:
+            service._handle_service_message_raw(raw)
+        best = min(best, time.perf_counter() - started)
+    capability.state.counting = False
+    return {
+        'metrics': 'on' if instrumented else 'off',
+        'requests': len(raw_requests),
+        'errors': provider.errors,
+        'requests_per_second': len(raw_requests) / best,
+        'us_per_request': best / len(raw_requests) * 1e6,
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    raw_requests = make_requests(args.operation, args.requests)
+    service = [bench_service(raw_requests, instrumented, args.repeats) for instrumented in (False, True)]
+    service[1]['overhead_percent'] = 100.0 * (service[1]['us_per_request'] / service[0]['us_per_request'] - 1)
+    return {
+        'config': {
+            'operation': args.operation,
+            'requests': args.requests,
+            'repeats': args.repeats,
+            'iterations': args.iterations,
+        },
+        'primitives': bench_primitives(args.iterations),
+        'service': service,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['primitives'], ['operation', 'ns_per_call']))
+    print()
+    print(format_table(report['service'], ['metrics', 'requests', 'errors', 'requests_per_second', 'us_per_request', 'overhead_percent']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000, help='requests per service run (default: 20000)')
+    parser.add_argument('--repeats', type=int, default=3, help='service runs per setting, the fastest counts (default: 3)')
+    parser.add_argument('--iterations', type=int, default=1000000, help='calls per primitive (default: 1000000)')
+    parser.add_argument('--operation', choices=['get_count', 'get_count_tagged', 'get_clock'], default='get_count',
+                        help='operation to call (default: get_count)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    # the service logs every 10th count at INFO, keep the benchmark output readable
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
@@ -0,0 +1,257 @@
+"""
+Benchmark for phase-aligned polling (client/poll_scheduler.py) against the fixed poll timings.
+
+Runs N orchestrators against the real counting service on the in-process broker stand-in (see
+local_broker.py), with a one-way latency and random jitter on every message:
+
+- lifecycle/fixed: SampleOrchestrators whose get_count chain sleeps a second in the reply callback
+- lifecycle/aligned: SampleOrchestrators fired by one PollScheduler thread, each with a PhaseSchedule
+- asyncio/fixed: AsyncCountingOrchestrators polling every --interval seconds on a fixed schedule
+- asyncio/aligned: AsyncCountingOrchestrators fired by a PollScheduler on the event loop, their
+  schedules sharing one clock sync
+
+The service records when in its tick (seconds after the count ticked over) it read each get_count.
+After --warmup seconds the trial reports how often a count came back twice, how many counts the
+skip detector reported although the service never skipped one, get_count requests per new count,
+and the read phase.
+
+A second table times the PollScheduler alone, firing synthetic schedules from one heap.
+
+Example:
+    python benchmarks/bench_poll_schedule.py --orchestrators 1 50 --latency-ms 20 --jitter-ms 10
+"""
+
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from bench_stats import format_table, summarize, write_json
+from local_broker import LocalCluster, LocalConnection, LocalIntersectClient, LocalIntersectService
+from repo_modules import load_client_module, load_service_module
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+
+
+class Tally:
+    """Counts, repeated counts and reported skips of every orchestrator in a trial, after the warmup."""
+
+    def __init__(self, measure_from: float) -> None:
+        self.measure_from = measure_from
+        self.counts = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, orchestrator: Any) -> None:
+        record_count = orchestrator.record_count
+
+        def counting_record(count_value: int, rtt: Any = None, request_id: Any = None) -> None:
+            if time.monotonic() >= self.measure_from and orchestrator.last_count >= 0:
+                with self._lock:
+                    self.counts += 1
+                    if count_value == orchestrator.last_count:
+                        self.duplicates += 1
+                    elif count_value > orchestrator.last_count + 1:
+                        self.skipped += count_value - orchestrator.last_count - 1
+            record_count(count_value, rtt, request_id)
+
+        orchestrator.record_count = counting_record
+
+
+def run_lifecycle(cluster: LocalCluster, args: argparse.Namespace, aligned: bool, tally: Tally) -> Dict[str, Any]:
+    """SampleOrchestrators, one client and lifecycle thread each, and one PollScheduler if aligned."""
+    counting_client = load_client_module()
+    poll_scheduler = load_client_module('poll_scheduler')
+    clock_sync = load_client_module('clock_sync')
+    stop = threading.Event()
+    scheduler = poll_scheduler.PollScheduler().start() if aligned else None
+    clients = []
+    for _ in range(args.orchestrators):
+        schedule = None
+        if aligned:
+            schedule = poll_scheduler.PhaseSchedule(clock_sync.ClockSync(), interval=args.interval)
+        orchestrator = counting_client.SampleOrchestrator(schedule=schedule)
+        tally.wrap(orchestrator)
+        client = LocalIntersectClient(
+            LocalConnection(cluster),
+            user_callback=orchestrator.client_callback,
+            initial_messages=[orchestrator.start_count_message],
+        ).startup()
+        if scheduler is not None:
+            scheduler.add(schedule, lambda orchestrator=orchestrator, client=client: orchestrator.poll_due(client))
+
+        def lifecycle(orchestrator: Any = orchestrator, client: Any = client) -> None:
+            while not stop.wait(1.0):
+                orchestrator.waiting_callback(client)
+
+        threading.Thread(target=lifecycle, daemon=True).start()
+        clients.append(client)
+
+    time.sleep(args.duration)
+    stop.set()
+    if scheduler is not None:
+        scheduler.stop()
+    for client in clients:
+        client.shutdown()
+    return {'timer_heaps': 1 if aligned else 0}
+
+
+async def _run_asyncio(cluster: LocalCluster, args: argparse.Namespace, aligned: bool, tally: Tally) -> Dict[str, Any]:
+    async_runner = load_client_module('async_runner')
+    poll_scheduler = load_client_module('poll_scheduler')
+    clock_sync = load_client_module('clock_sync')
+    client = async_runner.AsyncIntersectClient(
+        lambda user_callback, event_callback: LocalIntersectClient(LocalConnection(cluster), user_callback=user_callback),
+        destination=SERVICE_DESTINATION,
+    )
+    await client.start()
+    scheduler = None
+    clock = None
+    if aligned:
+        scheduler = poll_scheduler.PollScheduler()
+        clock = clock_sync.ClockSync(request_ids=client.request_ids)
+    running = []
+    for i in range(args.orchestrators):
+        orchestrator = async_runner.AsyncCountingOrchestrator(
+            client,
+            name=f'client-{i}',
+            poll_interval=args.interval,
+            log_counts=False,
+            schedule=poll_scheduler.PhaseSchedule(clock, interval=args.interval) if aligned else None,
+            scheduler=scheduler,
+        )
+        tally.wrap(orchestrator)
+        running.append(orchestrator)
+    tasks = [asyncio.create_task(orchestrator.run()) for orchestrator in running]
+    if aligned:
+        tasks.append(asyncio.create_task(scheduler.run()))
+        tasks.append(asyncio.create_task(async_runner.sync_phase_clock(client, clock)))
+    await asyncio.sleep(args.duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await client.stop()
+    return {'timer_heaps': 1 if aligned else 0}
+
+
+def run_asyncio(cluster: LocalCluster, args: argparse.Namespace, aligned: bool, tally: Tally) -> Dict[str, Any]:
+    """AsyncCountingOrchestrators sharing one client, and one PollScheduler on the loop if aligned."""
+    return asyncio.run(_run_asyncio(cluster, args, aligned, tally))
+
+
+RUNNERS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    'lifecycle': run_lifecycle,
+    'asyncio': run_asyncio,
+}
+
+
+def run_trial(args: argparse.Namespace, runner: str, schedule: str) -> Dict[str, Any]:
+    counting_service = load_service_module()
+    cluster = LocalCluster(['rabbitmq1', 'rabbitmq2'], latency=args.latency_ms / 1000.0, jitter=args.jitter_ms / 1000.0)
+    capability = counting_service.CountingServiceCapabilityImplementation()
+    service = LocalIntersectService([capability], SERVICE_DESTINATION, LocalConnection(cluster)).startup()
+    measure_from = time.monotonic() + args.warmup
+    phases: List[float] = []
+    dispatch = service.dispatch
+
+    def timed_dispatch(operation: str, payload: bytes) -> bytes:
+        # how far into its tick the service is when it reads the count
+        if operation.startswith('CountingExample.get_count') and time.monotonic() >= measure_from:
+            phases.append((time.time() - capability.start_time) % 1.0)
+        return dispatch(operation, payload)
+
+    service.dispatch = timed_dispatch
+    tally = Tally(measure_from)
+    result = RUNNERS[runner](cluster, args, schedule == 'aligned', tally)
+    service.shutdown()
+    capability.state.counting = False
+
+    phase = summarize([p * 1000.0 for p in phases])
+    new_counts = tally.counts - tally.duplicates
+    return {
+        'runner': runner,
+        'schedule': schedule,
+        'orchestrators': args.orchestrators,
+        'counts': tally.counts,
+        'duplicates': tally.duplicates,
+        'false_skips': tally.skipped,
+        'polls_per_count': len(phases) / new_counts if new_counts else None,
+        'phase_p50_ms': phase['p50'],
+        'phase_p99_ms': phase['p99'],
+        'phase_min_ms': phase['min'],
+        'timer_heaps': result['timer_heaps'],
+    }
+
+
+def run_scheduler_overhead(schedules: int, seconds: float, interval: float) -> Dict[str, Any]:
+    """Fire `schedules` phase-aligned schedules from one heap through `seconds` of simulated time."""
+    poll_scheduler = load_client_module('poll_scheduler')
+    scheduler = poll_scheduler.PollScheduler()
+    start = time.monotonic()
+    for i in range(schedules):
+        schedule = poll_scheduler.PhaseSchedule(interval=interval)
+        # a reply with count 0, received now over a 10-30ms round trip, puts each schedule's boundaries at `start`
+        rtt = 0.01 + 0.02 * i / schedules
+        schedule.observe(start - rtt, start, 0)
+        scheduler.add(schedule, lambda: None, first=start)
+    now = start
+    cpu_started = time.process_time()
+    while now < start + seconds:
+        now = scheduler.run_due(now)
+    cpu = time.process_time() - cpu_started
+    return {
+        'schedules': schedules,
+        'fired': scheduler.fired,
+        'us_per_poll': cpu / scheduler.fired * 1e6,
+        'polls_per_cpu_s': scheduler.fired / cpu if cpu else None,
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    trials = []
+    for orchestrators in args.orchestrators:
+        for runner in args.runner or list(RUNNERS):
+            for schedule in ('fixed', 'aligned'):
+                trial_args = argparse.Namespace(**{**vars(args), 'orchestrators': orchestrators})
+                trials.append(run_trial(trial_args, runner, schedule))
+    return {
+        'config': vars(args),
+        'trials': trials,
+        'scheduler': [run_scheduler_overhead(n, args.simulated_seconds, args.interval) for n in args.heap_schedules],
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['trials'], [
+        'runner', 'schedule', 'orchestrators', 'counts', 'duplicates', 'false_skips', 'polls_per_count',
+        'phase_p50_ms', 'phase_p99_ms', 'phase_min_ms', 'timer_heaps',
+    ]))
+    print()
+    print(format_table(report['scheduler'], ['schedules', 'fired', 'us_per_poll', 'polls_per_cpu_s']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orchestrators', type=int, nargs='+', default=[1, 50], help='orchestrator counts to try (default: 1 50)')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds per trial (default: 30)')
+    parser.add_argument('--warmup', type=float, default=5.0, help='seconds at the start of a trial left out of the results (default: 5)')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls (default: 1)')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='one-way broker latency in ms (default: 20)')
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help='random extra one-way latency in ms, up to (default: 10)')
+    parser.add_argument('--runner', choices=sorted(RUNNERS), action='append', help='only run these runners (default: both)')
+    parser.add_argument('--heap-schedules', type=int, nargs='+', default=[100, 10000], help='schedule counts for the scheduler table (default: 100 10000)')
+    parser.add_argument('--simulated-seconds', type=float, default=60.0, help='simulated seconds the scheduler table runs for (default: 60)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    # every orchestrator logs each count at INFO, keep the benchmark output readable
+    # (configured before the client module's own basicConfig call, which then does nothing)
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
@@ -0,0 +1,176 @@
+"""
+Benchmark of the scatter-gather client (client/scatter_gather.py).
+
+Runs N counting services under different hierarchy names on the in-process broker stand-in (see
+local_broker.py), some of them slowed down by a fixed delay per request, and gathers
+get_count_tagged from all of them through one AsyncIntersectClient, one gather after the other:
+
+- with a per-service deadline, a slow service is reported as missing once its deadline passes
+- without one, every gather waits for the slowest service
+
+For each it reports the time a gather takes, how many services answered, and the replies which
+arrived after their deadline.
+
+A second table checks the hash ring the keyed requests are routed by: how evenly keys spread over
+the services (the busiest and the quietest service's share relative to an even split), the
+fraction of keys which move to another service when one is added, and what looking a key up costs.
+hash(key) % N is shown for comparison.
+
+Example:
+    python benchmarks/bench_scatter_gather.py --services 8 --slow 1 --slow-ms 300 --deadline-ms 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from bench_metrics import time_call
+from bench_stats import format_table, summarize, write_json
+from local_broker import LocalCluster, LocalConnection, LocalIntersectClient, LocalIntersectService
+from repo_modules import load_client_module, load_service_module
+
+
+def start_services(cluster: LocalCluster, destinations: List[str], slow: int, slow_delay: float) -> List[Any]:
+    """One service per destination, the first slow ones sleep slow_delay in every request."""
+    counting_service = load_service_module()
+    services = []
+    for index, destination in enumerate(destinations):
+        capability = counting_service.CountingServiceCapabilityImplementation()
+        service = LocalIntersectService([capability], destination, LocalConnection(cluster))
+        if index < slow:
+            dispatch = service.dispatch
+
+            def slow_dispatch(operation, payload, dispatch=dispatch):
+                time.sleep(slow_delay)
+                return dispatch(operation, payload)
+
+            service.dispatch = slow_dispatch
+        services.append((service.startup(), capability))
+    return services
+
+
+async def _run_gathers(cluster: LocalCluster, destinations: List[str], deadline: Optional[float], gathers: int) -> Dict[str, Any]:
+    async_runner = load_client_module('async_runner')
+    scatter_gather = load_client_module('scatter_gather')
+    client = async_runner.AsyncIntersectClient(
+        lambda user_callback, event_callback: LocalIntersectClient(LocalConnection(cluster), user_callback=user_callback),
+        destination=destinations[0],
+    )
+    scatter = scatter_gather.ScatterGatherClient(client, destinations, deadline=deadline)
+    await client.start()
+    try:
+        await scatter.gather('CountingExample.start_count')
+        elapsed, answered = [], []
+        for _ in range(gathers):
+            request_id = next(client.request_ids)
+            result = await scatter.gather('CountingExample.get_count_tagged', request_id, request_id=request_id)
+            elapsed.append(result.elapsed)
+            answered.append(len(result.replies))
+        # replies to requests which gave up at their deadline
+        await asyncio.sleep(0.1)
+        return {'elapsed': elapsed, 'answered': answered, 'late_replies': client.late_replies}
+    finally:
+        await client.stop()
+
+
+def run_trial(args: argparse.Namespace, deadline: Optional[float]) -> Dict[str, Any]:
+    scatter_gather = load_client_module('scatter_gather')
+    destinations = scatter_gather.expand_destinations(f'counting-service-{{1..{args.services}}}')
+    cluster = LocalCluster(['rabbitmq1', 'rabbitmq2'], latency=args.broker_latency / 1000.0)
+    services = start_services(cluster, destinations, args.slow, args.slow_ms / 1000.0)
+    try:
+        result = asyncio.run(_run_gathers(cluster, destinations, deadline, args.gathers))
+    finally:
+        for service, capability in services:
+            service.shutdown()
+            capability.stop_count()
+    stats = summarize([seconds * 1000 for seconds in result['elapsed']])
+    return {
+        'deadline_ms': deadline * 1000 if deadline is not None else None,
+        'services': args.services,
+        'slow': args.slow,
+        'gathers': args.gathers,
+        'gather_p50_ms': stats['p50'],
+        'gather_p99_ms': stats['p99'],
+        'gather_max_ms': stats['max'],
+        'answered_mean': sum(result['answered']) / len(result['answered']),
+        'complete_percent': 100.0 * sum(1 for n in result['answered'] if n == args.services) / len(result['answered']),
+        'late_replies': result['late_replies'],
+    }
+
+
+def _modulo(key: str, nodes: List[str]) -> str:
+    return nodes[int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big') % len(nodes)]
+
+
+def run_ring(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    scatter_gather = load_client_module('scatter_gather')
+    nodes = scatter_gather.expand_destinations(f'counting-service-{{1..{args.services}}}')
+    added = nodes + scatter_gather.expand_destinations(f'counting-service-{args.services + 1}')
+    keys = [f'key-{i}' for i in range(args.keys)]
+    ring = scatter_gather.HashRing(nodes, args.replicas)
+    grown = scatter_gather.HashRing(added, args.replicas)
+
+    rows = []
+    for name, before, after in (
+        ('hash ring', ring.node_for, grown.node_for),
+        ('modulo', lambda key: _modulo(key, nodes), lambda key: _modulo(key, added)),
+    ):
+        owners = [before(key) for key in keys]
+        shares = [owners.count(node) / (len(keys) / len(nodes)) for node in nodes]
+        moved = sum(1 for key, owner in zip(keys, owners) if after(key) != owner)
+        rows.append({
+            'routing': name,
+            'services': len(nodes),
+            'keys': len(keys),
+            'max_share': max(shares),
+            'min_share': min(shares),
+            'moved_on_add_percent': 100.0 * moved / len(keys),
+            'ideal_moved_percent': 100.0 / len(added),
+            'lookup_ns': time_call(lambda: before('key-42'), args.iterations),
+        })
+    return rows
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    return {
+        'config': vars(args),
+        'gathers': [run_trial(args, args.deadline_ms / 1000.0), run_trial(args, None)],
+        'ring': run_ring(args),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['gathers'], [
+        'deadline_ms', 'services', 'slow', 'gathers', 'gather_p50_ms', 'gather_p99_ms', 'gather_max_ms',
+        'answered_mean', 'complete_percent', 'late_replies',
+    ]))
+    print()
+    print(format_table(report['ring'], [
+        'routing', 'services', 'keys', 'max_share', 'min_share', 'moved_on_add_percent', 'ideal_moved_percent', 'lookup_ns',
+    ]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--services', type=int, default=8, help='counting services (default: 8)')
+    parser.add_argument('--slow', type=int, default=1, help='services which answer slowly (default: 1)')
+    parser.add_argument('--slow-ms', type=float, default=300.0, help='delay per request of a slow service in ms (default: 300)')
+    parser.add_argument('--deadline-ms', type=float, default=50.0, help='per-service deadline in ms (default: 50)')
+    parser.add_argument('--gathers', type=int, default=30, help='gathers per trial (default: 30)')
+    parser.add_argument('--broker-latency', type=float, default=0.0, help='one-way broker latency in ms (default: 0)')
+    parser.add_argument('--keys', type=int, default=100000, help='keys routed for the hash ring table (default: 100000)')
+    parser.add_argument('--replicas', type=int, default=100, help='hash ring points per service (default: 100)')
+    parser.add_argument('--iterations', type=int, default=100000, help='lookups timed per routing (default: 100000)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
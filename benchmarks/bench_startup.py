@@ -0,0 +1,88 @@
+"""
+Service startup time with the schema generated at startup and with the precomputed schema
+(service/schema_cache.py).
+
+Every run is a fresh Python process, so nothing Pydantic or the SDK caches carries over. A run
+imports counting_service and constructs the service the way counting_service.py does, either
+generating the schema (SCHEMA_CACHE=0) or loading the checked-in artifact (SCHEMA_CACHE=1). It
+reports:
+
+- import_ms: importing counting_service, which imports the SDK, Pydantic and the capability
+- construct_ms: the IntersectService constructor, which is what the schema cache replaces
+- total_ms: both, i.e. everything up to connecting to a broker
+
+Example:
+    python benchmarks/bench_startup.py --runs 10 --multi-counter
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+from bench_stats import format_table, summarize, write_json
+from repo_modules import REPO_ROOT, SERVICE_DIR
+
+RUN = '''
+import json, logging, time
+started = time.perf_counter()
+import counting_service
+imported = time.perf_counter()
+logging.disable(logging.CRITICAL)
+multi_counter = {multi_counter}
+capabilities = [capability_type() for capability_type in counting_service.capability_types(multi_counter)]
+with counting_service.schema_source(multi_counter):
+    counting_service.IntersectService(capabilities, counting_service.SERVICE_CONFIG)
+constructed = time.perf_counter()
+for capability in capabilities:
+    if hasattr(capability, 'stop_count'):
+        capability.stop_count()
+print(json.dumps({{'import_ms': (imported - started) * 1000, 'construct_ms': (constructed - imported) * 1000}}))
+'''
+
+
+def run_once(cached: bool, multi_counter: bool) -> Dict[str, float]:
+    environment = dict(os.environ, SCHEMA_CACHE='1' if cached else '0', PYTHONPATH=REPO_ROOT)
+    result = subprocess.run(
+        [sys.executable, '-c', RUN.format(multi_counter=multi_counter)],
+        cwd=SERVICE_DIR, env=environment, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    rows: List[Dict[str, Any]] = []
+    for cached in (False, True):
+        # an unmeasured run per mode warms the OS file cache, so the first measured run isn't an outlier
+        run_once(cached, args.multi_counter)
+        samples = [run_once(cached, args.multi_counter) for _ in range(args.runs)]
+        row: Dict[str, Any] = {'schema': 'cached' if cached else 'generated', 'runs': args.runs}
+        for key in ('import_ms', 'construct_ms'):
+            stats = summarize([sample[key] for sample in samples])
+            row[f'{key[:-3]}_p50_ms'] = stats['p50']
+            row[f'{key[:-3]}_min_ms'] = stats['min']
+        row['total_p50_ms'] = summarize([sample['import_ms'] + sample['construct_ms'] for sample in samples])['p50']
+        rows.append(row)
+    rows[1]['construct_speedup'] = rows[0]['construct_p50_ms'] / rows[1]['construct_p50_ms']
+    return {'config': {'runs': args.runs, 'multi_counter': args.multi_counter}, 'startup': rows}
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['startup'], [
+        'schema', 'runs', 'import_p50_ms', 'import_min_ms', 'construct_p50_ms', 'construct_min_ms', 'total_p50_ms', 'construct_speedup',
+    ]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes per mode (default: 10)')
+    parser.add_argument('--multi-counter', action='store_true', help='also host the MultiCounter capability')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
@@ -0,0 +1,59 @@
+"""
+Summary statistics and report formatting shared by the benchmark scripts.
+"""
+
+import json
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted sequence, q in [0, 1]."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(values: Sequence[float]) -> Dict[str, Any]:
+    """Return count, mean, min, max and p50/p99/p999 of a list of samples."""
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) if ordered else None,
+        'min': ordered[0] if ordered else None,
+        'p50': percentile(ordered, 0.50),
+        'p99': percentile(ordered, 0.99),
+        'p999': percentile(ordered, 0.999),
+        'max': ordered[-1] if ordered else None,
+    }
+
+
+def format_table(rows: List[Dict[str, Any]], columns: List[str]) -> str:
+    """Render a list of dicts as a fixed-width text table. Floats are shown with 3 decimals."""
+
+    def cell(value: Any) -> str:
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return f'{value:.3f}'
+        return str(value)
+
+    cells = [[cell(row.get(column)) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(r[i]) for r in cells]) for i, column in enumerate(columns)]
+    lines = [
+        '  '.join(column.rjust(width) for column, width in zip(columns, widths)),
+        '  '.join('-' * width for width in widths),
+    ]
+    lines.extend('  '.join(value.rjust(width) for value, width in zip(r, widths)) for r in cells)
+    return '\n'.join(lines)
+
+
+def write_json(path: str, report: Dict[str, Any]) -> None:
+    """Write a report as indented JSON, '-' writes to stdout."""
+    text = json.dumps(report, indent=2)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
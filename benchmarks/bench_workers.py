@@ -0,0 +1,209 @@
+"""
+Throughput benchmark for the counting service's SERVICE_WORKERS mode.
+
+Pushes a fixed number of requests through the real SDK request path of the service (message
+deserialization and validation, the capability call, response serialization) and reports replies
+per second for:
+
+- single: one process with a plain IntersectService, as counting_service.py runs by default
+- workers: K processes with a WorkerIntersectService each, sharing one SharedCounterState
+
+The broker is replaced by two multiprocessing queues: one request queue all workers take from,
+like the shared AMQP request queue, and one reply queue. Messages travel in batches so the queues
+themselves don't dominate. Worker mode can only beat single-process mode on a machine with more
+than one core.
+
+Example:
+    python benchmarks/bench_workers.py --workers 1 2 4 --requests 50000 --json workers.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from bench_stats import format_table, write_json
+from repo_modules import load_service_module
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+CLIENT_SOURCE = 'intersect.resilience.clustering-demo.-.bench-client'
+
+# Request payload for each operation the benchmark can send
+PAYLOADS: Dict[str, Any] = {
+    'get_count': None,
+    'get_count_tagged': 7,
+    'get_clock': 7,
+    'get_snapshot': [],
+}
+
+
+class QueueProvider:
+    """Stands in for the broker connection: collects reply messages and hands them over in batches."""
+
+    def __init__(self, replies: Any) -> None:
+        self.replies = replies
+        self.sent = 0
+        self.errors = 0
+
+    def is_connected(self) -> bool:
+        return True
+
+    def considered_unrecoverable(self) -> bool:
+        return False
+
+    def publish(self, topic: str, payload: bytes, persist: bool) -> None:
+        # status and lifecycle messages aren't replies
+        if not topic.endswith('/response'):
+            return
+        self.sent += 1
+        if b'"has_error":true' in payload:
+            self.errors += 1
+
+    def flush(self) -> None:
+        self.replies.put((self.sent, self.errors))
+        self.sent = 0
+        self.errors = 0
+
+
+def bench_worker(mode: str, index: int, shared_name: Optional[str], lock: Any, requests: Any, replies: Any, ready: Any) -> None:
+    """One service process: build the service like counting_service.py does and drain the request queue."""
+    logging.basicConfig(level=logging.WARNING)
+    counting_service = load_service_module()
+    capability = counting_service.CountingServiceCapabilityImplementation()
+    if mode == 'single':
+        service = counting_service.IntersectService([capability], counting_service.SERVICE_CONFIG)
+    else:
+        shared = counting_service.SharedCounterState.attach(shared_name, lock)
+        service = counting_service.WorkerIntersectService(
+            capability, counting_service.SERVICE_CONFIG, shared, publishes_events=index == 0,
+        )
+    provider = QueueProvider(replies)
+    # what startup() would leave behind, minus the broker connection
+    service._control_plane_manager._control_providers = [provider]
+    service._control_plane_manager._ready = True
+    ready.set()
+
+    while True:
+        batch = requests.get()
+        if batch is None:
+            return
+        for raw in batch:
+            service._handle_service_message_raw(raw)
+        provider.flush()
+
+
+def make_requests(operation: str, count: int) -> List[bytes]:
+    """Serialized request messages, exactly as a client would publish them."""
+    from intersect_sdk import IntersectDataHandler, IntersectMimeType
+    from intersect_sdk._internal.control_plane.control_plane_manager import serialize_message
+    from intersect_sdk._internal.messages.userspace import create_userspace_message
+
+    payload = json.dumps(PAYLOADS[operation])
+    return [
+        serialize_message(create_userspace_message(
+            source=CLIENT_SOURCE,
+            destination=SERVICE_DESTINATION,
+            operation_id=f'CountingExample.{operation}',
+            content_type=IntersectMimeType.JSON,
+            data_handler=IntersectDataHandler.MESSAGE,
+            payload=payload,
+            message_id=uuid.uuid4(),
+        ))
+        for _ in range(count)
+    ]
+
+
+def run_trial(mode: str, workers: int, raw_requests: List[bytes], batch_size: int) -> Dict[str, Any]:
+    """Start the processes, push every request through them and time it."""
+    context = multiprocessing.get_context('spawn')
+    requests = context.Queue()
+    replies = context.Queue()
+    shared = None
+    if mode == 'workers':
+        counting_service = load_service_module()
+        shared = counting_service.SharedCounterState.create(context, time.time(), counting=True)
+
+    processes = []
+    for index in range(workers):
+        ready = context.Event()
+        process = context.Process(
+            target=bench_worker,
+            args=(mode, index, shared.name if shared else None, shared.lock if shared else None, requests, replies, ready),
+            daemon=True,
+        )
+        process.start()
+        processes.append((process, ready))
+    for _, ready in processes:
+        ready.wait(60)
+
+    started = time.monotonic()
+    for i in range(0, len(raw_requests), batch_size):
+        requests.put(raw_requests[i:i + batch_size])
+    for _ in processes:
+        requests.put(None)
+    received = 0
+    errors = 0
+    while received < len(raw_requests):
+        sent, failed = replies.get(timeout=60)
+        received += sent
+        errors += failed
+    elapsed = time.monotonic() - started
+
+    for process, _ in processes:
+        process.join(10)
+    if shared is not None:
+        shared.close()
+    return {
+        'mode': mode,
+        'workers': workers,
+        'requests': len(raw_requests),
+        'errors': errors,
+        'seconds': elapsed,
+        'replies_per_second': received / elapsed,
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    raw_requests = make_requests(args.operation, args.requests)
+    trials: List[Dict[str, Any]] = [run_trial('single', 1, raw_requests, args.batch)]
+    baseline = trials[0]['replies_per_second']
+    for workers in args.workers:
+        trials.append(run_trial('workers', workers, raw_requests, args.batch))
+    for trial in trials:
+        trial['speedup'] = trial['replies_per_second'] / baseline
+    return {
+        'config': {
+            'operation': args.operation,
+            'requests': args.requests,
+            'batch': args.batch,
+            'cpus': os.cpu_count(),
+        },
+        'trials': trials,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['trials'], ['mode', 'workers', 'requests', 'errors', 'seconds', 'replies_per_second', 'speedup']))
+    print(f"\n{report['config']['cpus']} CPU(s) available")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker counts to try (default: 1 2 4)')
+    parser.add_argument('--requests', type=int, default=20000, help='requests per trial (default: 20000)')
+    parser.add_argument('--operation', choices=sorted(PAYLOADS), default='get_count', help='operation to call (default: get_count)')
+    parser.add_argument('--batch', type=int, default=100, help='requests per queue item (default: 100)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    # the service logs every 10th count at INFO, keep the benchmark output readable
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
@@ -0,0 +1,457 @@
+"""
+In-process stand-in for the RabbitMQ cluster, used by the benchmarks.
+
+The real demo needs the docker-compose stack with two RabbitMQ nodes. For benchmarking we only
+need something which behaves like it from the point of view of the counting service and client:
+
+- LocalCluster: topic routing shared by every node (like queues in a RabbitMQ cluster), with
+  nodes which can be killed and restored, and an optional one-way network latency and jitter.
+- LocalConnection: a broker session pinned to one node at a time. Deliveries run on the
+  connection's own thread (like the paho/pika network threads), and when its node dies the
+  connection drops and reconnects to the next live node in its list after a delay.
+- LocalIntersectService / LocalIntersectClient: minimal versions of IntersectService and
+  IntersectClient which host the real capability and orchestrator classes over a LocalConnection.
+
+Messages are serialized to JSON with the same Pydantic type adapters the SDK uses, so encode and
+decode costs are in the measured path. Nothing here talks to a real broker.
+"""
+
+import inspect
+import itertools
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import typing
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import TypeAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerUnavailable(Exception):
+    """Raised when no node of the cluster accepts a connection."""
+
+
+@dataclass
+class LocalMessage:
+    """What travels over the stand-in broker. Mirrors the fields of an INTERSECT userspace message."""
+
+    operation: str
+    source: str
+    destination: str
+    payload: bytes
+    has_error: bool = False
+    message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    correlation_id: Optional[str] = None
+    """
+    message_id of the request this message replies to. The real SDK does not expose this to
+    callbacks, the benchmarks' own load clients use it to measure per-request latency.
+    """
+    event_name: Optional[str] = None
+
+
+class LocalBrokerNode:
+    """One node of the stand-in cluster."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.alive = True
+
+
+class LocalCluster:
+    """A set of broker nodes sharing one routing table.
+
+    Like a RabbitMQ cluster, a message published through any live node reaches subscribers
+    connected to any other live node. Messages to subscribers which are currently disconnected
+    are lost, as with the SDK's non-persistent client queues.
+    """
+
+    def __init__(self, node_names: List[str], latency: float = 0.0, jitter: float = 0.0) -> None:
+        """Create the cluster.
+
+        Params:
+          node_names: names of the nodes, e.g. ['rabbitmq1', 'rabbitmq2']
+          latency: one-way delivery delay in seconds added to every message
+          jitter: up to this many seconds more are added to each message's delay, at random.
+            A connection still delivers in order, like a TCP stream.
+        """
+        self.nodes = {name: LocalBrokerNode(name) for name in node_names}
+        self.latency = latency
+        self.jitter = jitter
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+        self._subscriptions: Dict[str, List['LocalConnection']] = {}
+        self._connections: List['LocalConnection'] = []
+        self._lock = threading.Lock()
+
+    def kill(self, name: str) -> None:
+        """Stop a node, like ``docker-compose stop rabbitmq1``. Its connections drop immediately."""
+        self.nodes[name].alive = False
+        with self._lock:
+            connections = [c for c in self._connections if c.node == name]
+        for connection in connections:
+            connection._on_node_lost()
+
+    def restore(self, name: str) -> None:
+        """Bring a killed node back. Existing connections stay where they are."""
+        self.nodes[name].alive = True
+
+    def connection_count(self) -> int:
+        """Return the number of currently connected sessions across all nodes."""
+        with self._lock:
+            return sum(1 for c in self._connections if c.connected)
+
+    def _attach(self, connection: 'LocalConnection') -> None:
+        with self._lock:
+            if connection not in self._connections:
+                self._connections.append(connection)
+
+    def _detach(self, connection: 'LocalConnection') -> None:
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+            for subscribers in self._subscriptions.values():
+                if connection in subscribers:
+                    subscribers.remove(connection)
+
+    def _subscribe(self, connection: 'LocalConnection', topic: str) -> None:
+        with self._lock:
+            subscribers = self._subscriptions.setdefault(topic, [])
+            if connection not in subscribers:
+                subscribers.append(connection)
+
+    def _unsubscribe(self, connection: 'LocalConnection', topic: str) -> None:
+        with self._lock:
+            subscribers = self._subscriptions.get(topic, [])
+            if connection in subscribers:
+                subscribers.remove(connection)
+
+    def _route(self, topic: str, message: LocalMessage) -> None:
+        due = time.monotonic() + self.latency + (random.uniform(0.0, self.jitter) if self.jitter else 0.0)
+        with self._lock:
+            self.published += 1
+            subscribers = list(self._subscriptions.get(topic, ()))
+        for subscriber in subscribers:
+            if subscriber._enqueue(due, topic, message):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+
+
+class LocalConnection:
+    """A broker session which fails over between the nodes of a LocalCluster.
+
+    This plays the part of the SDK's MQTT/AMQP broker clients: it keeps its subscriptions across
+    reconnects, and after its node dies it retries the configured nodes in order.
+    """
+
+    def __init__(
+        self,
+        cluster: LocalCluster,
+        node_order: Optional[List[str]] = None,
+        reconnect_delay: float = 1.0,
+        auto_reconnect: bool = True,
+    ) -> None:
+        """Create a connection, call connect() to open it.
+
+        Params:
+          cluster: the cluster to connect to
+          node_order: nodes to try, in order (default: every node in the cluster)
+          reconnect_delay: seconds to wait before reconnecting after the node was lost
+          auto_reconnect: if False, a lost node leaves the connection closed
+        """
+        self.cluster = cluster
+        self.node_order = list(node_order or cluster.nodes)
+        self.reconnect_delay = reconnect_delay
+        self.auto_reconnect = auto_reconnect
+
+        self.node: Optional[str] = None
+        self.connected = False
+        self.connect_attempts = 0
+        self.disconnects = 0
+        self.on_reconnect: Optional[Callable[['LocalConnection'], None]] = None
+
+        self._handlers: Dict[str, Callable[[str, LocalMessage], None]] = {}
+        self._deliveries: 'queue.Queue[Any]' = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._deliver_loop, daemon=True, name='local_broker_delivery')
+        self._thread.start()
+
+    def connect(self) -> str:
+        """Attach to the first live node in node_order.
+
+        Returns:
+            The name of the node connected to
+
+        Raises:
+            BrokerUnavailable: if every node is down
+        """
+        for name in self.node_order:
+            self.connect_attempts += 1
+            if self.cluster.nodes[name].alive:
+                self.node = name
+                self.connected = True
+                self._closed = False
+                self.cluster._attach(self)
+                for topic in self._handlers:
+                    self.cluster._subscribe(self, topic)
+                return name
+        raise BrokerUnavailable(f'no live node among {self.node_order}')
+
+    def close(self) -> None:
+        """Disconnect for good, e.g. on client.shutdown()."""
+        self._closed = True
+        self.connected = False
+        self.cluster._detach(self)
+
+    def subscribe(self, topic: str, handler: Callable[[str, LocalMessage], None]) -> None:
+        """Register a handler for a topic. Subscriptions survive reconnects."""
+        self._handlers[topic] = handler
+        if self.connected:
+            self.cluster._subscribe(self, topic)
+
+    def unsubscribe(self, topic: str) -> None:
+        """Remove a subscription."""
+        self._handlers.pop(topic, None)
+        self.cluster._unsubscribe(self, topic)
+
+    def publish(self, topic: str, message: LocalMessage) -> bool:
+        """Publish a message through our node.
+
+        Returns:
+            False if the message was lost because we are not connected
+        """
+        if not self.connected or not self.cluster.nodes[self.node].alive:
+            return False
+        self.cluster._route(topic, message)
+        return True
+
+    def _enqueue(self, due: float, topic: str, message: LocalMessage) -> bool:
+        if not self.connected:
+            return False
+        self._deliveries.put((due, topic, message))
+        return True
+
+    def _deliver_loop(self) -> None:
+        while True:
+            due, topic, message = self._deliveries.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            handler = self._handlers.get(topic)
+            if handler is not None and self.connected:
+                try:
+                    handler(topic, message)
+                except Exception:
+                    logger.exception('Handler for %s raised', topic)
+
+    def _on_node_lost(self) -> None:
+        self.connected = False
+        self.disconnects += 1
+        self.cluster._detach(self)
+        if self.auto_reconnect and not self._closed:
+            threading.Thread(target=self._reconnect_loop, daemon=True, name='local_broker_reconnect').start()
+
+    def _reconnect_loop(self) -> None:
+        while not self._closed and not self.connected:
+            time.sleep(self.reconnect_delay)
+            if self._closed:
+                return
+            try:
+                self.connect()
+            except BrokerUnavailable:
+                continue
+            if self.on_reconnect is not None:
+                self.on_reconnect(self)
+
+
+def _topic(destination: str, channel: str) -> str:
+    return f'{destination.replace(".", "/")}/{channel}'
+
+
+class _Operation:
+    """A capability function plus the type adapters needed to call it from JSON."""
+
+    def __init__(self, capability: Any, method_name: str) -> None:
+        self.method = getattr(capability, method_name)
+        hints = typing.get_type_hints(self.method)
+        params = [p for p in inspect.signature(self.method).parameters.values()]
+        self.request_adapter: Optional[TypeAdapter] = None
+        if params:
+            self.request_adapter = TypeAdapter(hints[params[0].name])
+        self.response_adapter = TypeAdapter(hints.get('return', Any))
+
+    def __call__(self, payload: bytes) -> bytes:
+        if self.request_adapter is None:
+            response = self.method()
+        else:
+            response = self.method(self.request_adapter.validate_json(payload))
+        return self.response_adapter.dump_json(response, by_alias=True)
+
+
+class LocalIntersectService:
+    """Hosts capabilities on a LocalConnection, answering requests like IntersectService does."""
+
+    def __init__(self, capabilities: List[Any], hierarchy: str, connection: LocalConnection) -> None:
+        """Create the service.
+
+        Params:
+          capabilities: capability instances (IntersectBaseCapabilityImplementation subclasses)
+          hierarchy: the service's destination, e.g. 'intersect.resilience.clustering-demo.-.counting-service'
+          connection: where to receive requests and send replies
+        """
+        self.hierarchy = hierarchy
+        self.connection = connection
+        self.requests_handled = 0
+        self.errors = 0
+
+        self._capabilities = {c.intersect_sdk_capability_name: c for c in capabilities}
+        self._operations: Dict[str, _Operation] = {}
+        self._event_adapters: Dict[type, TypeAdapter] = {}
+        for capability in capabilities:
+            capability._intersect_sdk_register_observer(self)
+
+    def startup(self) -> 'LocalIntersectService':
+        self.connection.subscribe(_topic(self.hierarchy, 'request'), self._handle_request)
+        self.connection.connect()
+        return self
+
+    def shutdown(self, reason: Optional[str] = None) -> 'LocalIntersectService':
+        self.connection.close()
+        return self
+
+    def is_connected(self) -> bool:
+        return self.connection.connected
+
+    def considered_unrecoverable(self) -> bool:
+        return False
+
+    def dispatch(self, operation: str, payload: bytes) -> bytes:
+        """Call an operation ('Capability.function') with a JSON payload and return the JSON reply."""
+        fn = self._operations.get(operation)
+        if fn is None:
+            capability_name, _, method_name = operation.partition('.')
+            capability = self._capabilities.get(capability_name)
+            if capability is None or not hasattr(capability, method_name):
+                raise KeyError(f'unknown operation {operation}')
+            fn = self._operations[operation] = _Operation(capability, method_name)
+        return fn(payload)
+
+    def _handle_request(self, topic: str, message: LocalMessage) -> None:
+        try:
+            payload = self.dispatch(message.operation, message.payload)
+            has_error = False
+        except Exception as e:  # the SDK also turns any capability error into an error reply
+            payload = json.dumps(str(e)).encode()
+            has_error = True
+            self.errors += 1
+        self.requests_handled += 1
+        reply = LocalMessage(
+            operation=message.operation,
+            source=self.hierarchy,
+            destination=message.source,
+            payload=payload,
+            has_error=has_error,
+            correlation_id=message.message_id,
+        )
+        self.connection.publish(_topic(message.source, 'response'), reply)
+
+    def _on_observe_event(self, event_name: str, event_value: Any, operation: str) -> None:
+        adapter = self._event_adapters.get(type(event_value))
+        if adapter is None:
+            adapter = self._event_adapters[type(event_value)] = TypeAdapter(type(event_value))
+        event = LocalMessage(
+            operation=operation,
+            source=self.hierarchy,
+            destination=self.hierarchy,
+            payload=adapter.dump_json(event_value),
+            event_name=event_name,
+        )
+        self.connection.publish(_topic(self.hierarchy, 'events'), event)
+
+
+class LocalIntersectClient:
+    """The parts of IntersectClient the demo's orchestrators use, over a LocalConnection.
+
+    Supports startup(), shutdown(), is_connected(), considered_unrecoverable() and the private
+    _send_userspace_message() which counting_client.py calls directly.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        connection: LocalConnection,
+        user_callback: Optional[Callable[..., Any]] = None,
+        event_callback: Optional[Callable[..., Any]] = None,
+        initial_messages: Optional[List[Any]] = None,
+        subscribe_to_events: Optional[List[str]] = None,
+        resend_initial_messages: bool = False,
+        system: str = 'intersect.resilience.clustering-demo',
+    ) -> None:
+        self.connection = connection
+        self.hierarchy = f'{system}.tmp-{next(self._ids)}'
+        self._user_callback = user_callback
+        self._event_callback = event_callback
+        self._initial_messages = list(initial_messages or [])
+        self._subscribe_to_events = list(subscribe_to_events or [])
+        self._resend_initial_messages = resend_initial_messages
+        self._sent_initial_messages = False
+
+    def startup(self) -> 'LocalIntersectClient':
+        if self._user_callback is not None:
+            self.connection.subscribe(_topic(self.hierarchy, 'response'), self._handle_response)
+        if self._event_callback is not None:
+            for service in self._subscribe_to_events:
+                self.connection.subscribe(_topic(service, 'events'), self._handle_event)
+        self.connection.connect()
+        if not self._sent_initial_messages or self._resend_initial_messages:
+            self._sent_initial_messages = True
+            for message in self._initial_messages:
+                self._send_userspace_message(message)
+        return self
+
+    def shutdown(self, reason: Optional[str] = None) -> 'LocalIntersectClient':
+        self.connection.close()
+        return self
+
+    def is_connected(self) -> bool:
+        return self.connection.connected
+
+    def considered_unrecoverable(self) -> bool:
+        return False
+
+    def _send_userspace_message(self, params: Any) -> bool:
+        message = LocalMessage(
+            operation=params.operation,
+            source=self.hierarchy,
+            destination=params.destination,
+            payload=json.dumps(params.payload).encode(),
+        )
+        return self.connection.publish(_topic(params.destination, 'request'), message)
+
+    def _handle_response(self, topic: str, message: LocalMessage) -> None:
+        result = self._user_callback(
+            message.source, message.operation, message.has_error, json.loads(message.payload)
+        )
+        self._handle_client_callback(result)
+
+    def _handle_event(self, topic: str, message: LocalMessage) -> None:
+        result = self._event_callback(
+            message.source, message.operation, message.event_name, json.loads(message.payload)
+        )
+        self._handle_client_callback(result)
+
+    def _handle_client_callback(self, result: Any) -> None:
+        if result is None:
+            return
+        for message in result.messages_to_send:
+            self._send_userspace_message(message)
@@ -0,0 +1,43 @@
+"""
+Import the demo's service and client scripts from the benchmarks.
+
+Both scripts do ``import config`` and ``import config_amqp`` and expect to find their own
+directory's versions, so the two directories can't simply both be on sys.path. The repository root
+is, so the benchmarks can import clustering_common like the scripts do.
+"""
+
+import importlib
+import os
+import sys
+from types import ModuleType
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIR = os.path.join(REPO_ROOT, 'service')
+CLIENT_DIR = os.path.join(REPO_ROOT, 'client')
+
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
+_CONFIG_MODULES = ('config', 'config_amqp')
+
+
+def _load(directory: str, name: str) -> ModuleType:
+    saved = {key: sys.modules.pop(key) for key in _CONFIG_MODULES if key in sys.modules}
+    sys.path.insert(0, directory)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(directory)
+        for key in _CONFIG_MODULES:
+            sys.modules.pop(key, None)
+        sys.modules.update(saved)
+
+
+def load_service_module(name: str = 'counting_service') -> ModuleType:
+    """Import a module from service/, e.g. counting_service."""
+    return _load(SERVICE_DIR, name)
+
+
+def load_client_module(name: str = 'counting_client') -> ModuleType:
+    """Import a module from client/, e.g. counting_client."""
+    return _load(CLIENT_DIR, name)
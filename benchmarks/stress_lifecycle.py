@@ -0,0 +1,183 @@
+"""
+Concurrency stress test for the counting capability's start_count, stop_count and reset_count.
+
+Several threads call random transitions and reads on one capability as fast as they can, like
+request handlers with many clients sending at once. count_tick events are captured instead of
+published. A checker thread and the final state look for what a lost update or a leaked counter
+thread would leave behind:
+
+- transitions: every transition reports the counting flag before and after it (reset_count
+  returns the state before it, start_count/stop_count say whether they changed anything). If they
+  happened one at a time, the number of off -> on transitions minus the on -> off ones is the
+  final flag minus the initial one.
+- threads: stop_count and reset_count join the thread they stopped, so no more than one counter
+  thread can be alive, plus one for each of those transitions still in progress.
+- final state: once the callers are done, a counter thread is alive exactly if the counter is on.
+- latency: stop_count and reset_count wake the counter thread rather than wait for its second to
+  run out, so they must stay well below a second.
+
+Exits with status 1 if a check fails.
+
+Example:
+    python benchmarks/stress_lifecycle.py --threads 16 --duration 10
+"""
+
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+from bench_stats import format_table, summarize, write_json
+from repo_modules import load_service_module
+
+OPERATIONS = ('start_count', 'stop_count', 'reset_count', 'reset_count_stopped', 'get_count', 'get_snapshot')
+
+
+def counter_threads() -> int:
+    return sum(1 for thread in threading.enumerate() if thread.name == 'counter_thread' and thread.is_alive())
+
+
+class Stress:
+    """Drives one capability from many threads and records what it answered."""
+
+    def __init__(self, capability: Any, duration: float, seed: int) -> None:
+        self.capability = capability
+        self.duration = duration
+        self.seed = seed
+        self.ticks = 0
+        self.violations: List[str] = []
+        self.latencies: Dict[str, List[float]] = {operation: [] for operation in OPERATIONS}
+        self.transitions: Counter = Counter()
+        self._lock = threading.Lock()
+        # stop/reset calls started and finished, for the thread count check
+        self._stopping_started = 0
+        self._stopping_finished = 0
+        self._done = threading.Event()
+        capability.intersect_sdk_emit_event = self._on_event
+
+    def _on_event(self, name: str, _payload: Any) -> None:
+        if name == 'count_tick':
+            with self._lock:
+                self.ticks += 1
+
+    def call(self, operation: str) -> Tuple[bool, bool]:
+        """Run one operation, returns the counting flag (before, after) for transitions."""
+        capability = self.capability
+        if operation == 'start_count':
+            response = capability.start_count()
+            return (not response.success, True)
+        if operation == 'stop_count':
+            response = capability.stop_count()
+            return (response.success, False)
+        if operation == 'reset_count':
+            return (capability.reset_count(True).counting, True)
+        if operation == 'reset_count_stopped':
+            return (capability.reset_count(False).counting, False)
+        if operation == 'get_count':
+            capability.get_count()
+        else:
+            capability.get_snapshot([])
+        return (False, False)
+
+    def caller(self, index: int) -> None:
+        rng = random.Random(self.seed + index)
+        latencies: Dict[str, List[float]] = {operation: [] for operation in OPERATIONS}
+        transitions: Counter = Counter()
+        stopping = ('stop_count', 'reset_count', 'reset_count_stopped')
+        while not self._done.is_set():
+            operation = rng.choice(OPERATIONS)
+            if operation in stopping:
+                with self._lock:
+                    self._stopping_started += 1
+            started = time.perf_counter()
+            before, after = self.call(operation)
+            latencies[operation].append(time.perf_counter() - started)
+            if operation in stopping:
+                with self._lock:
+                    self._stopping_finished += 1
+            if operation not in ('get_count', 'get_snapshot') and before != after:
+                transitions['on' if after else 'off'] += 1
+        with self._lock:
+            for operation, samples in latencies.items():
+                self.latencies[operation].extend(samples)
+            self.transitions.update(transitions)
+
+    def checker(self) -> None:
+        while not self._done.wait(0.001):
+            with self._lock:
+                finished = self._stopping_finished
+            alive = counter_threads()
+            with self._lock:
+                in_progress = self._stopping_started - finished
+            if alive > 1 + in_progress:
+                self.violations.append(f'{alive} counter threads alive with {in_progress} stop/reset calls in progress')
+
+    def run(self, threads: int) -> Dict[str, Any]:
+        initial = self.capability.state.counting
+        workers = [threading.Thread(target=self.caller, args=(i,)) for i in range(threads)]
+        workers.append(threading.Thread(target=self.checker))
+        for worker in workers:
+            worker.start()
+        time.sleep(self.duration)
+        self._done.set()
+        for worker in workers:
+            worker.join()
+
+        final = self.capability.state.counting
+        if self.transitions['on'] - self.transitions['off'] != int(final) - int(initial):
+            self.violations.append(
+                f"{self.transitions['on']} off->on and {self.transitions['off']} on->off transitions "
+                f"can't take the counter from {initial} to {final}"
+            )
+        if counter_threads() != int(final):
+            self.violations.append(f'{counter_threads()} counter threads alive with counting={final}')
+
+        rows = []
+        for operation in OPERATIONS:
+            stats = summarize([latency * 1000 for latency in self.latencies[operation]])
+            rows.append({'operation': operation, 'calls': stats['count'], 'p50_ms': stats['p50'], 'p99_ms': stats['p99'], 'max_ms': stats['max']})
+        return {
+            'config': {'threads': threads, 'duration': self.duration, 'seed': self.seed},
+            'operations': rows,
+            'transitions': dict(self.transitions),
+            'ticks': self.ticks,
+            'violations': self.violations[:20],
+            'violation_count': len(self.violations),
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(format_table(report['operations'], ['operation', 'calls', 'p50_ms', 'p99_ms', 'max_ms']))
+    print(f"\n{report['transitions'].get('on', 0)} off->on, {report['transitions'].get('off', 0)} on->off, {report['ticks']} count_tick events")
+    if report['violation_count']:
+        print(f"\n{report['violation_count']} violation(s):")
+        for violation in report['violations']:
+            print(f'  {violation}')
+    else:
+        print('\nNo violations')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16, help='calling threads (default: 16)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run (default: 10)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the choice of operations (default: 1)')
+    parser.add_argument('--max-latency', type=float, default=100.0, help='slowest stop/reset allowed, in ms (default: 100)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    counting_service = load_service_module()
+    result = Stress(counting_service.CountingServiceCapabilityImplementation(), args.duration, args.seed).run(args.threads)
+    for row in result['operations']:
+        if row['operation'] in ('stop_count', 'reset_count', 'reset_count_stopped') and row['max_ms'] is not None and row['max_ms'] > args.max_latency:
+            result['violations'].append(f"{row['operation']} took {row['max_ms']:.1f}ms")
+            result['violation_count'] += 1
+    print_report(result)
+    if args.json:
+        write_json(args.json, result)
+    sys.exit(1 if result['violation_count'] else 0)
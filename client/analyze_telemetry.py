@@ -0,0 +1,244 @@
+"""
+Offline analysis of the telemetry files the client writes (see telemetry.py).
+
+Memory-maps each file and walks its records in chunks, so a soak run of any length is analyzed
+in constant memory:
+
+- latency: percentiles of the request round trip, from a log-scale histogram with 1% wide
+  buckets (so the percentiles are accurate to about 1%)
+- gaps: every point where an orchestrator's count jumped by more than one, and skipped counts
+  per minute
+- failover windows: every silence longer than --gap-seconds between two counts of the same
+  orchestrator, with the broker before and after and whether the client reconnected
+
+Needs nothing beyond the standard library, so it runs on the host against client/output:
+
+    python client/analyze_telemetry.py client/output
+    python client/analyze_telemetry.py client/output/telemetry-20250101-120000-1-0000.bin --json report.json
+"""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from telemetry import FLAG_EVENT, FLAG_LOCAL, FLAG_RECONNECTED, FLAG_TIMEOUT, HEADER, MAGIC, RECORD, UNKNOWN_BROKER, telemetry_files
+
+# records unpacked per step, bounds the memory used for decoded tuples
+CHUNK_RECORDS = 65536
+
+# latency histogram resolution
+_LOG_BASE = math.log(1.01)
+
+Record = Tuple[float, float, int, float, int, int, int]
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """Yield (sent_at, received_at, count, client_elapsed, broker, flags, orchestrator) for every record in a file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= HEADER.size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, record_size, _ = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f'{path} is not a telemetry file this analyzer can read (version {version})')
+            view = memoryview(mapped)
+            try:
+                # a file still being written may end in the middle of a record
+                end = HEADER.size + (len(mapped) - HEADER.size) // RECORD.size * RECORD.size
+                chunk_bytes = CHUNK_RECORDS * RECORD.size
+                for offset in range(HEADER.size, end, chunk_bytes):
+                    yield from RECORD.iter_unpack(view[offset:min(offset + chunk_bytes, end)])
+            finally:
+                view.release()
+
+
+class LatencyHistogram:
+    """Counts latencies into log-scale buckets 1% apart, from which percentiles are read."""
+
+    def __init__(self) -> None:
+        self.buckets: Counter = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        # bucket 0 holds everything up to a microsecond
+        self.buckets[max(0, math.ceil(math.log(max(seconds, 1e-6) / 1e-6) / _LOG_BASE))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                # the bucket's upper bound, never more than the largest value seen
+                return min(1e-6 * math.exp(bucket * _LOG_BASE), self.max)
+        return self.max
+
+
+class _Orchestrator:
+    __slots__ = ('last_count', 'last_received', 'last_broker')
+
+    def __init__(self) -> None:
+        self.last_count = -1
+        self.last_received = 0.0
+        self.last_broker = UNKNOWN_BROKER
+
+
+def analyze(paths: List[str], gap_seconds: float, max_listed: int) -> Dict[str, Any]:
+    """Walk every record of the files, in order, and summarize them."""
+    latency = LatencyHistogram()
+    kinds: Counter = Counter()
+    skipped_per_minute: Counter = Counter()
+    gaps: List[Dict[str, Any]] = []
+    windows: List[Dict[str, Any]] = []
+    orchestrators: Dict[int, _Orchestrator] = {}
+    totals = {'records': 0, 'skipped': 0, 'gaps': 0, 'windows': 0}
+    first = last = None
+
+    for path in paths:
+        for sent_at, received_at, count, _, broker, flags, orchestrator in read_records(path):
+            totals['records'] += 1
+            first = received_at if first is None else min(first, received_at)
+            last = received_at if last is None else max(last, received_at)
+            if flags & FLAG_TIMEOUT:
+                kinds['timeout'] += 1
+                continue
+            kinds['event' if flags & FLAG_EVENT else 'local' if flags & FLAG_LOCAL else 'reply'] += 1
+            if sent_at:
+                latency.add(received_at - sent_at)
+
+            state = orchestrators.get(orchestrator)
+            if state is None:
+                state = orchestrators[orchestrator] = _Orchestrator()
+            if state.last_received and (received_at - state.last_received > gap_seconds or flags & FLAG_RECONNECTED):
+                totals['windows'] += 1
+                if len(windows) < max_listed:
+                    windows.append({
+                        'orchestrator': orchestrator,
+                        'start': state.last_received,
+                        'end': received_at,
+                        'seconds': received_at - state.last_received,
+                        'broker_before': state.last_broker,
+                        'broker_after': broker,
+                        'reconnected': bool(flags & FLAG_RECONNECTED),
+                    })
+            if state.last_count >= 0 and count > state.last_count + 1:
+                skipped = count - state.last_count - 1
+                totals['skipped'] += skipped
+                totals['gaps'] += 1
+                skipped_per_minute[int(received_at // 60) * 60] += skipped
+                if len(gaps) < max_listed:
+                    gaps.append({'orchestrator': orchestrator, 'time': received_at, 'from': state.last_count, 'to': count, 'skipped': skipped})
+            state.last_count = max(state.last_count, count)
+            state.last_received = received_at
+            state.last_broker = broker
+
+    return {
+        'files': len(paths),
+        'records': totals['records'],
+        'first': first,
+        'last': last,
+        'orchestrators': len(orchestrators),
+        'kinds': dict(kinds),
+        'latency': {
+            'count': latency.count,
+            'mean': latency.total / latency.count if latency.count else None,
+            'p50': latency.percentile(0.50),
+            'p90': latency.percentile(0.90),
+            'p99': latency.percentile(0.99),
+            'p999': latency.percentile(0.999),
+            'max': latency.max if latency.count else None,
+        },
+        'skipped': totals['skipped'],
+        'gaps': totals['gaps'],
+        'gap_list': gaps,
+        'skipped_per_minute': sorted(skipped_per_minute.items()),
+        'failover_windows': totals['windows'],
+        'window_list': windows,
+    }
+
+
+def _time(value: float) -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(value)) + f'.{int(value % 1 * 1000):03d}Z'
+
+
+def _ms(value: Optional[float]) -> str:
+    return '-' if value is None else f'{value * 1000:.1f}ms'
+
+
+def _broker(index: int) -> str:
+    return '?' if index == UNKNOWN_BROKER else str(index)
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    if not report['records']:
+        print(f"No records in {report['files']} file(s)")
+        return
+    print(f"{report['records']} records from {report['orchestrators']} orchestrator(s) in {report['files']} file(s), "
+          f"{_time(report['first'])} to {_time(report['last'])}")
+    print('  ' + ', '.join(f'{n} {kind}' for kind, n in sorted(report['kinds'].items())))
+
+    latency = report['latency']
+    print(f"\nRound trip ({latency['count']} requests): mean {_ms(latency['mean'])}, p50 {_ms(latency['p50'])}, "
+          f"p90 {_ms(latency['p90'])}, p99 {_ms(latency['p99'])}, p99.9 {_ms(latency['p999'])}, max {_ms(latency['max'])}")
+
+    print(f"\nSkipped {report['skipped']} count(s) in {report['gaps']} gap(s)")
+    for gap in report['gap_list']:
+        print(f"  {_time(gap['time'])}  orchestrator {gap['orchestrator']}: {gap['from']} -> {gap['to']} ({gap['skipped']} skipped)")
+    if report['gaps'] > len(report['gap_list']):
+        print(f"  ... {report['gaps'] - len(report['gap_list'])} more")
+    if report['skipped_per_minute']:
+        print('  skipped per minute:')
+        for minute, skipped in report['skipped_per_minute']:
+            print(f"    {_time(minute)[:16]}  {skipped}")
+
+    print(f"\n{report['failover_windows']} failover window(s)")
+    for window in report['window_list']:
+        print(f"  {_time(window['start'])}  orchestrator {window['orchestrator']}: {window['seconds']:.2f}s without counts, "
+              f"broker {_broker(window['broker_before'])} -> {_broker(window['broker_after'])}"
+              f"{', reconnected' if window['reconnected'] else ''}")
+    if report['failover_windows'] > len(report['window_list']):
+        print(f"  ... {report['failover_windows'] - len(report['window_list'])} more")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output')],
+                        help='telemetry files or directories holding them (default: client/output)')
+    parser.add_argument('--gap-seconds', type=float, default=2.5, help='silence which counts as a failover window (default: 2.5)')
+    parser.add_argument('--max-listed', type=int, default=50, help='gaps and windows to list individually (default: 50)')
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    files: List[str] = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(telemetry_files(path))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            sys.exit(f"{path} does not exist")
+    if not files:
+        sys.exit(f"No telemetry files in {', '.join(args.paths)}")
+
+    result = analyze(files, args.gap_seconds, args.max_listed)
+    print_report(result)
+    if args.json:
+        text = json.dumps(result, indent=2)
+        if args.json == '-':
+            print(text)
+        else:
+            with open(args.json, 'w') as f:
+                f.write(text + '\n')
@@ -0,0 +1,593 @@
+"""
+asyncio runner for the counting client.
+
+Under default_intersect_lifecycle_loop, SampleOrchestrator works through the SDK's callback model.
+Each reply callback returns the next message to send, the get_count chain sleeps a second inside
+the callback (holding up the broker's delivery thread), and the loop's waiting_callback restarts
+chains by sending directly. Every orchestrator needs its own client and its own blocked thread.
+
+Here AsyncIntersectClient wraps the SDK client and turns every request into an awaitable:
+
+    reply = await client.request('CountingExample.get_count_tagged', request_id, request_id=request_id)
+
+SDK callbacks only hand replies and events over to the event loop (loop.call_soon_threadsafe) and
+return at once. AsyncCountingOrchestrator polls from a task which sleeps until the next deadline,
+every request is its own task with its own timeout, and reconnecting is a coroutine which runs the
+SDK's blocking shutdown/startup in a worker thread. Any number of orchestrators can share one
+client and its broker connection, so one process can drive hundreds of them.
+"""
+
+import asyncio
+import itertools
+import logging
+import math
+import signal
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from intersect_sdk import INTERSECT_JSON_VALUE, IntersectClientCallback, IntersectDirectMessageParams
+
+from client_metrics import COUNTS, FAILOVERS, RECONNECTS, RECOVERY_SECONDS, ROUND_TRIP_SECONDS, SKIPPED, TIMEOUTS
+from clock_sync import ClockSync
+from hot_standby_client import HotStandbyClient
+from poll_scheduler import PhaseSchedule, PollScheduler
+from sdk_adapter import send_message
+from telemetry import FLAG_EVENT, FLAG_LOCAL, FLAG_RECONNECTED, FLAG_TIMEOUT, TelemetryRecorder
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+
+
+class ReplyError(Exception):
+    """The service answered a request with an error reply."""
+
+
+class RequestLost(Exception):
+    """The connection was restarted or switched while the request was in flight, it may never be answered."""
+
+
+class AsyncIntersectClient:
+    """Runs an IntersectClient (or HotStandbyClient) from asyncio, with replies delivered to awaiting requests.
+
+    Replies are matched to requests per service and operation, a service's replies carry its
+    hierarchy as their source. If the reply payload carries a request_id (as get_count_tagged and
+    get_clock replies do), it goes to the request which sent that ID, and a reply for a request
+    which already gave up is dropped. Any other reply, including an error reply, goes to the
+    oldest request for that service and operation.
+
+    Only call methods from the event loop's thread.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[..., Any],
+        destination: str = SERVICE_DESTINATION,
+        reconnect_after: float = 5.0,
+        check_interval: float = 0.25,
+    ) -> None:
+        """Create the SDK client, call start() from within the event loop to connect it.
+
+        Params:
+          client_factory: builds the SDK client from (user_callback, event_callback), e.g. an
+            IntersectClient or HotStandbyClient constructor with the config already filled in
+          destination: the service requests go to unless request() is given another one
+          reconnect_after: seconds requests may go unanswered before the client is restarted
+          check_interval: seconds between connection checks
+        """
+        self.destination = destination
+        self.reconnect_after = reconnect_after
+        self.check_interval = check_interval
+        self.client = client_factory(self._on_reply, self._on_event)
+
+        # correlation IDs for tagged requests, shared by everything sending through this client
+        self.request_ids = itertools.count(1)
+        self.last_message_time = 0.0
+        self.reconnections = 0
+        self.late_replies = 0
+        # outages that ended with a message arriving, lets orchestrators flag their first count after one
+        self.recoveries = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[Tuple[str, str], 'OrderedDict[Any, asyncio.Future]'] = {}
+        self._waiting_since = 0.0
+        # when messages stopped arriving before the last reconnect or switch, 0 once they arrive again
+        self._outage_started = 0.0
+        self._event_listeners: List[Callable[[str, INTERSECT_JSON_VALUE], None]] = []
+        # created in start(), before Python 3.10 a Lock binds to the loop current at construction
+        self._reconnect_lock: Optional[asyncio.Lock] = None
+        self._watchdog: Optional[asyncio.Task] = None
+
+    async def start(self) -> 'AsyncIntersectClient':
+        """Connect and start watching the connection."""
+        self._loop = asyncio.get_running_loop()
+        self._reconnect_lock = asyncio.Lock()
+        await asyncio.to_thread(self.client.startup)
+        self.last_message_time = time.time()
+        self._watchdog = asyncio.create_task(self._watch())
+        return self
+
+    async def stop(self, reason: Optional[str] = None) -> None:
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        self._fail_pending(RequestLost('client stopped'))
+        await asyncio.to_thread(self.client.shutdown, reason)
+
+    def add_event_listener(self, listener: Callable[[str, INTERSECT_JSON_VALUE], None]) -> None:
+        """Call listener(event_name, payload) on the event loop for every event the client receives."""
+        self._event_listeners.append(listener)
+
+    async def request(
+        self,
+        operation: str,
+        payload: INTERSECT_JSON_VALUE = None,
+        timeout: Optional[float] = None,
+        request_id: Optional[int] = None,
+        destination: Optional[str] = None,
+    ) -> INTERSECT_JSON_VALUE:
+        """Send a request and wait for its reply.
+
+        Params:
+          operation: 'Capability.function'
+          payload: the request payload
+          timeout: seconds to wait, None waits until the reply arrives or the connection is restarted
+          request_id: the correlation ID the reply will carry, see the class docstring
+          destination: the service to ask, the client's destination if None
+
+        Returns:
+            The reply payload
+
+        Raises:
+          ReplyError: the service sent an error reply
+          RequestLost: the connection was restarted before the reply arrived
+          asyncio.TimeoutError: no reply within timeout
+        """
+        destination = destination or self.destination
+        pending = self._pending.setdefault((destination, operation), OrderedDict())
+        key = request_id if request_id is not None else object()
+        future = self._loop.create_future()
+        if not self.pending_count():
+            self._waiting_since = time.time()
+        pending[key] = future
+        sent_at = time.perf_counter()
+        try:
+            send_message(self.client, IntersectDirectMessageParams(destination=destination, operation=operation, payload=payload))
+            reply = await asyncio.wait_for(future, timeout)
+            ROUND_TRIP_SECONDS.labels(operation).observe(time.perf_counter() - sent_at)
+            return reply
+        finally:
+            if pending.get(key) is future:
+                del pending[key]
+
+    def pending_count(self) -> int:
+        """Number of requests waiting for a reply."""
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def reconnect(self) -> None:
+        """Restart the SDK client so it connects to the next broker which answers.
+
+        Requests in flight fail with RequestLost. Concurrent calls reconnect once.
+        """
+        if self._reconnect_lock.locked():
+            async with self._reconnect_lock:
+                return
+        async with self._reconnect_lock:
+            self.reconnections += 1
+            RECONNECTS.inc()
+            self._outage_started = self._outage_started or self.last_message_time
+            self._fail_pending(RequestLost('reconnecting'))
+            await asyncio.to_thread(self.client.shutdown, 'no replies')
+            await asyncio.sleep(1.0)
+            await asyncio.to_thread(self.client.startup)
+            self.last_message_time = time.time()
+
+    async def _watch(self) -> None:
+        """Switch to a hot standby or reconnect when replies stop arriving."""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                # silence only matters while we are waiting for something
+                now = time.time()
+                last_heard = max(self.last_message_time, self._waiting_since) if self.pending_count() else now
+                if isinstance(self.client, HotStandbyClient):
+                    if await asyncio.to_thread(self.client.check_heartbeat, last_heard):
+                        # the waiting requests went out on the old connection, their senders resend
+                        FAILOVERS.inc()
+                        self._outage_started = self._outage_started or last_heard
+                        self.last_message_time = time.time()
+                        self._fail_pending(RequestLost('switched to a hot standby'))
+                        continue
+                quiet = now - last_heard
+                if quiet > self.reconnect_after:
+                    logger.warning(f"No replies for {quiet:.1f} seconds, reconnecting...")
+                    await self.reconnect()
+            except Exception as e:
+                logger.error(f"Error during reconnection: {e}")
+
+    def _fail_pending(self, error: Exception) -> None:
+        for pending in self._pending.values():
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            pending.clear()
+
+    def _on_reply(
+        self, source: str, operation: str, has_error: bool, payload: INTERSECT_JSON_VALUE
+    ) -> Optional[IntersectClientCallback]:
+        """SDK user_callback, runs on the broker's thread."""
+        self._loop.call_soon_threadsafe(self._resolve, source, operation, has_error, payload)
+        return None
+
+    def _on_event(
+        self, source: str, operation: str, event_name: str, payload: INTERSECT_JSON_VALUE
+    ) -> Optional[IntersectClientCallback]:
+        """SDK event_callback, runs on the broker's thread."""
+        self._loop.call_soon_threadsafe(self._dispatch_event, event_name, payload)
+        return None
+
+    def _message_received(self) -> None:
+        now = time.time()
+        if self._outage_started:
+            RECOVERY_SECONDS.observe(now - self._outage_started)
+            self._outage_started = 0.0
+            self.recoveries += 1
+        self.last_message_time = now
+
+    def _resolve(self, source: str, operation: str, has_error: bool, payload: INTERSECT_JSON_VALUE) -> None:
+        self._message_received()
+        pending = self._pending.get((source, operation))
+        if not pending:
+            self.late_replies += 1
+            return
+        if not has_error and isinstance(payload, dict) and 'request_id' in payload:
+            future = pending.pop(payload['request_id'], None)
+            if future is None:
+                self.late_replies += 1
+                return
+        else:
+            _, future = pending.popitem(last=False)
+        if future.done():
+            return
+        if has_error:
+            future.set_exception(ReplyError(payload))
+        else:
+            future.set_result(payload)
+
+    def _dispatch_event(self, event_name: str, payload: INTERSECT_JSON_VALUE) -> None:
+        self._message_received()
+        for listener in self._event_listeners:
+            try:
+                listener(event_name, payload)
+            except Exception as e:
+                logger.error(f"Error in event listener: {e}")
+
+
+class AsyncCountingOrchestrator:
+    """Starts the counter and follows its count, like SampleOrchestrator but as coroutines.
+
+    Polling sends a tagged get_count every poll_interval seconds on a fixed schedule. Each request
+    runs as its own task with its own timeout, so several can be in flight and a lost reply costs
+    one sample (the pipelined mode of SampleOrchestrator, without a window to manage). With a
+    PollScheduler the requests go out just after the service's count ticks over instead, see
+    poll_scheduler.py.
+
+    In tick mode it only polls while count_tick events have stopped arriving. In clock mode it
+    syncs with get_clock and then computes the count locally, waking just after each count boundary.
+    """
+
+    def __init__(
+        self,
+        client: AsyncIntersectClient,
+        name: str = 'client',
+        poll_interval: float = 1.0,
+        timeout: float = 3.0,
+        tick_events: bool = False,
+        tick_timeout: float = 2.5,
+        clock: Optional[ClockSync] = None,
+        log_counts: bool = True,
+        telemetry: Optional[TelemetryRecorder] = None,
+        index: int = 0,
+        schedule: Optional[PhaseSchedule] = None,
+        scheduler: Optional[PollScheduler] = None,
+    ) -> None:
+        """Create an orchestrator, run() does the work.
+
+        Params:
+          client: the shared client to send through
+          name: prefix for log lines, to tell orchestrators apart
+          poll_interval: seconds between get_count requests
+          timeout: seconds before a request is given up on
+          tick_events: if True, rely on count_tick events (the client must be subscribed) and only poll as a fallback
+          tick_timeout: seconds without a count_tick before falling back to polling
+          clock: if set, compute the count locally from a clock lease instead of polling. Build it
+            with request_ids=client.request_ids.
+          log_counts: log every count, turn off when running many orchestrators
+          telemetry: if set, write a record for every count and timeout
+          index: tells this orchestrator's telemetry records apart from the others'
+          schedule: with scheduler, when to poll. Its ClockSync may be shared by orchestrators polling
+            the same service, run_orchestrators() keeps it synced.
+          scheduler: if set, polls are fired from this timer heap, phase-aligned by schedule
+        """
+        self.client = client
+        self.name = name
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.tick_events = tick_events
+        self.tick_timeout = tick_timeout
+        self.clock = clock
+        self.log_counts = log_counts
+        self.telemetry = telemetry
+        self.index = index
+        self.schedule = schedule
+        self.scheduler = scheduler
+        self._recoveries_seen = client.recoveries
+
+        self.start_time: Optional[float] = None
+        self.last_count = -1
+        # request_id of the poll last_count came from, see record_count
+        self.last_request_id = 0
+        self.last_tick_time = 0.0
+        self.polling_fallback = False
+        self.counts = 0
+        self.skipped = 0
+        self.timeouts = 0
+
+        self._tasks = set()
+        if tick_events:
+            client.add_event_listener(self.on_event)
+
+    async def run(self) -> None:
+        await self.start_counter()
+        if self.clock is not None and await self.sync_clock():
+            await self.follow_clock()
+        else:
+            await self.poll()
+
+    async def start_counter(self) -> None:
+        """Send start_count until it is answered."""
+        while True:
+            try:
+                reply = await self.client.request('CountingExample.start_count', timeout=self.timeout)
+                break
+            except (asyncio.TimeoutError, RequestLost):
+                logger.warning(f"[{self.name}] start_count went unanswered, retrying")
+            except ReplyError as e:
+                logger.error(f"[{self.name}] start_count failed ({e}), retrying")
+                await asyncio.sleep(self.poll_interval)
+        self.start_time = time.time()
+        self.last_tick_time = self.start_time
+        if reply.get('success') is False:
+            logger.info(f"[{self.name}] Counter was already running. That's fine!")
+        else:
+            logger.info(f"[{self.name}] Successfully started the counter.")
+
+    def polling_needed(self) -> bool:
+        """Return True if we should poll get_count, False while count_tick events cover us."""
+        if not self.tick_events:
+            return True
+        if time.time() - self.last_tick_time > self.tick_timeout:
+            if not self.polling_fallback:
+                logger.warning(f"[{self.name}] No count_tick for more than {self.tick_timeout}s, falling back to polling")
+                self.polling_fallback = True
+        return self.polling_fallback
+
+    def on_event(self, event_name: str, payload: INTERSECT_JSON_VALUE) -> None:
+        if event_name != 'count_tick':
+            return
+        self.last_tick_time = time.time()
+        if self.polling_fallback:
+            logger.info(f"[{self.name}] Count ticks resumed, stopping fallback polling")
+            self.polling_fallback = False
+        if self.clock is not None:
+            if not self.clock.check_tick(payload):
+                logger.warning(f"[{self.name}] count_tick disagrees with the clock lease (service restarted?), syncing again")
+                self.clock.invalidate()
+            return
+        if self.start_time is not None:
+            self.record_count(payload['count'])
+            self.record_telemetry(payload['count'], FLAG_EVENT)
+
+    async def poll(self) -> None:
+        """Send a get_count every poll_interval, on a fixed schedule which doesn't drift with reply times.
+
+        With a scheduler, the scheduler fires the polls instead, until this is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        if self.scheduler is not None:
+            self.scheduler.add(self.schedule, self.fire_poll)
+            try:
+                await loop.create_future()
+            finally:
+                self.scheduler.remove(self.schedule)
+        next_at = loop.time()
+        while True:
+            self.fire_poll()
+            next_at += self.poll_interval
+            now = loop.time()
+            if next_at < now:
+                # we fell behind (e.g. during a reconnect), skip the missed slots instead of bursting
+                next_at = now
+            await asyncio.sleep(next_at - now)
+
+    def fire_poll(self) -> None:
+        """Start a poll unless the events make it unnecessary."""
+        if self.polling_needed():
+            task = asyncio.create_task(self.poll_once())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def poll_once(self) -> None:
+        request_id = next(self.client.request_ids)
+        timeout = self.schedule.timeout if self.schedule is not None else self.timeout
+        sent_at = time.monotonic()
+        try:
+            reply = await self.client.request(
+                'CountingExample.get_count_tagged', request_id, timeout=timeout, request_id=request_id,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            TIMEOUTS.inc()
+            logger.warning("[%s] Request %d timed out after %.2fs, dropping one sample", self.name, request_id, timeout)
+            self.record_telemetry(-1, FLAG_TIMEOUT, time.monotonic() - sent_at)
+        except RequestLost:
+            pass
+        except ReplyError as e:
+            logger.error(f"[{self.name}] get_count_tagged failed: {e}")
+        else:
+            received_at = time.monotonic()
+            if self.schedule is not None:
+                self.schedule.observe(sent_at, received_at, reply['count'])
+            self.record_count(reply['count'], received_at - sent_at, request_id)
+            self.record_telemetry(reply['count'], rtt=received_at - sent_at)
+
+    async def sync_clock(self) -> bool:
+        """Take get_clock samples until the clock has a lease.
+
+        Returns:
+            False if the service doesn't support get_clock, in which case we poll instead
+        """
+        while True:
+            request_id = self.clock.next_request()
+            try:
+                reply = await self.client.request(
+                    'CountingExample.get_clock', request_id, timeout=self.clock.timeout, request_id=request_id,
+                )
+            except (asyncio.TimeoutError, RequestLost):
+                continue
+            except ReplyError as e:
+                logger.error(f"[{self.name}] get_clock failed ({e}), falling back to polling get_count")
+                self.clock = None
+                return False
+            previous_instance = self.clock.instance_id
+            if self.clock.add_sample(reply):
+                if previous_instance is not None and previous_instance != self.clock.instance_id:
+                    logger.warning(f"[{self.name}] Service restarted, counting from its new start time")
+                    self.last_count = -1
+                logger.info(
+                    f"[{self.name}] Clock synced: offset {self.clock.offset:+.3f}s, rtt {self.clock.rtt * 1000:.1f}ms, "
+                    f"serving counts locally for {self.clock.lease:.0f}s"
+                )
+                return True
+
+    async def follow_clock(self) -> None:
+        """Compute the count locally, waking just after each count boundary, and sync again when the lease ends."""
+        while True:
+            count_value = self.clock.estimate_count()
+            if count_value is None:
+                if not await self.sync_clock():
+                    return await self.poll()
+                continue
+            if count_value != self.last_count:
+                self.record_count(count_value)
+                self.record_telemetry(count_value, FLAG_LOCAL)
+            # sleep until the service's count ticks over
+            server_time = self.clock.server_time()
+            if server_time is None:
+                continue
+            elapsed = server_time - self.clock.start_time
+            await asyncio.sleep(math.floor(elapsed) + 1 - elapsed + 0.005)
+
+    def record_count(self, count_value: int, rtt: Optional[float] = None, request_id: Optional[int] = None) -> None:
+        """Check a count from the service for skips and log it.
+
+        Polls pass their request_id, a reply overtaken by a later poll's reply is logged but not compared.
+        """
+        client_elapsed = int(time.time() - self.start_time)
+        self.counts += 1
+        COUNTS.inc()
+
+        if request_id is None or request_id > self.last_request_id:
+            if request_id is not None:
+                self.last_request_id = request_id
+            if self.last_count >= 0 and count_value > self.last_count + 1:
+                skipped = count_value - self.last_count - 1
+                self.skipped += skipped
+                SKIPPED.inc(skipped)
+                logger.warning("[%s] Skipped %d count(s)! Server: %d, Client: %d", self.name, skipped, count_value, client_elapsed)
+            # a lower count means the service restarted or was reset, follow it
+            self.last_count = count_value
+
+        if not self.log_counts:
+            return
+        if rtt is None:
+            logger.info("[%s] Current count: %d (client elapsed: %ds)", self.name, count_value, client_elapsed)
+        else:
+            logger.info("[%s] Current count: %d (client elapsed: %ds, rtt: %.1fms)", self.name, count_value, client_elapsed, rtt * 1000)
+
+    def record_telemetry(self, count_value: int, flags: int = 0, rtt: Optional[float] = None) -> None:
+        """Write a telemetry record for a count, or for a timeout with count_value -1, if telemetry is on."""
+        if self.telemetry is None:
+            return
+        now = time.time()
+        if not flags & FLAG_TIMEOUT and self.client.recoveries != self._recoveries_seen:
+            self._recoveries_seen = self.client.recoveries
+            flags |= FLAG_RECONNECTED
+        sent_at = now - rtt if rtt is not None else 0.0
+        self.telemetry.record(sent_at, now, count_value, now - self.start_time, flags, self.index)
+
+
+async def sync_phase_clock(client: AsyncIntersectClient, clock: ClockSync, check_interval: float = 1.0) -> None:
+    """Keep the ClockSync of poll schedules synced, one get_clock round trip at a time.
+
+    If the service doesn't support get_clock the clock is left unsynced, and the schedules align
+    at their plain interval.
+    """
+    while True:
+        if not clock.needs_sync():
+            await asyncio.sleep(check_interval)
+            continue
+        request_id = clock.next_request()
+        try:
+            reply = await client.request('CountingExample.get_clock', request_id, timeout=clock.timeout, request_id=request_id)
+        except (asyncio.TimeoutError, RequestLost):
+            continue
+        except ReplyError as e:
+            logger.warning(f"get_clock failed ({e}), polling without phase alignment")
+            return
+        if clock.add_sample(reply):
+            logger.info(f"Polls aligned to the service's count, rtt {clock.rtt * 1000:.1f}ms")
+
+
+async def run_orchestrators(
+    client: AsyncIntersectClient,
+    orchestrators: List[AsyncCountingOrchestrator],
+    report_interval: float = 10.0,
+    scheduler: Optional[PollScheduler] = None,
+) -> None:
+    """Start the client and run every orchestrator until SIGTERM, SIGINT or cancellation.
+
+    With more than one orchestrator a summary line is logged every report_interval seconds. The
+    scheduler, if the orchestrators poll through one, runs on the same event loop.
+    """
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, main_task.cancel)
+
+    await client.start()
+    tasks = [asyncio.create_task(orchestrator.run()) for orchestrator in orchestrators]
+    if scheduler is not None:
+        tasks.append(asyncio.create_task(scheduler.run()))
+        clocks = {id(o.schedule.clock): o.schedule.clock for o in orchestrators if o.schedule is not None and o.schedule.clock is not None}
+        tasks.extend(asyncio.create_task(sync_phase_clock(client, clock)) for clock in clocks.values())
+    if len(orchestrators) > 1:
+        tasks.append(asyncio.create_task(_report(client, orchestrators, report_interval)))
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        logger.info('Stopping orchestrators')
+    finally:
+        for task in tasks:
+            task.cancel()
+        await client.stop('client exiting')
+
+
+async def _report(client: AsyncIntersectClient, orchestrators: List[AsyncCountingOrchestrator], interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(
+            f"{len(orchestrators)} orchestrators: {sum(o.counts for o in orchestrators)} counts, "
+            f"{sum(o.skipped for o in orchestrators)} skipped, {sum(o.timeouts for o in orchestrators)} timeouts, "
+            f"{client.pending_count()} requests in flight, {client.reconnections} reconnections"
+        )
@@ -0,0 +1,66 @@
+"""
+Metrics recorded by the counting client, served at http://<host>:METRICS_PORT/metrics.
+
+See clustering_common/metrics.py for the registry. Requests and replies are counted where they
+pass through the SDK client, the rest is recorded by the orchestrators.
+"""
+
+from typing import Any, Callable, Optional
+
+from intersect_sdk import INTERSECT_JSON_VALUE, IntersectClientCallback, IntersectDirectMessageParams
+
+from clustering_common.metrics import REGISTRY
+
+from sdk_adapter import wrap_send
+
+REQUESTS = REGISTRY.counter('counting_client_requests', 'Requests sent, by operation', ['operation'])
+REPLIES = REGISTRY.counter('counting_client_replies', 'Replies received, by operation and outcome', ['operation', 'outcome'])
+ROUND_TRIP_SECONDS = REGISTRY.histogram(
+    'counting_client_round_trip_seconds', 'Request to reply time, where the reply can be matched to its request', ['operation'],
+)
+IN_FLIGHT = REGISTRY.gauge('counting_client_requests_in_flight', 'Requests waiting for a reply (pipelined and asyncio modes)')
+TIMEOUTS = REGISTRY.counter('counting_client_request_timeouts', 'Requests given up on without a reply')
+RECONNECTS = REGISTRY.counter('counting_client_reconnects', 'Client restarts after messages stopped arriving')
+FAILOVERS = REGISTRY.counter('counting_client_failovers', 'Switches to a hot standby connection')
+STARTUP_SECONDS = REGISTRY.gauge('counting_client_startup_seconds', 'Time each startup phase took', ['phase'])
+RECOVERY_SECONDS = REGISTRY.histogram(
+    'counting_client_recovery_seconds',
+    'Silence from the last message before a reconnect or hot standby switch to the first message after it',
+    buckets=(0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0),
+)
+GATHER_SECONDS = REGISTRY.histogram(
+    'counting_client_gather_seconds', 'Scatter-gather time from sending to the last reply or deadline', ['operation'],
+)
+GATHER_MISSING = REGISTRY.counter(
+    'counting_client_gather_missing', 'Services which missed a scatter-gather deadline or replied with an error', ['destination'],
+)
+BROKER_CONNECTIONS = REGISTRY.gauge('counting_client_broker_connections', 'Pooled broker connections which are up (CONNECTION_POOL=1)')
+COUNTS = REGISTRY.counter('counting_client_counts', 'Counts observed')
+SKIPPED = REGISTRY.counter('counting_client_skipped_counts', 'Counts never observed because of a gap')
+
+
+def instrument_client(client: Any) -> None:
+    """Count every request an IntersectClient (or each client of a HotStandbyClient) sends."""
+    wrap_send(client, _counted_send)
+
+
+def _counted_send(send: Callable[[IntersectDirectMessageParams], None]) -> Callable[[IntersectDirectMessageParams], None]:
+    def counted_send(params: IntersectDirectMessageParams) -> None:
+        REQUESTS.labels(params.operation).inc()
+        return send(params)
+
+    return counted_send
+
+
+def count_replies(
+    callback: Callable[[str, str, bool, INTERSECT_JSON_VALUE], Optional[IntersectClientCallback]],
+) -> Callable[[str, str, bool, INTERSECT_JSON_VALUE], Optional[IntersectClientCallback]]:
+    """Wrap a user_callback so every reply is counted before it is handled."""
+
+    def counted_callback(
+        source: str, operation: str, has_error: bool, payload: INTERSECT_JSON_VALUE
+    ) -> Optional[IntersectClientCallback]:
+        REPLIES.labels(operation, 'error' if has_error else 'ok').inc()
+        return callback(source, operation, has_error, payload)
+
+    return counted_callback
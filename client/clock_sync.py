@@ -0,0 +1,210 @@
+"""
+Clock-synchronized count estimation for the counting client.
+
+The service's count is a pure function of its start time and its wall clock:
+``int(time.time() - start_time)``. Once the client knows the service's ``start_time`` and the
+offset between the two clocks, it can compute the count itself instead of asking the broker every
+second.
+
+ClockSync learns both with an NTP-style handshake. Each ``get_clock`` round trip is one sample. The
+service's clock reading is assumed to be taken halfway through the round trip, so the error of a
+sample is at most half its RTT. After several samples the one with the smallest RTT wins. The
+result is valid for a lease period, after which (or as soon as the service reports a restart)
+the client syncs again. In between, count reads are pure arithmetic on the local monotonic clock.
+"""
+
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class ClockSample:
+    """One get_clock round trip."""
+
+    sent_at: float
+    """
+    Local monotonic time the request was handed to the SDK
+    """
+    received_at: float
+    """
+    Local monotonic time the reply arrived
+    """
+    server_time: float
+    """
+    Service wall clock time when it handled the request
+    """
+    start_time: float
+    """
+    The service's count epoch, count = int(server time - start_time)
+    """
+    instance_id: str
+    """
+    Identifies the service process, changes when the service restarts
+    """
+
+    @property
+    def rtt(self) -> float:
+        return self.received_at - self.sent_at
+
+    @property
+    def offset(self) -> float:
+        """Service wall clock minus local monotonic clock, assuming the reading was taken mid round trip."""
+        return self.server_time - (self.sent_at + self.received_at) / 2.0
+
+
+class ClockSync:
+    """Tracks the service clock and answers count reads locally while the lease is valid.
+
+    Like RequestPipeline this never sends anything itself. The orchestrator asks needs_sync(),
+    sends a get_clock request with the ID from next_request(), then feeds the reply to add_sample().
+    Only the reply to the latest request is used, a late reply would look like a fast round trip.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(
+        self,
+        samples: int = 4,
+        lease: float = 30.0,
+        timeout: float = 3.0,
+        request_ids: Optional[Iterator[int]] = None,
+    ) -> None:
+        """Create an unsynchronized clock.
+
+        Params:
+          samples: get_clock round trips per sync, the one with the smallest RTT is kept
+          lease: seconds a sync stays valid before the next one is needed
+          timeout: seconds after which an unanswered get_clock request is sent again
+          request_ids: where correlation IDs come from, defaults to counting up from 1. ClockSyncs
+            whose requests share one client connection must share this so their IDs don't collide.
+        """
+        if samples < 1:
+            raise ValueError('samples must be at least 1')
+        self.samples = samples
+        self.lease = lease
+        self.timeout = timeout
+
+        self.offset: Optional[float] = None
+        self.rtt: Optional[float] = None
+        self.start_time: Optional[float] = None
+        self.instance_id: Optional[str] = None
+        self.syncs = 0
+        self.restarts = 0
+
+        self._lease_expires = 0.0
+        self._round: List[ClockSample] = []
+        self._sent_at: Optional[float] = None
+        self._pending_id: Optional[int] = None
+        self._ids = request_ids if request_ids is not None else itertools.count(1)
+        self._lock = threading.Lock()
+
+    def lease_valid(self, now: Optional[float] = None) -> bool:
+        """True if count reads can be answered locally."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self.offset is not None and now < self._lease_expires
+
+    def needs_sync(self, now: Optional[float] = None) -> bool:
+        """True if a get_clock request should go out now.
+
+        That is the case when the lease ran out (or never existed) and no request is in flight,
+        or the one in flight timed out.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.offset is not None and now < self._lease_expires:
+                return False
+            return self._sent_at is None or now - self._sent_at > self.timeout
+
+    def next_request(self, now: Optional[float] = None) -> int:
+        """Start a get_clock round trip, any earlier one still in flight is forgotten.
+
+        Returns:
+            The correlation ID to send as the get_clock payload
+        """
+        with self._lock:
+            self._sent_at = time.monotonic() if now is None else now
+            self._pending_id = next(self._ids)
+            return self._pending_id
+
+    def add_sample(self, reply: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """Feed a get_clock reply.
+
+        Params:
+          reply: the get_clock payload, with request_id, server_time, start_time and instance_id
+          now: local monotonic receive time, defaults to now
+
+        Returns:
+            True if this sample completed a sync and a new lease started, False if more samples
+            are needed (or the reply was late or unexpected)
+        """
+        received_at = time.monotonic() if now is None else now
+        with self._lock:
+            if self._pending_id is None or reply['request_id'] != self._pending_id:
+                return False
+            sample = ClockSample(
+                sent_at=self._sent_at,
+                received_at=received_at,
+                server_time=reply['server_time'],
+                start_time=reply['start_time'],
+                instance_id=reply['instance_id'],
+            )
+            self._sent_at = None
+            self._pending_id = None
+            # samples from before a restart or a reset describe a different counter
+            if self._round and (self._round[0].instance_id, self._round[0].start_time) != (sample.instance_id, sample.start_time):
+                self._round = []
+            self._round.append(sample)
+            if len(self._round) < self.samples:
+                return False
+
+            best = min(self._round, key=lambda s: s.rtt)
+            self._round = []
+            if self.instance_id is not None and best.instance_id != self.instance_id:
+                self.restarts += 1
+            self.offset = best.offset
+            self.rtt = best.rtt
+            self.start_time = best.start_time
+            self.instance_id = best.instance_id
+            self._lease_expires = received_at + self.lease
+            self.syncs += 1
+            return True
+
+    def invalidate(self) -> None:
+        """Drop the lease, e.g. after the service reported a restart. The next read needs a sync."""
+        with self._lock:
+            self._lease_expires = 0.0
+            self._round = []
+            self._sent_at = None
+            self._pending_id = None
+
+    def server_time(self, now: Optional[float] = None) -> Optional[float]:
+        """Estimated service wall clock time, or None outside the lease."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.offset is None or now >= self._lease_expires:
+                return None
+            return now + self.offset
+
+    def estimate_count(self, now: Optional[float] = None) -> Optional[int]:
+        """The count get_count would return right now, or None if a sync is needed first."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.offset is None or now >= self._lease_expires:
+                return None
+            return int(now + self.offset - self.start_time)
+
+    def check_tick(self, tick: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """Compare a count_tick event with the local estimate.
+
+        Returns:
+            False if the tick comes from another service instance or disagrees with the estimate
+            by more than one count, in which case the lease should be dropped
+        """
+        if self.instance_id is not None and tick.get('instance_id', self.instance_id) != self.instance_id:
+            return False
+        estimate = self.estimate_count(now)
+        return estimate is None or abs(estimate - tick['count']) <= 1
@@ -1,9 +1,18 @@
+import asyncio
 import logging
 import time
 import os
+from typing import Optional
 
 import sys
 sys.path.append('/opt')
+# the shared clustering_common package lives next to client/ when running outside docker
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from clustering_common.readiness import StartupTimer, wait_for_brokers
+
+# Started before the SDK is imported, so the import is the first startup phase
+startup_timer = StartupTimer()
+
 from intersect_sdk import (
     INTERSECT_JSON_VALUE,
     IntersectClient,
@@ -15,8 +24,40 @@ from intersect_sdk import (
 # Import our clustering configuration
 import config
 import config_amqp
+from hot_standby_client import HotStandbyClient, split_client_config
+from request_pipeline import RequestPipeline
+from clock_sync import ClockSync
+from poll_scheduler import PhaseSchedule, PollScheduler
+from telemetry import FLAG_EVENT, FLAG_LOCAL, FLAG_RECONNECTED, FLAG_TIMEOUT, TelemetryRecorder, broker_index
+from async_runner import AsyncCountingOrchestrator, AsyncIntersectClient, run_orchestrators
+from scatter_gather import ScatterGatherClient, expand_destinations, run_scatter_gather
+from sdk_adapter import send_message
+from client_metrics import (
+    BROKER_CONNECTIONS,
+    COUNTS,
+    FAILOVERS,
+    IN_FLIGHT,
+    RECONNECTS,
+    RECOVERY_SECONDS,
+    ROUND_TRIP_SECONDS,
+    SKIPPED,
+    STARTUP_SECONDS,
+    TIMEOUTS,
+    count_replies,
+    instrument_client,
+)
+from clustering_common.broker_selector import select_config_brokers
+from clustering_common.connection_pool import ConnectionPool
+from clustering_common.log_pipeline import configure_logging
+from clustering_common.metrics import REGISTRY, serve
+
+# Log records per second per message type before only a sample is kept, 0 turns the limit off
+LOG_RATE = float(os.environ.get("LOG_RATE", "10"))
+# Once a message type is over LOG_RATE, keep one record in LOG_SAMPLE, 0 drops the rest
+LOG_SAMPLE = int(os.environ.get("LOG_SAMPLE", "100"))
 
-logging.basicConfig(level=logging.INFO)
+# Records are written by a background thread, so the broker's delivery thread never waits on log output
+configure_logging(logging.INFO, rate=LOG_RATE, sample_every=LOG_SAMPLE)
 logger = logging.getLogger(__name__)
 
 # Determine which config to use based on environment variable
@@ -28,6 +69,70 @@ else:
     CLIENT_CONFIG = config.CLIENT_CONFIG
     logger.info("Using MQTT configuration")
 
+# Number of get_count requests to keep in flight at once. 0 keeps the original request-reply chain.
+PIPELINE_WINDOW = int(os.environ.get("PIPELINE_WINDOW", "0"))
+# Seconds before an unanswered pipelined request is given up on
+PIPELINE_TIMEOUT = float(os.environ.get("PIPELINE_TIMEOUT", "3.0"))
+# Minimum seconds between two pipelined requests
+PIPELINE_INTERVAL = float(os.environ.get("PIPELINE_INTERVAL", "1.0"))
+# "fixed" sleeps a second after each reply, or polls every PIPELINE_INTERVAL with CLIENT_RUNNER=asyncio,
+# "aligned" sends every get_count just after the service's count ticks over (poll_scheduler.py)
+POLL_SCHEDULE = os.environ.get("POLL_SCHEDULE", "fixed")
+
+# If set, subscribe to the service's count_tick events instead of polling get_count
+TICK_EVENTS = os.environ.get("TICK_EVENTS", "0") == "1"
+# Seconds without a count_tick before falling back to polling
+TICK_TIMEOUT = float(os.environ.get("TICK_TIMEOUT", "2.5"))
+
+# If set, keep a connected client on every broker node and switch between them on a missed heartbeat
+HOT_STANDBY = os.environ.get("HOT_STANDBY", "0") == "1"
+# Seconds without any message before the hot standby takes over
+HEARTBEAT_TIMEOUT = float(os.environ.get("HEARTBEAT_TIMEOUT", "1.5"))
+
+# If set, learn the service's clock with get_clock and compute the count locally instead of polling
+CLOCK_SYNC = os.environ.get("CLOCK_SYNC", "0") == "1"
+# Seconds a clock sync stays valid before the client syncs again
+CLOCK_LEASE = float(os.environ.get("CLOCK_LEASE", "30"))
+# get_clock round trips per sync, the one with the smallest round-trip time wins
+CLOCK_SAMPLES = int(os.environ.get("CLOCK_SAMPLES", "4"))
+
+# "latency" probes the brokers and tries the fastest healthy one first, "static" keeps the configured order
+BROKER_SELECTION = os.environ.get("BROKER_SELECTION", "static")
+# Seconds between background re-ranking probes when BROKER_SELECTION=latency
+BROKER_PROBE_INTERVAL = float(os.environ.get("BROKER_PROBE_INTERVAL", "30"))
+
+# "lifecycle" runs SampleOrchestrator under the SDK's lifecycle loop, "asyncio" uses async_runner.py,
+# "scatter" polls every service in SERVICE_DESTINATIONS at once (scatter_gather.py)
+CLIENT_RUNNER = os.environ.get("CLIENT_RUNNER", "lifecycle")
+# Number of orchestrators sharing one connection, only with CLIENT_RUNNER=asyncio
+ORCHESTRATORS = int(os.environ.get("ORCHESTRATORS", "1"))
+# Services for CLIENT_RUNNER=scatter, comma-separated names or patterns like "counting-service-{1..4}"
+SERVICE_DESTINATIONS = os.environ.get("SERVICE_DESTINATIONS", "counting-service")
+# Seconds each service gets to reply to a scatter-gather request before it is reported as missing
+GATHER_DEADLINE = float(os.environ.get("GATHER_DEADLINE", "1.0"))
+
+# Port serving Prometheus metrics at /metrics, 0 turns the endpoint off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9465"))
+# Address the metrics endpoint listens on, the default only accepts local connections
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# If set, write a binary record of every count to TELEMETRY_DIR, read them back with analyze_telemetry.py
+TELEMETRY = os.environ.get("TELEMETRY", "0") == "1"
+TELEMETRY_DIR = os.environ.get("TELEMETRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "output"))
+# Start a new telemetry file after this many MiB, and delete the oldest past TELEMETRY_MAX_FILES (0 keeps them all)
+TELEMETRY_FILE_MB = int(os.environ.get("TELEMETRY_FILE_MB", "64"))
+TELEMETRY_MAX_FILES = int(os.environ.get("TELEMETRY_MAX_FILES", "8"))
+
+# Seconds to wait at startup for a broker to accept a session before giving up, 0 waits forever
+STARTUP_TIMEOUT = float(os.environ.get("STARTUP_TIMEOUT", "300"))
+
+# Every IntersectClient of the process shares its broker connections (connection_pool.py), "0" gives each its own
+CONNECTION_POOL = os.environ.get("CONNECTION_POOL", "0") == "1"
+# Clients per pooled connection (AMQP channels on it), past that another connection is opened
+POOL_MAX_CHANNELS = int(os.environ.get("POOL_MAX_CHANNELS", "64"))
+
+SERVICE_DESTINATION = 'intersect.resilience.clustering-demo.-.counting-service'
+
 
 class SampleOrchestrator:
     """This class contains the callback function.
@@ -36,10 +141,39 @@ class SampleOrchestrator:
 
     State is managed through a message stack. We initialize a request-reply-request-reply... chain with the Service,
     and the chain ends once we've popped all messages from our message stack.
+
+    If a RequestPipeline is provided, the chain is replaced by a window of tagged get_count requests
+    which are matched to their replies by correlation ID, see request_pipeline.py.
+
+    If a PhaseSchedule is provided, the chain doesn't sleep in the callback either. A PollScheduler
+    calls poll_due, which sends each get_count just after the service's count ticks over, see
+    poll_scheduler.py.
+
+    In tick mode the service pushes a count_tick event every second and we only poll
+    (with whichever of the two modes above is configured) while the ticks have stopped arriving.
+
+    In clock mode we never poll get_count. A few get_clock round trips tell us the service's count
+    epoch and clock offset, and the lifecycle loop computes the count locally until the lease
+    runs out, see clock_sync.py. count_tick events, if subscribed, only serve to notice restarts.
     """
 
-    def __init__(self) -> None:
-        """Basic constructor for the orchestrator class, call before creating the IntersectClient."""
+    def __init__(
+        self,
+        pipeline: Optional[RequestPipeline] = None,
+        tick_events: bool = False,
+        clock: Optional[ClockSync] = None,
+        telemetry: Optional[TelemetryRecorder] = None,
+        schedule: Optional[PhaseSchedule] = None,
+    ) -> None:
+        """Basic constructor for the orchestrator class, call before creating the IntersectClient.
+
+        Params:
+          pipeline: if set, poll in pipelined mode instead of a strict request-reply chain
+          tick_events: if True, rely on count_tick events and only poll as a fallback
+          clock: if set, compute the count locally from a clock lease instead of polling
+          telemetry: if set, write a record for every count and timeout
+          schedule: if set (and there's no pipeline), poll phase-aligned from a PollScheduler
+        """
         # Create our messages
         self.get_count_message = IntersectDirectMessageParams(
             destination='intersect.resilience.clustering-demo.-.counting-service',
@@ -59,12 +193,274 @@ class SampleOrchestrator:
         
         # Track the last count we received to detect skips
         self.last_count = -1
+
+        # Correlation ID of the pipelined request last_count came from, see record_count
+        self.last_request_id = 0
         
         # Track when we started to display elapsed time in client
         self.start_time = None
         
         # Track when we last received a message
         self.last_message_time = 0
+
+        # Time of the last message before a reconnect or failover, until the first one after it arrives
+        self.outage_started = 0.0
+
+        # Number of times we had to restart the client because messages stopped
+        self.reconnections = 0
+
+        # Optional pipelined mode, see make_tagged_count_message
+        self.pipeline = pipeline
+
+        # Optional push mode, see event_callback
+        self.tick_events = tick_events
+        self.last_tick_time = 0.0
+        self.polling_fallback = False
+
+        # Optional local count mode, see read_local_count
+        self.clock = clock
+
+        # Optional per-count records for offline analysis, see record_telemetry
+        self.telemetry = telemetry
+        self.recovered = False
+
+        # Optional phase-aligned polling, see poll_due. When the get_count in flight went out (time.monotonic())
+        self.schedule = schedule
+        self.get_count_sent_at: Optional[float] = None
+
+    def message_received(self) -> None:
+        """Note that a message arrived, and how long the outage was if it's the first one since a reconnect or failover."""
+        now = time.time()
+        if self.outage_started:
+            RECOVERY_SECONDS.observe(now - self.outage_started)
+            self.outage_started = 0.0
+            self.recovered = True
+        self.last_message_time = now
+
+    def polling_needed(self) -> bool:
+        """Return True if we should keep polling get_count, False if count_tick events or the clock cover us."""
+        if self.clock is not None:
+            return False
+        if not self.tick_events:
+            return True
+        if time.time() - self.last_tick_time > TICK_TIMEOUT:
+            if not self.polling_fallback:
+                logger.warning(f"No count_tick for more than {TICK_TIMEOUT}s, falling back to polling")
+                self.polling_fallback = True
+        return self.polling_fallback
+
+    def check_tick_fallback(self, client) -> None:
+        """Restart the poll chain if ticks stopped arriving (called periodically by the lifecycle loop).
+
+        In pipelined mode fill_pipeline already takes care of this, with a schedule poll_due does.
+        """
+        if not self.tick_events or not self.counter_started or self.pipeline is not None or self.schedule is not None:
+            return
+        if self.polling_fallback or not self.polling_needed():
+            return
+        try:
+            send_message(client, self.get_count_message)
+        except Exception as e:
+            logger.error(f"Error starting fallback polling: {e}")
+
+    def event_callback(
+        self, source: str, operation: str, event_name: str, payload: INTERSECT_JSON_VALUE
+    ) -> None:
+        """Handle count_tick events pushed by the service."""
+        if event_name != 'count_tick':
+            return None
+        self.message_received()
+        self.last_tick_time = time.time()
+        if self.polling_fallback:
+            logger.info("Count ticks resumed, stopping fallback polling")
+            self.polling_fallback = False
+        if self.clock is not None:
+            # local reads cover the count, the tick only tells us whether our lease still holds
+            if not self.clock.check_tick(payload):
+                logger.warning("count_tick disagrees with the clock lease (service restarted?), syncing again")
+                self.clock.invalidate()
+            return None
+        if self.start_time is not None:
+            self.record_count(payload['count'])
+            self.record_telemetry(payload['count'], FLAG_EVENT)
+        return None
+
+    def make_clock_message(self, clock: Optional[ClockSync] = None) -> IntersectDirectMessageParams:
+        """Start a get_clock round trip of clock (default: the clock lease) and build its request."""
+        return IntersectDirectMessageParams(
+            destination='intersect.resilience.clustering-demo.-.counting-service',
+            operation='CountingExample.get_clock',
+            payload=(clock or self.clock).next_request(),
+        )
+
+    def read_local_count(self, client) -> None:
+        """Record the locally computed count, or start a sync if the lease ran out (called by the lifecycle loop)."""
+        if self.clock is None or not self.counter_started:
+            return
+        count_value = self.clock.estimate_count()
+        if count_value is not None:
+            # Silence is expected under the lease, the reconnection check starts counting once it ends
+            self.last_message_time = time.time()
+            # the loop runs several times per count, only report each count once
+            if count_value != self.last_count:
+                self.record_count(count_value)
+                self.record_telemetry(count_value, FLAG_LOCAL)
+            return
+        if self.clock.needs_sync():
+            try:
+                send_message(client, self.make_clock_message())
+            except Exception as e:
+                logger.error(f"Error sending clock sync request: {e}")
+
+    def handle_clock_reply(self, payload: INTERSECT_JSON_VALUE) -> Optional[IntersectClientCallback]:
+        """Feed a get_clock reply to the clock and ask for the next sample if the sync needs more."""
+        previous_instance = self.clock.instance_id
+        if not self.clock.add_sample(payload):
+            # a late reply leaves the current request in flight, its timeout covers it
+            if not self.clock.needs_sync():
+                return None
+            return IntersectClientCallback(messages_to_send=[self.make_clock_message()])
+
+        if previous_instance is not None and previous_instance != self.clock.instance_id:
+            logger.warning("Service restarted, counting from its new start time")
+            self.last_count = -1
+        logger.info(
+            f"Clock synced: offset {self.clock.offset:+.3f}s, rtt {self.clock.rtt * 1000:.1f}ms, "
+            f"serving counts locally for {self.clock.lease:.0f}s"
+        )
+        return None
+
+    def handle_phase_clock_reply(self, has_error: bool, payload: INTERSECT_JSON_VALUE) -> Optional[IntersectClientCallback]:
+        """Feed a get_clock reply to the poll schedule's clock, after an error the schedule polls at its plain interval."""
+        phase_clock = self.schedule.clock
+        if phase_clock is None:
+            return None
+        if has_error:
+            logger.warning(f"get_clock failed ({payload}), polling every {self.schedule.interval}s without phase alignment")
+            self.schedule.clock = None
+            return None
+        if phase_clock.add_sample(payload):
+            logger.info(f"Polls aligned to the service's count, rtt {phase_clock.rtt * 1000:.1f}ms")
+            return None
+        if not phase_clock.needs_sync():
+            return None
+        return IntersectClientCallback(messages_to_send=[self.make_clock_message(phase_clock)])
+
+    def poll_due(self, client) -> None:
+        """Send the next get_count, and a get_clock if the schedule's clock needs syncing (called by the PollScheduler).
+
+        One get_count is in flight at a time, until the schedule's timeout gives up on it.
+        """
+        if not self.counter_started or self.clock is not None or not self.polling_needed():
+            return
+        now = time.monotonic()
+        try:
+            phase_clock = self.schedule.clock
+            if phase_clock is not None and phase_clock.needs_sync():
+                send_message(client, self.make_clock_message(phase_clock))
+            if self.get_count_sent_at is not None:
+                age = now - self.get_count_sent_at
+                if age < self.schedule.timeout:
+                    return
+                TIMEOUTS.inc()
+                logger.warning("get_count timed out after %.2fs, dropping one sample", age)
+                self.record_telemetry(-1, FLAG_TIMEOUT, age)
+            self.get_count_sent_at = now
+            send_message(client, self.get_count_message)
+        except Exception as e:
+            logger.error(f"Error sending scheduled poll: {e}")
+
+    def continue_polling(self) -> Optional[IntersectClientCallback]:
+        """Messages which keep polling going from a reply callback, the PollScheduler needs none."""
+        if self.pipeline is not None:
+            return self.next_poll_messages()
+        if self.schedule is not None:
+            return None
+        return IntersectClientCallback(messages_to_send=[self.get_count_message])
+
+    def make_tagged_count_message(self) -> Optional[IntersectDirectMessageParams]:
+        """Reserve a pipeline slot and build the matching request, or return None if the window is full."""
+        request_id = self.pipeline.acquire()
+        if request_id is None:
+            return None
+        return IntersectDirectMessageParams(
+            destination='intersect.resilience.clustering-demo.-.counting-service',
+            operation='CountingExample.get_count_tagged',
+            payload=request_id,
+        )
+
+    def next_poll_messages(self) -> IntersectClientCallback:
+        """Messages to send after a reply when we are not sleeping in the callback (pipelined mode)."""
+        if not self.polling_needed():
+            return IntersectClientCallback(messages_to_send=[])
+        message = self.make_tagged_count_message()
+        return IntersectClientCallback(messages_to_send=[message] if message else [])
+
+    def fill_pipeline(self, client) -> None:
+        """Expire timed-out requests and top the pipeline window back up (called by the lifecycle loop)."""
+        for request_id, age in self.pipeline.expire():
+            TIMEOUTS.inc()
+            logger.warning("Request %d timed out after %.2fs, dropping one sample", request_id, age)
+            self.record_telemetry(-1, FLAG_TIMEOUT, age)
+        if not self.counter_started or not self.polling_needed():
+            return
+        while True:
+            message = self.make_tagged_count_message()
+            if message is None:
+                break
+            try:
+                send_message(client, message)
+            except Exception as e:
+                logger.error(f"Error sending pipelined request: {e}")
+                break
+
+    def record_count(self, count_value: int, rtt: Optional[float] = None, request_id: Optional[int] = None) -> None:
+        """Check a count from the service for skips and log it.
+
+        Pipelined replies pass the correlation ID of their request. A reply overtaken by the reply
+        to a later request carries an older count, it's logged but not compared.
+        """
+        client_elapsed = int(time.time() - self.start_time)
+        COUNTS.inc()
+
+        if request_id is None or request_id > self.last_request_id:
+            if request_id is not None:
+                self.last_request_id = request_id
+
+            # Check for skips (more than 1 second difference)
+            if self.last_count >= 0 and count_value > self.last_count + 1:
+                skipped = count_value - self.last_count - 1
+                SKIPPED.inc(skipped)
+                logger.warning("Skipped %d count(s)! Server: %d, Client: %d", skipped, count_value, client_elapsed)
+
+            # A count lower than the last one means the service restarted or was reset, follow it
+            self.last_count = count_value
+
+        # Use logger instead of print to make sure it's visible in Docker logs, formatted by the log writer
+        if rtt is None:
+            logger.info("Current count: %d (client elapsed: %ds)", count_value, client_elapsed)
+        else:
+            logger.info("Current count: %d (client elapsed: %ds, rtt: %.1fms)", count_value, client_elapsed, rtt * 1000)
+
+    def record_telemetry(self, count_value: int, flags: int = 0, rtt: Optional[float] = None) -> None:
+        """Write a telemetry record for a count, or for a timeout with count_value -1, if telemetry is on.
+
+        Without an rtt a polled count is timed from the last get_count sent, the request-reply
+        chain has only one in flight.
+        """
+        if self.telemetry is None:
+            return
+        now = time.time()
+        if rtt is not None:
+            sent_at = now - rtt
+        elif flags & (FLAG_EVENT | FLAG_LOCAL):
+            sent_at = 0.0
+        else:
+            sent_at = self.telemetry.last_sent(self.get_count_message.operation)
+        if self.recovered and not flags & FLAG_TIMEOUT:
+            self.recovered = False
+            flags |= FLAG_RECONNECTED
+        self.telemetry.record(sent_at, now, count_value, now - self.start_time if self.start_time else 0.0, flags)
         
     def check_for_reconnection_needed(self, client):
         """Check if we need to restart the message chain (called periodically by the lifecycle loop)."""
@@ -73,18 +469,34 @@ class SampleOrchestrator:
         # Check if it's been too long since we received a message
         if self.last_message_time > 0 and current_time - self.last_message_time > 5:
             print(f"\nNo messages for {current_time - self.last_message_time:.1f} seconds, restarting chain...")
+            self.outage_started = self.outage_started or self.last_message_time
             self.last_message_time = current_time  # Reset to avoid multiple restarts
+            self.reconnections += 1
+            RECONNECTS.inc()
             
             # Restart the client to force reconnection
             try:
                 client.shutdown()
                 time.sleep(1.0)
                 client.startup()
+
+                # Anything in flight was sent over the old connection and will never be answered
+                if self.clock is not None:
+                    self.clock.invalidate()
+                    if self.counter_started:
+                        print("Restarting clock sync...")
+                        return None
+                if self.pipeline is not None:
+                    self.pipeline.reset()
+                    if self.counter_started:
+                        print("Restarting pipelined polling...")
+                        return None
+                self.get_count_sent_at = None
                 
                 # Force restart of the message chain
                 if self.counter_started:
                     print("Restarting count chain...")
-                    return IntersectClientCallback(messages_to_send=[self.get_count_message])
+                    return self.continue_polling()
                 else:
                     print("Starting counter...")
                     return IntersectClientCallback(messages_to_send=[self.start_count_message])
@@ -92,6 +504,60 @@ class SampleOrchestrator:
                 print(f"Error during reconnection: {e}")
         
         return None
+
+    def on_failover(self, client_instance) -> None:
+        """Resend whatever we were waiting on after a missed hot standby heartbeat.
+
+        Anything in flight was sent over the old connection and may never be answered.
+        """
+        FAILOVERS.inc()
+        self.outage_started = self.outage_started or self.last_message_time
+        self.last_message_time = time.time()
+        if not self.counter_started:
+            send_message(client_instance, self.start_count_message)
+        elif self.clock is not None:
+            # read_local_count starts a new sync on the next loop
+            self.clock.invalidate()
+        elif self.pipeline is not None:
+            self.pipeline.reset()
+        elif self.schedule is not None:
+            # poll_due sends again at the next count boundary
+            self.get_count_sent_at = None
+        elif self.polling_needed():
+            send_message(client_instance, self.get_count_message)
+
+    def waiting_callback(self, client_instance) -> None:
+        """Monitor message flow and restart the chain if needed (passed to the lifecycle loop)."""
+        # With a hot standby a missed heartbeat is a switch to an already connected client,
+        # which happens long before the full restart below would kick in
+        if isinstance(client_instance, HotStandbyClient):
+            if client_instance.check_heartbeat(self.last_message_time):
+                try:
+                    self.on_failover(client_instance)
+                except Exception as e:
+                    logger.error(f"Error resending after failover: {e}")
+
+        # Check if we need to restart the message chain
+        result = self.check_for_reconnection_needed(client_instance)
+        if result:
+            # If we need to restart, handle the callback result
+            # In this case, add the message to the queue
+            message = result.messages_to_send[0]
+            try:
+                # Try to send a message directly to restart the chain
+                send_message(client_instance, message)
+            except:
+                pass
+
+        # In pipelined mode the loop also handles per-request timeouts and refills the window
+        if self.pipeline is not None:
+            self.fill_pipeline(client_instance)
+
+        # In tick mode, start polling if the ticks have gone quiet
+        self.check_tick_fallback(client_instance)
+
+        # In clock mode, answer the count locally or sync again
+        self.read_local_count(client_instance)
         
     def client_callback(
         self, source: str, operation: str, has_error: bool, payload: INTERSECT_JSON_VALUE
@@ -102,7 +568,7 @@ class SampleOrchestrator:
         """
         try:
             # Update last message time whenever we receive any message
-            self.last_message_time = time.time()
+            self.message_received()
             
             # If this is our first response and we need to start the counter
             if not self.counter_started:
@@ -117,25 +583,64 @@ class SampleOrchestrator:
                         else:
                             logger.info("Successfully started the counter.")
                     
+                    # In clock mode, sync once and compute counts ourselves from then on
+                    if self.clock is not None:
+                        logger.info("Syncing with the service clock...")
+                        return IntersectClientCallback(messages_to_send=[self.make_clock_message()])
+
+                    # In tick mode the service pushes counts to us, give the first tick time to arrive
+                    if self.tick_events:
+                        logger.info("Waiting for count_tick events...")
+                        self.last_tick_time = time.time()
+                        return None
+
+                    # Phase-aligned polls start with a clock sync, poll_due sends the get_counts
+                    if self.pipeline is None and self.schedule is not None and self.schedule.clock is not None:
+                        logger.info("Aligning polls with the service's count...")
+                        return IntersectClientCallback(messages_to_send=[self.make_clock_message(self.schedule.clock)])
+
                     # Send the first get_count message immediately
                     logger.info("Starting to poll the counter...")
-                    return IntersectClientCallback(messages_to_send=[self.get_count_message])
+                    return self.continue_polling()
+
+            # Clock samples, an error means the service doesn't know get_clock, so poll instead
+            elif operation == "CountingExample.get_clock":
+                if self.clock is None and self.schedule is not None:
+                    return self.handle_phase_clock_reply(has_error, payload)
+                if has_error:
+                    logger.error(f"get_clock failed ({payload}), falling back to polling get_count")
+                    self.clock = None
+                    return self.continue_polling()
+                return self.handle_clock_reply(payload)
+
+            # Pipelined replies carry the correlation ID we sent
+            elif operation == "CountingExample.get_count_tagged":
+                rtt = self.pipeline.complete(payload['request_id'])
+                if rtt is None:
+                    logger.info("Ignoring late or duplicate reply for request %s", payload['request_id'])
+                else:
+                    ROUND_TRIP_SECONDS.labels(operation).observe(rtt)
+                    self.record_count(payload['count'], rtt, payload['request_id'])
+                    self.record_telemetry(payload['count'], rtt=rtt)
+                return self.next_poll_messages()
             
             # For all subsequent responses, we just get the current count
             elif operation == "CountingExample.get_count":
-                # Extract the count value
-                count_value = payload
-                client_elapsed = int(time.time() - self.start_time)
-                
-                # Check for skips (more than 1 second difference)
-                if self.last_count >= 0 and count_value > self.last_count + 1:
-                    skipped = count_value - self.last_count - 1
-                    logger.warning(f"Skipped {skipped} count(s)! Server: {count_value}, Client: {client_elapsed}")
-                
-                self.last_count = count_value
-                
-                # Use logger instead of print to make sure it's visible in Docker logs
-                logger.info(f"Current count: {count_value} (client elapsed: {client_elapsed}s)")
+                if self.schedule is not None and self.get_count_sent_at is not None:
+                    received_at = time.monotonic()
+                    rtt = received_at - self.get_count_sent_at
+                    self.schedule.observe(self.get_count_sent_at, received_at, payload)
+                    self.get_count_sent_at = None
+                    ROUND_TRIP_SECONDS.labels(operation).observe(rtt)
+                    self.record_count(payload, rtt)
+                    self.record_telemetry(payload, rtt=rtt)
+                    return None
+                self.record_count(payload)
+                self.record_telemetry(payload)
+
+                # End the fallback chain once ticks are back, the PollScheduler sends the next poll
+                if not self.polling_needed() or self.schedule is not None:
+                    return None
                 
                 # Add a delay between requests to reduce load
                 time.sleep(1.0)  # Wait 1 second between requests
@@ -145,36 +650,176 @@ class SampleOrchestrator:
             else:
                 logger.warning(f"Received unexpected response: {operation}")
                 # Always continue the chain by asking for the count
-                return IntersectClientCallback(messages_to_send=[self.get_count_message])
+                return self.continue_polling()
                 
         except Exception as e:
             # Safer error handling
             logger.error(f"Error in callback: {e}")
             # Always continue the chain even on errors
-            return IntersectClientCallback(messages_to_send=[self.get_count_message])
+            return self.continue_polling()
 
 if __name__ == '__main__':
-    # Initial message to start the counter
+    scatter_destinations = []
+    if CLIENT_RUNNER == "scatter":
+        try:
+            scatter_destinations = expand_destinations(SERVICE_DESTINATIONS)
+        except ValueError as e:
+            logger.error(f"Bad SERVICE_DESTINATIONS: {e}")
+            sys.exit(1)
+
+    # Start as soon as a broker accepts a session, rather than after a fixed sleep
+    startup_timer.mark('import')
+    try:
+        wait_for_brokers(CLIENT_CONFIG, timeout=STARTUP_TIMEOUT)
+    except TimeoutError as e:
+        logger.error(f"Giving up on startup: {e}")
+        sys.exit(1)
+    startup_timer.mark('brokers')
+
+    # Initial message to start the counter, in scatter-gather mode one per service
+    # (the runner starts the counters of services which missed theirs, the SDK needs at least one message)
     initial_messages = [
         IntersectDirectMessageParams(
-            destination='intersect.resilience.clustering-demo.-.counting-service',
+            destination=destination,
             operation='CountingExample.start_count',
             payload=None,
         )
+        for destination in scatter_destinations or [SERVICE_DESTINATION]
     ]
     
     # Make sure initial messages are retried on reconnection
     CLIENT_CONFIG.resend_initial_messages_on_secondary_startup = True
     
-    # Configure the client to send the start_count message initially
-    CLIENT_CONFIG.initial_message_event_config = IntersectClientCallback(messages_to_send=initial_messages)
+    # Configure the client to send the start_count message initially,
+    # and listen for the service's count_tick events if we're using them
+    CLIENT_CONFIG.initial_message_event_config = IntersectClientCallback(
+        messages_to_send=initial_messages,
+        subscribe_to_events=[SERVICE_DESTINATION] if TICK_EVENTS else [],
+    )
+    
+    # Try the fastest broker first, with hot standby this decides which connection starts out active
+    if BROKER_SELECTION == "latency":
+        select_config_brokers(CLIENT_CONFIG, probe_interval=BROKER_PROBE_INTERVAL, background=not HOT_STANDBY)
+
+    # Before the first IntersectClient is constructed, they take their broker clients from the pool
+    if CONNECTION_POOL:
+        pool = ConnectionPool(max_channels=POOL_MAX_CHANNELS).install()
+        BROKER_CONNECTIONS.set_function(pool.connection_count)
+        logger.info(f"Sharing broker connections, up to {POOL_MAX_CHANNELS} clients each")
     
+    if METRICS_PORT:
+        serve(REGISTRY, METRICS_PORT, host=METRICS_HOST)
+
+    telemetry = None
+    if TELEMETRY:
+        telemetry = TelemetryRecorder(TELEMETRY_DIR, file_size=TELEMETRY_FILE_MB * 1024 * 1024, max_files=TELEMETRY_MAX_FILES)
+        logger.info(f"Writing per-count telemetry to {TELEMETRY_DIR}")
+    broker_hosts = [broker.host for control_plane in CLIENT_CONFIG.brokers for broker in control_plane.brokers]
+
+    if CLIENT_RUNNER in ("asyncio", "scatter"):
+        def make_client(user_callback, event_callback):
+            if HOT_STANDBY:
+                client = HotStandbyClient(
+                    split_client_config(CLIENT_CONFIG),
+                    user_callback=count_replies(user_callback),
+                    event_callback=event_callback if TICK_EVENTS else None,
+                    probe_destination=(scatter_destinations or [SERVICE_DESTINATION])[0],
+                    heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                )
+            else:
+                client = IntersectClient(
+                    config=CLIENT_CONFIG,
+                    user_callback=count_replies(user_callback),
+                    event_callback=event_callback if TICK_EVENTS else None,
+                )
+            instrument_client(client)
+            startup_timer.watch(client, 'counting_client', STARTUP_SECONDS)
+            return client
+
+        if scatter_destinations:
+            # One client and connection for every service, each gather waits GATHER_DEADLINE at most
+            async_client = AsyncIntersectClient(make_client, destination=scatter_destinations[0])
+            IN_FLIGHT.set_function(async_client.pending_count)
+            scatter = ScatterGatherClient(async_client, scatter_destinations, deadline=GATHER_DEADLINE)
+            logger.info(f"Polling {len(scatter_destinations)} service(s) at once: {', '.join(scatter_destinations)}")
+            startup_timer.mark('setup')
+            asyncio.run(run_scatter_gather(scatter, poll_interval=PIPELINE_INTERVAL))
+            sys.exit(0)
+
+        # Every orchestrator polls on its own schedule, each request is its own task with its own timeout
+        async_client = AsyncIntersectClient(make_client, destination=SERVICE_DESTINATION)
+        IN_FLIGHT.set_function(async_client.pending_count)
+        if telemetry is not None:
+            telemetry.broker_node = lambda: broker_index(async_client.client, broker_hosts)
+        poll_scheduler = None
+        phase_clock = None
+        if POLL_SCHEDULE == "aligned" and not CLOCK_SYNC:
+            # One timer heap fires every orchestrator's polls, they share one clock sync of the service
+            poll_scheduler = PollScheduler()
+            phase_clock = ClockSync(samples=CLOCK_SAMPLES, lease=CLOCK_LEASE, request_ids=async_client.request_ids)
+        orchestrators = [
+            AsyncCountingOrchestrator(
+                async_client,
+                name=f'client-{i}',
+                poll_interval=PIPELINE_INTERVAL,
+                timeout=PIPELINE_TIMEOUT,
+                tick_events=TICK_EVENTS,
+                tick_timeout=TICK_TIMEOUT,
+                clock=ClockSync(samples=CLOCK_SAMPLES, lease=CLOCK_LEASE, request_ids=async_client.request_ids) if CLOCK_SYNC else None,
+                log_counts=ORCHESTRATORS == 1,
+                telemetry=telemetry,
+                index=i,
+                schedule=PhaseSchedule(phase_clock, interval=PIPELINE_INTERVAL, max_timeout=PIPELINE_TIMEOUT) if poll_scheduler else None,
+                scheduler=poll_scheduler,
+            )
+            for i in range(ORCHESTRATORS)
+        ]
+        logger.info(f"Running {ORCHESTRATORS} orchestrator(s) on asyncio over one connection, press Ctrl+C to exit")
+        startup_timer.mark('setup')
+        asyncio.run(run_orchestrators(async_client, orchestrators, scheduler=poll_scheduler))
+        sys.exit(0)
+
     # Create the orchestrator and client
-    orchestrator = SampleOrchestrator()
-    client = IntersectClient(
-        config=CLIENT_CONFIG,
-        user_callback=orchestrator.client_callback,
-    )
+    pipeline = None
+    if PIPELINE_WINDOW > 0:
+        pipeline = RequestPipeline(PIPELINE_WINDOW, timeout=PIPELINE_TIMEOUT, send_interval=PIPELINE_INTERVAL)
+        logger.info(f"Pipelined polling enabled with {PIPELINE_WINDOW} request(s) in flight")
+    clock = None
+    if CLOCK_SYNC:
+        clock = ClockSync(samples=CLOCK_SAMPLES, lease=CLOCK_LEASE)
+        logger.info(f"Clock sync enabled, counts are computed locally under a {CLOCK_LEASE:.0f}s lease")
+    schedule = None
+    if POLL_SCHEDULE == "aligned" and pipeline is None and clock is None:
+        schedule = PhaseSchedule(ClockSync(samples=CLOCK_SAMPLES, lease=CLOCK_LEASE), interval=PIPELINE_INTERVAL, max_timeout=PIPELINE_TIMEOUT)
+        logger.info("Polls are sent just after the service's count ticks over")
+    orchestrator = SampleOrchestrator(pipeline, tick_events=TICK_EVENTS, clock=clock, telemetry=telemetry, schedule=schedule)
+    if TICK_EVENTS:
+        logger.info(f"Listening for count_tick events, polling only after {TICK_TIMEOUT}s without one")
+    if HOT_STANDBY:
+        client = HotStandbyClient(
+            split_client_config(CLIENT_CONFIG),
+            user_callback=count_replies(orchestrator.client_callback),
+            event_callback=orchestrator.event_callback if TICK_EVENTS else None,
+            probe_destination=SERVICE_DESTINATION,
+            heartbeat_timeout=HEARTBEAT_TIMEOUT,
+        )
+        logger.info(f"Hot standby enabled with {len(client.clients)} broker connection(s)")
+    else:
+        client = IntersectClient(
+            config=CLIENT_CONFIG,
+            user_callback=count_replies(orchestrator.client_callback),
+            event_callback=orchestrator.event_callback if TICK_EVENTS else None,
+        )
+    instrument_client(client)
+    if telemetry is not None:
+        telemetry.instrument(client)
+        telemetry.broker_node = lambda: broker_index(client, broker_hosts)
+    if pipeline is not None:
+        IN_FLIGHT.set_function(pipeline.in_flight)
+    if schedule is not None:
+        PollScheduler().start().add(schedule, lambda: orchestrator.poll_due(client))
+    startup_timer.mark('setup')
+    startup_timer.watch(client, 'counting_client', STARTUP_SECONDS)
     
     print("\n-------------------------------------------------")
     print("| INTERSECT RabbitMQ Clustering Resilience Demo |")
@@ -190,25 +835,12 @@ if __name__ == '__main__':
     print("\nPress Ctrl+C to exit when done\n")
     
     try:
-        # Define a waiting callback that monitors message flow and restarts the chain if needed
-        def waiting_callback(client_instance):
-            # Check if we need to restart the message chain
-            result = orchestrator.check_for_reconnection_needed(client_instance)
-            if result:
-                # If we need to restart, handle the callback result
-                # In this case, add the message to the queue
-                message = result.messages_to_send[0]
-                try:
-                    # Try to send a message directly to restart the chain
-                    client_instance._send_userspace_message(message)
-                except:
-                    pass
-                    
         # Start the client with a short delay between lifecycle checks and our waiting callback
         default_intersect_lifecycle_loop(
             client,
-            delay=1.0,  # Check status frequently for faster recovery
-            waiting_callback=waiting_callback
+            # Check status frequently for faster recovery, pipelined mode, heartbeats and local reads need finer pacing
+            delay=min(1.0, PIPELINE_INTERVAL / 4) if pipeline is not None or HOT_STANDBY or CLOCK_SYNC else 1.0,
+            waiting_callback=orchestrator.waiting_callback
         )
     except KeyboardInterrupt:
         print("\n\nExiting demo. Thanks for using INTERSECT with RabbitMQ clustering!")
\ No newline at end of file
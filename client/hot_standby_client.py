@@ -0,0 +1,228 @@
+"""
+Hot-standby broker connections for the counting client.
+
+Normally the client has one IntersectClient which, once messages stop for 5 seconds, is shut down
+and started up again so the SDK can try the next broker in ``broker_configs``. Every failover
+therefore pays for a full connect, authenticate and subscribe cycle.
+
+HotStandbyClient instead opens one IntersectClient per broker node up front, each pinned to a
+single node and already subscribed to its reply (and event) channels. Traffic goes through the
+active one; when a heartbeat is missed it switches the active pointer to a standby which is
+already connected, so failover is a pointer swap.
+
+HotStandbyClient has the same lifecycle methods as IntersectClient (startup, shutdown, is_connected,
+considered_unrecoverable) so it can be handed to default_intersect_lifecycle_loop.
+"""
+
+import copy
+import logging
+import time
+from typing import Callable, List, Optional
+
+from intersect_sdk import (
+    INTERSECT_JSON_VALUE,
+    IntersectClient,
+    IntersectClientCallback,
+    IntersectClientConfig,
+    IntersectDirectMessageParams,
+)
+
+from sdk_adapter import send_message
+
+logger = logging.getLogger(__name__)
+
+# The standby clients send this on startup and periodically afterwards, to prove their
+# publish and reply paths work before we ever need them. The reply is never shown to the orchestrator.
+PROBE_OPERATION = 'CountingExample.get_snapshot'
+
+
+def split_client_config(client_config: IntersectClientConfig) -> List[IntersectClientConfig]:
+    """Return one copy of the client config per broker node, each listing only that node."""
+    configs = []
+    for control_plane in client_config.brokers:
+        for broker in control_plane.brokers:
+            # ControlPlaneConfig is a dataclass rather than a model, so copy it by hand
+            pinned = copy.copy(control_plane)
+            pinned.brokers = [broker]
+            configs.append(client_config.model_copy(update={'brokers': [pinned]}))
+    return configs
+
+
+class HotStandbyClient:
+    """One pre-connected IntersectClient per broker node, with traffic on the active one."""
+
+    def __init__(
+        self,
+        configs: List[IntersectClientConfig],
+        user_callback: Callable[[str, str, bool, INTERSECT_JSON_VALUE], Optional[IntersectClientCallback]],
+        event_callback: Optional[Callable[[str, str, str, INTERSECT_JSON_VALUE], Optional[IntersectClientCallback]]] = None,
+        probe_destination: str = 'intersect.resilience.clustering-demo.-.counting-service',
+        heartbeat_timeout: float = 1.5,
+        probe_interval: float = 5.0,
+        client_factory: Callable[..., IntersectClient] = IntersectClient,
+    ) -> None:
+        """Create the clients, call startup() to connect them.
+
+        Params:
+          configs: one config per node (see split_client_config). The first one is the primary
+            and keeps the initial messages, the others only send a probe.
+          user_callback: the orchestrator's response callback
+          event_callback: the orchestrator's event callback, only events from the active client are delivered
+          probe_destination: the service to send standby probes to
+          heartbeat_timeout: seconds without a message before the active client is considered dead
+          probe_interval: seconds between probes sent through each standby
+          client_factory: builds each client from (config, user_callback, event_callback),
+            only meant to be changed by the benchmarks
+        """
+        if not configs:
+            raise ValueError('need at least one client config')
+        self.heartbeat_timeout = heartbeat_timeout
+        self.probe_interval = probe_interval
+        self.active_index = 0
+        self.failovers = 0
+        self.last_failover_duration: Optional[float] = None
+
+        self._user_callback = user_callback
+        self._event_callback = event_callback
+        self._probe = IntersectDirectMessageParams(
+            destination=probe_destination,
+            operation=PROBE_OPERATION,
+            payload=['uptime'],
+        )
+        self._probes_pending = [0] * len(configs)
+        self._last_probe_sent = [0.0] * len(configs)
+        self._last_probe_reply = [0.0] * len(configs)
+
+        self.clients: List[IntersectClient] = []
+        for index, config in enumerate(configs):
+            if index > 0:
+                self._probes_pending[index] = 1
+                config = config.model_copy(
+                    update={
+                        'initial_message_event_config': config.initial_message_event_config.model_copy(
+                            update={'messages_to_send': [self._probe]}
+                        ),
+                    }
+                )
+            self.clients.append(
+                client_factory(
+                    config=config,
+                    user_callback=self._make_user_callback(index),
+                    event_callback=self._make_event_callback(index) if event_callback else None,
+                )
+            )
+
+    @property
+    def active(self) -> IntersectClient:
+        """The client traffic currently goes through."""
+        return self.clients[self.active_index]
+
+    def startup(self) -> 'HotStandbyClient':
+        for index, client in enumerate(self.clients):
+            try:
+                client.startup()
+            except Exception as e:
+                logger.error(f"Could not start client for broker node {index}: {e}")
+        return self
+
+    def shutdown(self, reason: Optional[str] = None) -> 'HotStandbyClient':
+        for client in self.clients:
+            client.shutdown(reason)
+        return self
+
+    def is_connected(self) -> bool:
+        return self.active.is_connected()
+
+    def considered_unrecoverable(self) -> bool:
+        return all(client.considered_unrecoverable() for client in self.clients)
+
+    def _send_userspace_message(self, params: IntersectDirectMessageParams) -> None:
+        """Send through the active client. Named like IntersectClient's method so callers need not care."""
+        send_message(self.active, params)
+
+    def check_heartbeat(self, last_message_time: float) -> bool:
+        """Switch to a standby if the active client lost its connection or went quiet.
+
+        Params:
+          last_message_time: wall clock time the orchestrator last received anything
+
+        Returns:
+            True if a heartbeat was missed, in which case the caller should resend whatever it
+            was waiting on. This is through a standby if one is connected, otherwise the
+            active client is retried.
+        """
+        now = time.time()
+        self._send_probes(now)
+        silent = last_message_time > 0 and now - last_message_time > self.heartbeat_timeout
+        if self.active.is_connected() and not silent:
+            return False
+
+        candidate = self._pick_standby()
+        if candidate is None:
+            # nothing to switch to, the request we were waiting on may just have been lost
+            return self.active.is_connected()
+        started = time.perf_counter()
+        previous = self.active_index
+        self.active_index = candidate
+        self.failovers += 1
+        self.last_failover_duration = time.perf_counter() - started
+        logger.warning(
+            f"Heartbeat missed on broker node {previous} "
+            f"({now - last_message_time:.1f}s since last message), switched to hot standby node {candidate}"
+        )
+        return True
+
+    def _pick_standby(self) -> Optional[int]:
+        """The connected standby which answered a probe most recently, if any."""
+        standbys = [
+            i for i, client in enumerate(self.clients)
+            if i != self.active_index and client.is_connected()
+        ]
+        if not standbys:
+            return None
+        return max(standbys, key=lambda i: self._last_probe_reply[i])
+
+    def _send_probes(self, now: float) -> None:
+        for index, client in enumerate(self.clients):
+            if index == self.active_index or now - self._last_probe_sent[index] < self.probe_interval:
+                continue
+            if not client.is_connected():
+                continue
+            self._last_probe_sent[index] = now
+            self._probes_pending[index] += 1
+            try:
+                send_message(client, self._probe)
+            except Exception as e:
+                logger.warning(f"Could not probe standby broker node {index}: {e}")
+
+    def _make_user_callback(self, index: int):
+        def callback(
+            source: str, operation: str, has_error: bool, payload: INTERSECT_JSON_VALUE
+        ) -> Optional[IntersectClientCallback]:
+            # our own probes are answered here and never reach the orchestrator
+            if operation == PROBE_OPERATION and self._probes_pending[index] > 0:
+                self._probes_pending[index] -= 1
+                if not has_error:
+                    self._last_probe_reply[index] = time.time()
+                return None
+            # replies to messages sent before a switch still come back on the old client, that's fine
+            result = self._user_callback(source, operation, has_error, payload)
+            if result is not None and index != self.active_index:
+                # follow-up messages always go through the active client
+                for message in result.messages_to_send:
+                    self._send_userspace_message(message)
+                return None
+            return result
+
+        return callback
+
+    def _make_event_callback(self, index: int):
+        def callback(
+            source: str, operation: str, event_name: str, payload: INTERSECT_JSON_VALUE
+        ) -> Optional[IntersectClientCallback]:
+            # every client is subscribed so a standby is ready, but only deliver each event once
+            if index != self.active_index:
+                return None
+            return self._event_callback(source, operation, event_name, payload)
+
+        return callback
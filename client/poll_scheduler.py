@@ -0,0 +1,313 @@
+"""
+Phase-aligned polling for the counting client.
+
+The service's count ticks over at fixed boundaries, count = int(server time - start_time). A client
+which polls once per reply plus a fixed sleep drifts against them. Sooner or later one poll is read
+just before a boundary and the next one just after the boundary following it, which looks like a
+skipped count, or two polls are read within one tick and return the same count twice.
+
+PhaseSchedule plans the polls of one service so each is read just after a boundary:
+
+- where the boundaries are comes from a ClockSync (clock_sync.py), whose get_clock samples give the
+  service's start_time and clock offset to within half a round trip. The orchestrator keeps it
+  synced, the schedule only reads it, and keeps the last synced boundaries while a new sync is
+  under way. Every poll reply bounds the boundaries as well: a reply with count c was read before
+  it arrived, so the boundary of count c can't be later than the receive time. The schedule aims
+  at the latest boundary all of these allow.
+- a poll is sent half the quickest recent round trip before the service should read it, and aimed
+  a margin after the boundary which grows with the round-trip jitter, so the read stays on the
+  right side of the boundary as latency changes
+- the request timeout follows the round trips too, smoothed RTT plus four deviations as in TCP's
+  retransmission timer
+- a count which the boundaries can't explain (a restart or reset_count) drops them, and the clock
+  is synced again
+
+Poll replies alone only give upper bounds, and a poll aimed at one just reproduces it, so they
+can't find the boundaries on their own. Until the clock has synced once (and without a clock, or
+when the service doesn't support get_clock) the schedule polls at its plain interval.
+
+PollScheduler fires any number of schedules from one timer heap, on a thread of its own (start())
+or as an asyncio task (run()), instead of every poll chain sleeping in a callback or a task.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from clock_sync import ClockSync
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseSchedule:
+    """When to poll one service so the service reads its count just after the count ticks over.
+
+    observe() every poll reply, the scheduler asks next_poll() when to send and reports the poll it
+    fired with fired(). All methods are thread-safe.
+    """
+
+    def __init__(
+        self,
+        clock: Optional[ClockSync] = None,
+        interval: float = 1.0,
+        tick: float = 1.0,
+        window: int = 16,
+        min_margin: float = 0.005,
+        min_timeout: float = 0.25,
+        max_timeout: float = 3.0,
+    ) -> None:
+        """
+        Params:
+          clock: tells where the boundaries are, None (or a clock which never syncs) polls at the
+            plain interval
+          interval: seconds between polls, rounded to whole ticks once the boundaries are known
+          tick: seconds per count on the service
+          window: recent replies the boundaries and the quickest round trip are taken from, older
+            ones are dropped so the estimates follow clock drift and route changes
+          min_margin: seconds after the boundary a poll is aimed at, when there is no jitter
+          min_timeout, max_timeout: bounds of the request timeout
+        """
+        self.clock = clock
+        self.interval = interval
+        self.tick = tick
+        self.stride = max(1, round(interval / tick))
+        self.min_margin = min_margin
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.resets = 0
+
+        # (latest local monotonic time count 0 can have begun, round trip) per reply
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        # the same bound from the last clock lease, nothing is aligned without one
+        self._anchor: Optional[float] = None
+        self._fired_count: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def observe(self, sent_at: float, received_at: float, count: int) -> None:
+        """Feed a poll reply.
+
+        Params:
+          sent_at: local monotonic time the request was handed to the SDK
+          received_at: local monotonic time the reply arrived
+          count: the count in the reply
+        """
+        rtt = received_at - sent_at
+        bound = received_at - count * self.tick
+        with self._lock:
+            if self.srtt is None:
+                self.srtt, self.rttvar = rtt, rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            epoch = self._epoch()
+            # the count was read after sending, so count 0 began after sent_at - (count + 1) ticks. If
+            # that is past the latest possible epoch, the boundaries belong to a counter which is gone
+            if epoch is not None and sent_at - (count + 1) * self.tick > epoch:
+                logger.info('Count %d is %.3fs off the count boundaries (service restarted?), phase-aligning again', count, sent_at - (count + 1) * self.tick - epoch)
+                self._samples.clear()
+                self._anchor = None
+                self._fired_count = None
+                self.resets += 1
+                if self.clock is not None:
+                    self.clock.invalidate()
+            self._samples.append((bound, rtt))
+
+    def _epoch(self) -> Optional[float]:
+        if self.clock is not None and self.clock.lease_valid():
+            # the lease knows the epoch to within half its best round trip
+            self._anchor = self.clock.start_time - self.clock.offset + self.clock.rtt / 2
+        if self._anchor is None:
+            return None
+        return min([self._anchor] + [bound for bound, _ in self._samples])
+
+    @property
+    def epoch(self) -> Optional[float]:
+        """The latest local monotonic time count 0 can have begun, None until it is known."""
+        with self._lock:
+            return self._epoch()
+
+    @property
+    def margin(self) -> float:
+        """Seconds after the latest possible boundary a poll is aimed at."""
+        with self._lock:
+            return self._margin()
+
+    def _margin(self) -> float:
+        return min(self.tick / 2, self.min_margin + (self.rttvar or 0.0))
+
+    @property
+    def timeout(self) -> float:
+        """Seconds to wait for a reply before giving up on it."""
+        with self._lock:
+            if self.srtt is None:
+                return self.max_timeout
+            return min(self.max_timeout, max(self.min_timeout, self.srtt + 4 * self.rttvar))
+
+    def next_poll(self, after: float) -> Tuple[float, Optional[int]]:
+        """When to send the poll following one sent at `after`.
+
+        Returns:
+            The local monotonic send time, and the count the poll will read (None while the
+            boundaries are unknown), to pass to fired()
+        """
+        with self._lock:
+            epoch = self._epoch()
+            if epoch is None:
+                return after + self.interval, None
+            # half the quickest round trip is how long a request takes to reach the service
+            lead = min(rtt for _, rtt in self._samples) / 2 if self._samples else (self.clock.rtt or 0.0) / 2
+            offset = self._margin() - lead
+            count = math.floor((after - epoch - offset) / self.tick) + 1
+            if self._fired_count is not None:
+                count = max(count, self._fired_count + self.stride)
+            return epoch + count * self.tick + offset, count
+
+    def fired(self, count: Optional[int]) -> None:
+        """The poll planned for count went out (or was passed over), plan the next one after it."""
+        with self._lock:
+            if count is not None:
+                self._fired_count = count
+
+
+@dataclass(order=True)
+class _Timer:
+    due: float
+    seq: int
+    schedule: PhaseSchedule = field(compare=False)
+    fire: Callable[[], None] = field(compare=False)
+    after: float = field(compare=False)
+    """
+    When the previous poll of the schedule went out
+    """
+    first: bool = field(default=True, compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+
+class PollScheduler:
+    """Fires the polls of many PhaseSchedules from one timer heap.
+
+    Each schedule has one timer on the heap. When it comes due the scheduler asks the schedule
+    again, since replies which arrived meanwhile may have moved the poll, and either fires it and
+    queues the next one or puts it back at its new time.
+    """
+
+    def __init__(self) -> None:
+        self.fired = 0
+        self._heap: List[_Timer] = []
+        self._timers: Dict[int, _Timer] = {}
+        self._seq = itertools.count()
+        self._changed = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def add(self, schedule: PhaseSchedule, fire: Callable[[], None], first: Optional[float] = None) -> None:
+        """Call fire() whenever the schedule wants a poll sent, starting at first (default: now).
+
+        fire() runs on the scheduler's thread or event loop and should only hand the request off,
+        it holds up every other schedule while it runs.
+        """
+        now = time.monotonic()
+        timer = _Timer(now if first is None else first, next(self._seq), schedule, fire, now)
+        with self._changed:
+            self._timers[id(schedule)] = timer
+            heapq.heappush(self._heap, timer)
+        self._notify()
+
+    def remove(self, schedule: PhaseSchedule) -> None:
+        with self._changed:
+            timer = self._timers.pop(id(schedule), None)
+            if timer is not None:
+                timer.cancelled = True
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def run_due(self, now: Optional[float] = None) -> Optional[float]:
+        """Fire every poll which is due.
+
+        Returns:
+            When the next poll is due, None if no schedule is left
+        """
+        now = time.monotonic() if now is None else now
+        while True:
+            with self._changed:
+                while self._heap and self._heap[0].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    return None
+                timer = self._heap[0]
+                if timer.due > now:
+                    return timer.due
+                heapq.heappop(self._heap)
+                due, count = (now, None) if timer.first else timer.schedule.next_poll(timer.after)
+                if due > now:
+                    # a reply moved the poll later since it was queued
+                    timer.due = due
+                    heapq.heappush(self._heap, timer)
+                    continue
+                timer.schedule.fired(count)
+                timer.after = now
+                timer.first = False
+                timer.due, _ = timer.schedule.next_poll(now)
+                timer.seq = next(self._seq)
+                heapq.heappush(self._heap, timer)
+            self.fired += 1
+            try:
+                timer.fire()
+            except Exception:
+                logger.exception('Poll callback raised')
+
+    def start(self) -> 'PollScheduler':
+        """Fire polls from a thread of its own, for callers without an event loop."""
+        self._thread = threading.Thread(target=self._run_thread, daemon=True, name='poll_scheduler')
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run_thread(self) -> None:
+        while True:
+            due = self.run_due()
+            with self._changed:
+                if self._stopped:
+                    return
+                self._changed.wait(None if due is None else max(0.0, due - time.monotonic()))
+
+    async def run(self) -> None:
+        """Fire polls from the running event loop until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                due = self.run_due()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if due is None else max(0.0, due - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = None
+
+    def _notify(self) -> None:
+        with self._changed:
+            self._changed.notify_all()
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wakeup.set)
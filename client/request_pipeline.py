@@ -0,0 +1,120 @@
+"""
+Pipelined request tracking for the counting client.
+
+The default client runs a strict request-reply chain: every reply triggers exactly one new request.
+A single dropped message stalls that chain until the reconnection check notices the silence.
+
+RequestPipeline instead keeps up to ``window`` requests in flight at once. Each request carries a
+correlation ID in its payload (the service echoes it back from ``get_count_tagged``), so replies can
+arrive in any order, a lost message only costs one sample, and every request gets its own timeout
+and round-trip time.
+"""
+
+import itertools
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class InFlightRequest:
+    """Bookkeeping for a single outstanding request."""
+
+    request_id: int
+    """
+    The correlation ID sent in the request payload
+    """
+    sent_at: float
+    """
+    Monotonic time the request was handed to the SDK
+    """
+
+
+class RequestPipeline:
+    """Tracks a bounded window of in-flight requests matched by correlation ID.
+
+    The pipeline does not send anything itself, it only decides *when* a new request may go out
+    and hands back the correlation ID to put in its payload. This keeps it independent of the
+    SDK thread which delivers replies and the lifecycle loop which tops the window back up.
+
+    All methods are thread-safe.
+    """
+
+    def __init__(self, window: int, timeout: float = 5.0, send_interval: float = 1.0) -> None:
+        """Create a pipeline.
+
+        Params:
+          window: maximum number of requests allowed in flight at once
+          timeout: seconds after which an unanswered request is given up on
+          send_interval: minimum seconds between two consecutive requests, this keeps the
+            sampling rate of the original chain while allowing several samples to overlap
+        """
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        self.window = window
+        self.timeout = timeout
+        self.send_interval = send_interval
+
+        self._ids = itertools.count(1)
+        self._in_flight: Dict[int, InFlightRequest] = {}
+        self._last_send: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        """Return the number of requests currently awaiting a reply."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def acquire(self, now: Optional[float] = None) -> Optional[int]:
+        """Reserve a slot for a new request if the window and send interval allow one.
+
+        Returns:
+            The correlation ID to send with the request, or None if no request should be sent yet
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if len(self._in_flight) >= self.window:
+                return None
+            if self._last_send is not None and now - self._last_send < self.send_interval:
+                return None
+            request_id = next(self._ids)
+            self._in_flight[request_id] = InFlightRequest(request_id=request_id, sent_at=now)
+            self._last_send = now
+            return request_id
+
+    def complete(self, request_id: int, now: Optional[float] = None) -> Optional[float]:
+        """Match a reply to its request.
+
+        Returns:
+            The round-trip time in seconds, or None if the ID is unknown (already timed out,
+            duplicated by a broker redelivery, or from a previous client run)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            request = self._in_flight.pop(request_id, None)
+            if request is None:
+                return None
+            return now - request.sent_at
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[int, float]]:
+        """Drop every request older than the timeout, freeing its slot.
+
+        Returns:
+            A list of (request_id, age in seconds) for each request which timed out
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            for request_id, request in list(self._in_flight.items()):
+                age = now - request.sent_at
+                if age > self.timeout:
+                    del self._in_flight[request_id]
+                    expired.append((request_id, age))
+        return expired
+
+    def reset(self) -> None:
+        """Forget every in-flight request, e.g. after the client reconnected to another broker."""
+        with self._lock:
+            self._in_flight.clear()
+            self._last_send = None
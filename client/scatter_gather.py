@@ -0,0 +1,352 @@
+"""
+Scatter-gather across many counting services, with consistent hashing for keyed requests.
+
+AsyncIntersectClient talks to one service. ScatterGatherClient sends through the same client (and
+broker connection) to a set of services, each running under its own hierarchy name
+(SERVICE_NAME on the service side):
+
+- gather() sends an operation to every service at once and waits for the replies, each with its
+  own deadline. A service which misses its deadline is reported as such, it can't hold up the
+  result past its deadline. The result has every service's reply or error and its latency.
+- request() routes a keyed request to one service, picked by a consistent hash ring of the
+  services. The same key always goes to the same service, and adding or removing a service only
+  moves the keys that hashed next to it, about 1/N of them, instead of nearly all of them like
+  hash(key) % N would.
+
+The services are given as a comma-separated list in which an entry can be a pattern with
+{first..last} number ranges or {a,b} alternatives, e.g. 'counting-service-{1..4}'. Entries
+without a dot are service names in the demo's system (DESTINATION_PREFIX).
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import re
+import signal
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from intersect_sdk import INTERSECT_JSON_VALUE
+
+from async_runner import AsyncIntersectClient, ReplyError, RequestLost
+from client_metrics import GATHER_MISSING, GATHER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DESTINATION_PREFIX = 'intersect.resilience.clustering-demo.-.'
+
+_BRACES = re.compile(r'\{([^{}]*)\}')
+_RANGE = re.compile(r'^(-?\d+)\.\.(-?\d+)$')
+
+
+def expand_destinations(spec: str, prefix: str = DESTINATION_PREFIX) -> List[str]:
+    """Turn a list of destinations and destination patterns into destinations.
+
+    Params:
+      spec: comma-separated entries, each may contain {first..last} and {a,b} groups
+      prefix: put in front of entries without a dot
+
+    Returns:
+        The destinations in order, without duplicates
+
+    Raises:
+      ValueError: spec names no destination or has an unbalanced brace
+    """
+    destinations: List[str] = []
+    for entry in _split_top_level(spec):
+        for name in _expand(entry.strip()):
+            destination = name if '.' in name else prefix + name
+            if name and destination not in destinations:
+                destinations.append(destination)
+    if not destinations:
+        raise ValueError(f'no service destinations in {spec!r}')
+    return destinations
+
+
+def _split_top_level(spec: str) -> List[str]:
+    """Split at the commas outside of braces."""
+    entries, depth, start = [], 0, 0
+    for index, char in enumerate(spec):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f'unbalanced braces in {spec!r}')
+        elif char == ',' and depth == 0:
+            entries.append(spec[start:index])
+            start = index + 1
+    if depth:
+        raise ValueError(f'unbalanced braces in {spec!r}')
+    entries.append(spec[start:])
+    return entries
+
+
+def _expand(pattern: str) -> List[str]:
+    match = _BRACES.search(pattern)
+    if match is None:
+        return [pattern]
+    number_range = _RANGE.match(match.group(1))
+    if number_range:
+        first, last = int(number_range.group(1)), int(number_range.group(2))
+        step = 1 if last >= first else -1
+        # {01..10} keeps the zero padding
+        width = len(number_range.group(1)) if number_range.group(1).startswith('0') else 0
+        choices = [str(n).zfill(width) for n in range(first, last + step, step)]
+    else:
+        choices = match.group(1).split(',')
+    head, tail = pattern[:match.start()], pattern[match.end():]
+    return [expanded for choice in choices for expanded in _expand(head + choice + tail)]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring, each node is placed at `replicas` points so keys spread evenly."""
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 100) -> None:
+        """
+        Params:
+          nodes: the initial nodes
+          replicas: points per node, more spread the keys more evenly at the cost of memory
+        """
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key: Any) -> str:
+        """The node owning key, the first one clockwise from the key's hash.
+
+        Raises:
+          LookupError: the ring is empty
+        """
+        if not self._points:
+            raise LookupError('no nodes on the hash ring')
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[index]
+
+
+@dataclass
+class TargetResult:
+    """One service's part of a gather."""
+
+    destination: str
+    value: INTERSECT_JSON_VALUE = None
+    error: Optional[str] = None
+    """
+    None if the service replied, 'timeout', 'lost' (the connection was restarted) or the error reply
+    """
+    latency: float = 0.0
+    """
+    Seconds from sending to the reply, or to giving up
+    """
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class GatherResult:
+    """Every service's reply or error for one gather."""
+
+    operation: str
+    targets: List[TargetResult] = field(default_factory=list)
+    elapsed: float = 0.0
+    """
+    Seconds from sending to the last reply or deadline
+    """
+
+    @property
+    def replies(self) -> Dict[str, INTERSECT_JSON_VALUE]:
+        """Destination -> reply, for the services which replied."""
+        return {target.destination: target.value for target in self.targets if target.ok}
+
+    @property
+    def missing(self) -> List[str]:
+        """The services which didn't reply in time or replied with an error."""
+        return [target.destination for target in self.targets if not target.ok]
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+
+class ScatterGatherClient:
+    """Sends through an AsyncIntersectClient to many services, see the module docstring.
+
+    Only call methods from the event loop's thread.
+    """
+
+    def __init__(
+        self,
+        client: AsyncIntersectClient,
+        destinations: List[str],
+        deadline: float = 1.0,
+        deadlines: Optional[Dict[str, float]] = None,
+        replicas: int = 100,
+    ) -> None:
+        """
+        Params:
+          client: the client to send through, it may also be used on its own
+          destinations: the services, see expand_destinations()
+          deadline: seconds each service gets to reply to a gather
+          deadlines: per-service deadlines overriding deadline, e.g. for a service far away
+          replicas: points per service on the hash ring
+        """
+        self.client = client
+        self.destinations = list(destinations)
+        self.deadline = deadline
+        self.deadlines = dict(deadlines or {})
+        self.ring = HashRing(self.destinations, replicas)
+
+    def add_destination(self, destination: str) -> None:
+        if destination not in self.destinations:
+            self.destinations.append(destination)
+            self.ring.add(destination)
+
+    def remove_destination(self, destination: str) -> None:
+        """Stop sending to a service, its keys move to the services next to it on the ring."""
+        if destination in self.destinations:
+            self.destinations.remove(destination)
+            self.ring.remove(destination)
+
+    def destination_for(self, key: Any) -> str:
+        return self.ring.node_for(key)
+
+    async def request(
+        self,
+        key: Any,
+        operation: str,
+        payload: INTERSECT_JSON_VALUE = None,
+        timeout: Optional[float] = None,
+        request_id: Optional[int] = None,
+    ) -> INTERSECT_JSON_VALUE:
+        """Send a request to the service owning key and wait for its reply.
+
+        Raises:
+          the same as AsyncIntersectClient.request()
+        """
+        return await self.client.request(operation, payload, timeout, request_id, destination=self.destination_for(key))
+
+    async def gather(
+        self,
+        operation: str,
+        payload: INTERSECT_JSON_VALUE = None,
+        request_id: Optional[int] = None,
+        destinations: Optional[List[str]] = None,
+    ) -> GatherResult:
+        """Send a request to every service at once and collect the replies.
+
+        Params:
+          operation: 'Capability.function'
+          payload: the request payload, the same for every service
+          request_id: the correlation ID the replies will carry, every service gets the same one
+          destinations: only ask these services
+
+        Returns:
+            Every service's reply or error, once all replied or missed their deadlines
+        """
+        started = time.perf_counter()
+        targets = await asyncio.gather(*(
+            self._ask(destination, operation, payload, request_id) for destination in (destinations or self.destinations)
+        ))
+        result = GatherResult(operation, list(targets), time.perf_counter() - started)
+        GATHER_SECONDS.labels(operation).observe(result.elapsed)
+        for destination in result.missing:
+            GATHER_MISSING.labels(destination).inc()
+        return result
+
+    async def _ask(self, destination: str, operation: str, payload: INTERSECT_JSON_VALUE, request_id: Optional[int]) -> TargetResult:
+        target = TargetResult(destination)
+        sent_at = time.perf_counter()
+        try:
+            target.value = await self.client.request(
+                operation, payload, self.deadlines.get(destination, self.deadline), request_id, destination=destination,
+            )
+        except asyncio.TimeoutError:
+            target.error = 'timeout'
+        except RequestLost:
+            target.error = 'lost'
+        except ReplyError as e:
+            target.error = str(e)
+        target.latency = time.perf_counter() - sent_at
+        return target
+
+
+def short_name(destination: str) -> str:
+    """The service part of a destination, for log lines."""
+    return destination[len(DESTINATION_PREFIX):] if destination.startswith(DESTINATION_PREFIX) else destination
+
+
+async def run_scatter_gather(scatter: ScatterGatherClient, poll_interval: float = 1.0) -> None:
+    """Start every service's counter, then gather get_count_tagged every poll_interval until SIGTERM, SIGINT or cancellation."""
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, main_task.cancel)
+
+    client = scatter.client
+    await client.start()
+    try:
+        # keep asking the services which haven't answered, a slow one doesn't hold up the others' polling
+        waiting = list(scatter.destinations)
+        last_counts: Dict[str, int] = {}
+        next_at = loop.time()
+        while True:
+            if waiting:
+                started = await scatter.gather('CountingExample.start_count', destinations=waiting)
+                waiting = started.missing
+                if started.replies:
+                    logger.info(f"Counter started on {', '.join(short_name(d) for d in started.replies)}")
+            request_id = next(client.request_ids)
+            result = await scatter.gather('CountingExample.get_count_tagged', request_id, request_id=request_id)
+            parts = []
+            for target in result.targets:
+                name = short_name(target.destination)
+                if not target.ok:
+                    parts.append(f'{name} {target.error} ({target.latency * 1000:.0f}ms)')
+                    continue
+                count_value = target.value['count']
+                previous = last_counts.get(target.destination, -1)
+                if previous >= 0 and count_value > previous + 1:
+                    logger.warning(f"[{name}] Skipped {count_value - previous - 1} count(s)! Server: {count_value}")
+                last_counts[target.destination] = count_value
+                parts.append(f'{name} {count_value} ({target.latency * 1000:.1f}ms)')
+            logger.info(
+                f"{len(result.replies)}/{len(result.targets)} services in {result.elapsed * 1000:.1f}ms: {', '.join(parts)}"
+            )
+            next_at += poll_interval
+            now = loop.time()
+            if next_at < now:
+                next_at = now
+            await asyncio.sleep(next_at - now)
+    except asyncio.CancelledError:
+        logger.info('Stopping scatter-gather')
+    finally:
+        await client.stop('client exiting')
@@ -0,0 +1,58 @@
+"""
+The one place the client reaches into the SDK's private API.
+
+IntersectClient only sends the messages its callbacks return and its initial messages. The client
+also sends outside of callbacks (restarting a chain, scheduled polls, asyncio requests) and watches
+every message going out (metrics, telemetry). The SDK has no public API for either, only the
+private IntersectClient._send_userspace_message. Everything goes through send_message() and
+wrap_send() below, and the method is checked when this module is imported, so an SDK which renames
+or drops it fails at startup rather than at the first send.
+"""
+
+import logging
+from typing import Any, Callable
+
+import intersect_sdk
+from intersect_sdk import IntersectClient, IntersectDirectMessageParams
+
+logger = logging.getLogger(__name__)
+
+# SDK releases (major.minor) whose IntersectClient._send_userspace_message(params) has been used with this client
+TESTED_SDK_VERSIONS = ('0.8',)
+
+Send = Callable[[IntersectDirectMessageParams], Any]
+
+
+def check_sdk() -> None:
+    """Make sure the installed SDK has the private method, warn if it's a release nobody tried.
+
+    Raises:
+      ImportError: IntersectClient has no _send_userspace_message
+    """
+    version = getattr(intersect_sdk, '__version__', 'unknown')
+    if not callable(getattr(IntersectClient, '_send_userspace_message', None)):
+        raise ImportError(f"intersect_sdk {version} has no IntersectClient._send_userspace_message, update client/sdk_adapter.py")
+    if '.'.join(version.split('.')[:2]) not in TESTED_SDK_VERSIONS:
+        logger.warning(f"intersect_sdk {version} is untested, sending relies on IntersectClient._send_userspace_message")
+
+
+check_sdk()
+
+
+def send_message(client: Any, params: IntersectDirectMessageParams) -> Any:
+    """Send a message from outside of a callback.
+
+    Params:
+      client: an IntersectClient, or a HotStandbyClient which sends through its active client
+      params: the message
+    """
+    return client._send_userspace_message(params)
+
+
+def wrap_send(client: Any, wrapper: Callable[[Send], Send]) -> None:
+    """Pass every message an IntersectClient (or each client of a HotStandbyClient) sends through wrapper(send).
+
+    The SDK sends callback results through the same method, so the wrapper sees everything.
+    """
+    for inner in getattr(client, 'clients', [client]):
+        inner._send_userspace_message = wrapper(inner._send_userspace_message)
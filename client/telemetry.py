@@ -0,0 +1,217 @@
+"""
+A binary record of every count the client observes, for offline analysis of long runs.
+
+Each count, and each request given up on, becomes one fixed-size 32 byte record (RECORD):
+
+    sent_at         float64  wall clock time the request was sent, 0 if there was no request
+    received_at     float64  wall clock time the count arrived (or the request was given up on)
+    count           int64    the count, -1 for a timeout
+    client_elapsed  float32  seconds since the client started the counter
+    broker          uint8    index of the broker node in the client config, 255 if unknown
+    flags           uint8    see the FLAG_ constants
+    orchestrator    uint16   which orchestrator recorded it, 0 unless several share the process
+
+Records are appended to a buffer under a lock and a background thread writes the buffer out in
+bulk, so recording costs one struct.pack and never touches the disk on the caller's thread.
+Files start with a 32 byte HEADER and are named so they sort in the order they were written.
+When one reaches its size limit the next one is started, and the oldest are deleted past a
+maximum file count.
+
+analyze_telemetry.py reads the files back.
+"""
+
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CTEL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHd16x')
+"""
+magic, version, record size, wall clock time the file was created, padding to 32 bytes
+"""
+RECORD = struct.Struct('<ddqfBBH')
+
+FILE_PREFIX = 'telemetry-'
+FILE_SUFFIX = '.bin'
+
+FLAG_RECONNECTED = 1
+"""
+The first count after a reconnect or hot standby switch
+"""
+FLAG_TIMEOUT = 2
+"""
+No reply, the request was given up on
+"""
+FLAG_EVENT = 4
+"""
+Pushed by a count_tick event rather than requested
+"""
+FLAG_LOCAL = 8
+"""
+Computed locally from a clock lease rather than requested
+"""
+
+UNKNOWN_BROKER = 255
+
+
+def broker_index(client: Any, hosts: List[str]) -> int:
+    """Which of hosts the client is connected to, UNKNOWN_BROKER if that can't be told.
+
+    Works for a HotStandbyClient (its active client), and for an IntersectClient whose broker
+    connection exposes its host, which the SDK doesn't guarantee.
+    """
+    active_index = getattr(client, 'active_index', None)
+    if active_index is not None:
+        return active_index
+    try:
+        provider = client._control_plane_manager._control_providers[0]
+        connection = getattr(provider, '_connection', None)
+        host = getattr(connection, '_host', None) or getattr(provider, 'host', None)
+        return hosts.index(host)
+    except (AttributeError, IndexError, ValueError):
+        return UNKNOWN_BROKER
+
+
+class TelemetryRecorder:
+    """Buffers records and writes them to rotating files in a directory from a background thread."""
+
+    def __init__(
+        self,
+        directory: str,
+        file_size: int = 64 * 1024 * 1024,
+        max_files: int = 0,
+        flush_interval: float = 1.0,
+        buffer_size: int = 64 * 1024,
+    ) -> None:
+        """
+        Params:
+          directory: where to put the files, created if missing
+          file_size: start a new file once one reaches this many bytes
+          max_files: delete the oldest files past this many, 0 keeps them all
+          flush_interval: seconds between writes, at most
+          buffer_size: write early once this many bytes are waiting
+        """
+        self.directory = directory
+        self.file_size = file_size
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.records = 0
+        # set once the client exists, see broker_index
+        self.broker_node: Callable[[], int] = lambda: UNKNOWN_BROKER
+
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._file: Optional[BinaryIO] = None
+        self._file_bytes = 0
+        self._sequence = 0
+        self._last_sent: Dict[str, float] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True, name='telemetry_writer')
+        self._thread.start()
+        atexit.register(self.close)
+
+    def instrument(self, client: Any) -> None:
+        """Note when requests go out, for request-reply chains which don't time their requests themselves."""
+        # imported here, analyze_telemetry.py reads the records with the standard library alone
+        from sdk_adapter import wrap_send
+
+        wrap_send(client, self._noting_send)
+
+    def last_sent(self, operation: str) -> float:
+        """Wall clock time the last request for operation was sent, 0 if none was."""
+        return self._last_sent.get(operation, 0.0)
+
+    def record(
+        self,
+        sent_at: float,
+        received_at: float,
+        count: int,
+        client_elapsed: float,
+        flags: int = 0,
+        orchestrator: int = 0,
+    ) -> None:
+        """Append one record, see the module docstring for the fields."""
+        data = RECORD.pack(sent_at, received_at, count, client_elapsed, self.broker_node(), flags, orchestrator)
+        with self._lock:
+            self._buffer += data
+            self.records += 1
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self._wake.set()
+
+    def close(self) -> None:
+        """Write what's buffered and stop, further records are dropped."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._thread.join()
+
+    def _noting_send(self, send: Callable[[Any], None]) -> Callable[[Any], None]:
+        def noting_send(params: Any) -> None:
+            self._last_sent[params.operation] = time.time()
+            return send(params)
+
+        return noting_send
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush()
+        self._flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self) -> None:
+        with self._lock:
+            if not self._buffer:
+                return
+            data, self._buffer = self._buffer, bytearray()
+        try:
+            view = memoryview(data)
+            while view:
+                if self._file is None or self._file_bytes >= self.file_size:
+                    self._rotate()
+                # whole records only, so every file can be read on its own
+                room = max(RECORD.size, (self.file_size - self._file_bytes) // RECORD.size * RECORD.size)
+                chunk = view[:room]
+                self._file.write(chunk)
+                self._file_bytes += len(chunk)
+                view = view[room:]
+            self._file.flush()
+        except OSError as e:
+            logger.error(f"Could not write telemetry to {self.directory}: {e}")
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        now = time.time()
+        name = f"{FILE_PREFIX}{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{os.getpid()}-{self._sequence:04d}{FILE_SUFFIX}"
+        self._sequence += 1
+        self._file = open(os.path.join(self.directory, name), 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, now))
+        self._file_bytes = HEADER.size
+        if self.max_files:
+            for old in telemetry_files(self.directory)[:-self.max_files]:
+                os.remove(old)
+
+
+def telemetry_files(directory: str) -> List[str]:
+    """The telemetry files in directory, oldest first."""
+    names = sorted(
+        name for name in os.listdir(directory) if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)
+    )
+    return [os.path.join(directory, name) for name in names]
@@ -0,0 +1,6 @@
+"""
+Code shared by the counting service and the counting client.
+
+The service and client containers each mount only their own directory, so anything both of them
+need lives here and is mounted at /opt/clustering_common (see docker-compose.yml).
+"""
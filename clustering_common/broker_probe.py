@@ -0,0 +1,156 @@
+"""
+Lightweight broker health and latency probes.
+
+A probe opens a plain TCP connection to a broker and performs just enough of the MQTT 3.1.1 or
+AMQP 0-9-1 handshake to know that the broker accepts a session with our credentials:
+
+- MQTT: CONNECT, wait for CONNACK, DISCONNECT
+- AMQP: protocol header, wait for Connection.Start, send Connection.Start-Ok (PLAIN), wait for
+  Connection.Tune, then close the socket
+
+This costs a few packets and needs no client library, so it can run before the SDK is imported
+and as often as needed in the background.
+"""
+
+import socket
+import struct
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class ProbeResult:
+    """Outcome of probing one broker."""
+
+    host: str
+    port: int
+    healthy: bool
+    """
+    True if the broker accepted a session with our credentials
+    """
+    connect_time: Optional[float] = None
+    """
+    Seconds to open the TCP connection
+    """
+    handshake_time: Optional[float] = None
+    """
+    Seconds from sending the protocol handshake to the broker accepting it, i.e. one or two
+    application-level round trips
+    """
+    error: Optional[str] = None
+    probed_at: float = 0.0
+    """
+    Wall clock time the probe started
+    """
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed by broker')
+        data += chunk
+    return data
+
+
+def _mqtt_string(value: str) -> bytes:
+    encoded = value.encode()
+    return struct.pack('!H', len(encoded)) + encoded
+
+
+def _mqtt_remaining_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _mqtt_handshake(sock: socket.socket, username: str, password: str) -> None:
+    # protocol name, level 4 (3.1.1), flags: username + password + clean session, keepalive 10s
+    variable_header = _mqtt_string('MQTT') + bytes([0x04, 0xC2]) + struct.pack('!H', 10)
+    payload = _mqtt_string(f'probe-{uuid.uuid4().hex[:12]}') + _mqtt_string(username) + _mqtt_string(password)
+    body = variable_header + payload
+    sock.sendall(bytes([0x10]) + _mqtt_remaining_length(len(body)) + body)
+
+    packet_type, length, _, return_code = _recv_exact(sock, 4)
+    if packet_type != 0x20 or length != 2:
+        raise ConnectionError(f'unexpected MQTT reply 0x{packet_type:02x}')
+    if return_code != 0:
+        raise ConnectionError(f'MQTT CONNECT refused with return code {return_code}')
+    # DISCONNECT so the broker doesn't log an unexpected close
+    sock.sendall(bytes([0xE0, 0x00]))
+
+
+def _amqp_read_method(sock: socket.socket) -> tuple:
+    header = _recv_exact(sock, 7)
+    if header.startswith(b'AMQP'):
+        raise ConnectionError('broker does not support AMQP 0-9-1')
+    frame_type, _, size = struct.unpack('!BHI', header)
+    payload = _recv_exact(sock, size + 1)[:-1]
+    if frame_type != 1:
+        raise ConnectionError(f'unexpected AMQP frame type {frame_type}')
+    return struct.unpack('!HH', payload[:4])
+
+
+def _amqp_handshake(sock: socket.socket, username: str, password: str) -> None:
+    sock.sendall(b'AMQP\x00\x00\x09\x01')
+    if _amqp_read_method(sock) != (10, 10):
+        raise ConnectionError('expected Connection.Start')
+
+    response = f'\x00{username}\x00{password}'.encode()
+    arguments = (
+        struct.pack('!I', 0)  # empty client-properties table
+        + bytes([5]) + b'PLAIN'
+        + struct.pack('!I', len(response)) + response
+        + bytes([5]) + b'en_US'
+    )
+    payload = struct.pack('!HH', 10, 11) + arguments
+    sock.sendall(struct.pack('!BHI', 1, 0, len(payload)) + payload + b'\xce')
+
+    method = _amqp_read_method(sock)
+    if method == (10, 50):
+        raise ConnectionError('AMQP login refused')
+    if method != (10, 30):
+        raise ConnectionError(f'expected Connection.Tune, got {method}')
+
+
+def probe_broker(
+    host: str,
+    port: int,
+    protocol: str,
+    username: str,
+    password: str,
+    timeout: float = 2.0,
+) -> ProbeResult:
+    """Open a session on a broker and time it. Never raises, failures are reported in the result.
+
+    Params:
+      host, port: the broker to probe
+      protocol: the ControlPlaneConfig protocol, e.g. 'mqtt3.1.1' or 'amqp0.9.1'
+      username, password: broker credentials
+      timeout: seconds allowed for the connect and for the handshake each
+    """
+    result = ProbeResult(host=host, port=port, healthy=False, probed_at=time.time())
+    started = time.perf_counter()
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            connected = time.perf_counter()
+            result.connect_time = connected - started
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if protocol.startswith('amqp'):
+                _amqp_handshake(sock, username, password)
+            else:
+                _mqtt_handshake(sock, username, password)
+            result.handshake_time = time.perf_counter() - connected
+            result.healthy = True
+    except (OSError, ConnectionError, struct.error, ValueError) as e:
+        result.error = str(e) or e.__class__.__name__
+    return result
@@ -0,0 +1,217 @@
+"""
+Latency-aware ordering of the brokers in a ControlPlaneConfig.
+
+``broker_configs`` in the config modules is a fixed list: rabbitmq1 first, then rabbitmq2. The
+SDK connects to the first broker which answers, so a slow but still alive primary slows down
+every message.
+
+BrokerSelector probes every listed broker (see broker_probe.py) and reorders the config's broker
+list in place so the fastest healthy node comes first. Call select() before the config is handed
+to IntersectService/IntersectClient. Run start() to keep re-ranking in the background: a node
+must beat the current first choice by a relative margin for several consecutive rounds before it
+takes over, so the order doesn't flap between nodes with similar latency. Background re-ranking
+takes effect the next time the SDK (re)connects.
+
+A service or client config holds one ControlPlaneConfig per entry of its ``brokers`` list,
+select_config_brokers() runs a selector for each of them.
+"""
+
+import logging
+import threading
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
+
+from .broker_probe import ProbeResult, probe_broker
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerSelector:
+    """Probes the brokers of one ControlPlaneConfig and keeps them sorted by latency."""
+
+    def __init__(
+        self,
+        control_plane: Any,
+        probe_interval: float = 30.0,
+        hysteresis: float = 0.25,
+        confirm_rounds: int = 3,
+        smoothing: float = 0.3,
+        timeout: float = 2.0,
+    ) -> None:
+        """Create a selector, nothing is probed until select() or start() is called.
+
+        Params:
+          control_plane: a ControlPlaneConfig whose ``brokers`` list will be reordered in place
+          probe_interval: seconds between background probe rounds
+          hysteresis: a challenger's latency must be at least this fraction lower than the current
+            first choice's to replace it (0.25 means 25% faster)
+          confirm_rounds: number of consecutive rounds the challenger must win before the swap
+          smoothing: weight of the newest sample in each broker's moving average latency
+          timeout: per-probe connect and handshake timeout in seconds
+        """
+        self.control_plane = control_plane
+        self.probe_interval = probe_interval
+        self.hysteresis = hysteresis
+        self.confirm_rounds = confirm_rounds
+        self.smoothing = smoothing
+        self.timeout = timeout
+        self.reranks = 0
+
+        self._latest: Dict[str, ProbeResult] = {}
+        self._average: Dict[str, float] = {}
+        self._challenger: Optional[str] = None
+        self._challenger_wins = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(broker: Any) -> str:
+        return f'{broker.host}:{broker.port}'
+
+    def probe_all(self) -> List[ProbeResult]:
+        """Probe every broker once and fold the results into the moving averages."""
+        results = [
+            probe_broker(
+                broker.host,
+                broker.port,
+                self.control_plane.protocol,
+                self.control_plane.username,
+                self.control_plane.password,
+                timeout=self.timeout,
+            )
+            for broker in list(self.control_plane.brokers)
+        ]
+        with self._lock:
+            for result in results:
+                key = f'{result.host}:{result.port}'
+                self._latest[key] = result
+                if result.healthy:
+                    sample = result.connect_time + result.handshake_time
+                    previous = self._average.get(key)
+                    self._average[key] = sample if previous is None else (
+                        self.smoothing * sample + (1.0 - self.smoothing) * previous
+                    )
+                else:
+                    # an unhealthy broker starts from scratch once it comes back
+                    self._average.pop(key, None)
+        return results
+
+    def select(self) -> List[str]:
+        """Probe once and put the fastest healthy broker first, no hysteresis.
+
+        Returns:
+            The new broker order as 'host:port' strings
+        """
+        self.probe_all()
+        with self._lock:
+            self._reorder(self._ranked())
+            order = [self._key(b) for b in self.control_plane.brokers]
+        logger.info(f"Broker order by latency: {', '.join(order)}")
+        return order
+
+    def rerank(self) -> bool:
+        """Probe once and move a faster broker to the front if it has clearly and consistently won.
+
+        Returns:
+            True if the first choice changed
+        """
+        self.probe_all()
+        with self._lock:
+            ranked = self._ranked()
+            if not ranked:
+                return False
+            current = self._key(self.control_plane.brokers[0])
+            best = ranked[0]
+            current_latency = self._average.get(current)
+
+            if current_latency is None:
+                # the first choice is down, don't wait to confirm anything
+                replace = best != current
+            elif best != current and self._average[best] < current_latency * (1.0 - self.hysteresis):
+                if self._challenger == best:
+                    self._challenger_wins += 1
+                else:
+                    self._challenger = best
+                    self._challenger_wins = 1
+                replace = self._challenger_wins >= self.confirm_rounds
+            else:
+                self._challenger = None
+                self._challenger_wins = 0
+                replace = False
+
+            if not replace:
+                return False
+            self._reorder(ranked)
+            self._challenger = None
+            self._challenger_wins = 0
+            self.reranks += 1
+            order = [self._key(b) for b in self.control_plane.brokers]
+        logger.info(f"Re-ranked brokers by latency: {', '.join(order)}")
+        return True
+
+    def results(self) -> Dict[str, Dict[str, Any]]:
+        """Latest probe result, moving average latency and current rank of every broker, for inspection."""
+        with self._lock:
+            order = [self._key(b) for b in self.control_plane.brokers]
+            return {
+                key: {
+                    'rank': order.index(key) if key in order else None,
+                    'average_latency': self._average.get(key),
+                    'latest': asdict(result),
+                }
+                for key, result in self._latest.items()
+            }
+
+    def start(self) -> 'BrokerSelector':
+        """Keep re-ranking in a background thread every probe_interval seconds."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='broker_selector')
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.probe_interval):
+            try:
+                self.rerank()
+            except Exception as e:
+                logger.warning(f"Broker re-ranking failed: {e}")
+
+    def _ranked(self) -> List[str]:
+        """Healthy brokers, fastest first (call with the lock held)."""
+        return sorted(self._average, key=self._average.__getitem__)
+
+    def _reorder(self, ranked: List[str]) -> None:
+        """Sort the config's broker list in place: ranked brokers first, the rest keep their order."""
+        position = {key: i for i, key in enumerate(ranked)}
+        self.control_plane.brokers.sort(key=lambda b: position.get(self._key(b), len(position)))
+
+
+def select_config_brokers(config: Any, probe_interval: float = 30.0, background: bool = True) -> List[BrokerSelector]:
+    """Put the fastest broker of every control plane in a service or client config first.
+
+    A control plane whose probes fail keeps its configured order and isn't re-ranked.
+
+    Params:
+      config: an IntersectServiceConfig or IntersectClientConfig
+      probe_interval: seconds between background probe rounds
+      background: if True, keep re-ranking in the background
+
+    Returns:
+        The selectors which ranked their control plane
+    """
+    selectors = []
+    for control_plane in config.brokers:
+        selector = BrokerSelector(control_plane, probe_interval=probe_interval)
+        try:
+            selector.select()
+        except Exception as e:
+            logger.warning(f"Broker selection failed ({e}), keeping the configured order")
+            continue
+        if background:
+            selector.start()
+        selectors.append(selector)
+    return selectors
@@ -0,0 +1,705 @@
+"""
+Process-wide pool of broker connections, shared by every IntersectService and IntersectClient.
+
+The SDK gives every IntersectService and IntersectClient its own connection to each broker it is
+configured with: its own socket, heartbeats and network thread, and its own reconnect logic. A
+process hosting several services, or driving several clients, multiplies all of that, and after
+a node fails every one of them reconnects on its own.
+
+Once a ConnectionPool is installed, the SDK's broker clients come from the pool instead. Every
+control plane with the same protocol, credentials and broker list shares a SharedConnection:
+
+- each IntersectService or IntersectClient holds a lease on it, a PooledBrokerClient, which the
+  SDK uses like its own MQTT or AMQP client. Over AMQP every lease gets its own channel on the
+  connection, so queues and acknowledgements work as before. MQTT has no channels, so the leases
+  share one session, and an incoming message goes to every lease subscribed to its topic.
+- a connection takes at most max_channels leases, the next lease opens another connection
+- each connection has one failover state machine (DISCONNECTED -> CONNECTING -> CONNECTED, and
+  back to CONNECTING when the broker goes away). It tries the configured brokers in order,
+  starting with the one after the broker it lost, backs off between rounds, and gives every lease
+  its channel and subscriptions back once connected. After max_rounds failed rounds it is FAILED,
+  which the leases report as unrecoverable, like the SDK's clients do after their retries.
+
+Install the pool before the first IntersectService or IntersectClient is constructed:
+
+    pool = ConnectionPool(max_channels=64).install()
+
+paho-mqtt and pika are imported when the first connection of their protocol opens, so this module
+can be imported without either.
+"""
+
+import enum
+import functools
+import itertools
+import logging
+import threading
+import time
+import uuid
+from hashlib import sha384
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORTS = {'mqtt3.1.1': 1883, 'amqp0.9.1': 5672}
+
+# the SDK publishes every INTERSECT message to this exchange, and names persistent queues the same way
+_AMQP_EXCHANGE = 'intersect-messages'
+
+
+class ConnectionState(enum.Enum):
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    FAILED = 'failed'
+    CLOSED = 'closed'
+
+
+class MQTTTransport:
+    """One paho-mqtt session. MQTT has no channels, the leases share its subscriptions."""
+
+    channel_per_lease = False
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        client_id: str,
+        on_message: Callable[[Optional['PooledBrokerClient'], str, bytes], None],
+        on_lost: Callable[[Any, str], None],
+        max_channels: int,
+    ) -> None:
+        import paho.mqtt.client as paho_client
+
+        self.host = host
+        self.port = port
+        self._on_lost = on_lost
+        self._closing = False
+        self._connack = threading.Event()
+        self._result: Optional[int] = None
+        # the connection keeps its client ID across failovers, so the cluster can hand its session back
+        self._client = paho_client.Client(client_id=client_id, clean_session=False)
+        self._client.username_pw_set(username=username, password=password)
+        self._client.on_connect = self._handle_connect
+        self._client.on_disconnect = self._handle_disconnect
+        self._client.on_message = lambda _client, _userdata, message: on_message(None, message.topic, message.payload)
+
+    def open(self, timeout: float) -> None:
+        """Connect, raise ConnectionError or OSError if the broker doesn't accept the session within timeout."""
+        self._client.connect(self.host, self.port, keepalive=60)
+        self._client.loop_start()
+        if not self._connack.wait(timeout) or self._result != 0:
+            self.close()
+            raise ConnectionError(f'no session (CONNACK {self._result})' if self._connack.is_set() else f'no CONNACK within {timeout}s')
+
+    def close(self) -> None:
+        self._closing = True
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def open_channel(self, lease: 'PooledBrokerClient') -> None:
+        pass
+
+    def close_channel(self, lease: 'PooledBrokerClient') -> None:
+        pass
+
+    def publish(self, lease: 'PooledBrokerClient', topic: str, payload: bytes, persist: bool) -> None:
+        # the SDK asks for QoS 2, which RabbitMQ serves as QoS 1 anyway
+        self._client.publish(topic, payload, qos=1 if persist else 0)
+
+    def subscribe(self, lease: Optional['PooledBrokerClient'], topic: str, persist: bool) -> None:
+        self._client.subscribe(topic, qos=1 if persist else 0)
+
+    def unsubscribe(self, lease: Optional['PooledBrokerClient'], topic: str) -> None:
+        self._client.unsubscribe(topic)
+
+    def _handle_connect(self, _client: Any, _userdata: Any, _flags: Dict[str, Any], rc: int) -> None:
+        self._result = rc
+        self._connack.set()
+
+    def _handle_disconnect(self, client: Any, _userdata: Any, rc: int) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        # the pool's state machine picks the next broker, paho must not reconnect to this one by itself
+        client.loop_stop()
+        self._on_lost(self, f'disconnected (rc {rc})')
+
+
+class _AMQPChannel:
+    """A lease's channel, and what it asked for before the channel was open."""
+
+    def __init__(self) -> None:
+        self.channel: Any = None
+        self.ready = False
+        self.pending: List[Callable[[], None]] = []
+        self.consumer_tags: Dict[str, str] = {}
+
+
+class AMQPTransport:
+    """One pika connection, with an AMQP channel per lease.
+
+    pika isn't thread safe, everything runs on the connection's I/O loop thread.
+    """
+
+    channel_per_lease = True
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        client_id: str,
+        on_message: Callable[[Optional['PooledBrokerClient'], str, bytes], None],
+        on_lost: Callable[[Any, str], None],
+        max_channels: int,
+    ) -> None:
+        import pika
+
+        self.host = host
+        self.port = port
+        self._pika = pika
+        self._on_message = on_message
+        self._on_lost = on_lost
+        self._parameters = pika.ConnectionParameters(
+            host=host,
+            port=port,
+            virtual_host='/',
+            credentials=pika.PlainCredentials(username, password),
+            connection_attempts=1,
+            # one channel per lease, the broker can lower this
+            channel_max=max_channels,
+            client_properties={'connection_name': client_id},
+        )
+        self._connection: Any = None
+        self._thread: Optional[threading.Thread] = None
+        self._opened = threading.Event()
+        self._error: Optional[Exception] = None
+        self._closing = False
+        self._channels: Dict['PooledBrokerClient', _AMQPChannel] = {}
+
+    def open(self, timeout: float) -> None:
+        """Connect, raise ConnectionError if the broker doesn't accept the connection within timeout."""
+        self._connection = self._pika.SelectConnection(
+            parameters=self._parameters,
+            on_open_callback=lambda _connection: self._opened.set(),
+            on_open_error_callback=self._handle_open_error,
+            on_close_callback=self._handle_closed,
+        )
+        self._thread = threading.Thread(target=self._connection.ioloop.start, daemon=True, name='broker_pool_amqp')
+        self._thread.start()
+        if not self._opened.wait(timeout) or self._error is not None:
+            self.close()
+            raise ConnectionError(str(self._error) if self._error is not None else f'not open within {timeout}s')
+
+    def close(self) -> None:
+        self._closing = True
+        self._call(self._close_connection)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5.0)
+
+    def open_channel(self, lease: 'PooledBrokerClient') -> None:
+        state = self._channels[lease] = _AMQPChannel()
+        self._call(lambda: self._connection.channel(on_open_callback=functools.partial(self._channel_open, lease, state)))
+
+    def close_channel(self, lease: 'PooledBrokerClient') -> None:
+        state = self._channels.pop(lease, None)
+        if state is not None:
+            self._call(lambda: state.channel is not None and state.channel.is_open and state.channel.close())
+
+    def publish(self, lease: 'PooledBrokerClient', topic: str, payload: bytes, persist: bool) -> None:
+        properties = self._pika.BasicProperties(content_type='text/plain', delivery_mode=2 if persist else 1)
+        self._on_channel(lease, lambda channel: channel.basic_publish(
+            exchange=_AMQP_EXCHANGE, routing_key=topic.replace('/', '.'), body=payload, properties=properties,
+        ))
+
+    def subscribe(self, lease: Optional['PooledBrokerClient'], topic: str, persist: bool) -> None:
+        routing_key = topic.replace('/', '.')
+
+        def declare(channel: Any) -> None:
+            channel.queue_declare(
+                # the SDK's persistent queue names, so a service finds the requests queued while it was away
+                queue=sha384(routing_key.encode()).hexdigest() if persist else '',
+                durable=persist,
+                exclusive=not persist,
+                callback=lambda frame: channel.queue_bind(
+                    queue=frame.method.queue,
+                    exchange=_AMQP_EXCHANGE,
+                    routing_key=routing_key,
+                    callback=lambda _frame: consume(channel, frame.method.queue),
+                ),
+            )
+
+        def consume(channel: Any, queue_name: str) -> None:
+            state = self._channels.get(lease)
+            if state is None or state.channel is not channel:
+                return
+            state.consumer_tags[topic] = channel.basic_consume(
+                queue=queue_name,
+                # like the SDK, persistent messages are acknowledged once they were handled
+                auto_ack=not persist,
+                on_message_callback=functools.partial(self._consume, lease, topic, persist),
+            )
+
+        self._on_channel(lease, declare)
+
+    def unsubscribe(self, lease: Optional['PooledBrokerClient'], topic: str) -> None:
+        def cancel(channel: Any) -> None:
+            tag = self._channels[lease].consumer_tags.pop(topic, None)
+            if tag is not None:
+                channel.basic_cancel(tag)
+
+        self._on_channel(lease, cancel)
+
+    def _call(self, function: Callable[[], Any]) -> None:
+        try:
+            self._connection.ioloop.add_callback_threadsafe(function)
+        except Exception as e:  # the I/O loop is already gone
+            logger.debug(f'AMQP connection to {self.host}:{self.port} is closed: {e}')
+
+    def _on_channel(self, lease: 'PooledBrokerClient', action: Callable[[Any], None]) -> None:
+        """Run action(channel) on the I/O loop once the lease's channel is open."""
+
+        def run() -> None:
+            state = self._channels.get(lease)
+            if state is None:
+                return
+            if state.ready:
+                action(state.channel)
+            else:
+                state.pending.append(lambda: action(state.channel))
+
+        self._call(run)
+
+    def _channel_open(self, lease: 'PooledBrokerClient', state: _AMQPChannel, channel: Any) -> None:
+        state.channel = channel
+        channel.add_on_close_callback(functools.partial(self._channel_closed, lease, state))
+
+        def declared(_frame: Any) -> None:
+            state.ready = True
+            for action in state.pending:
+                action()
+            state.pending.clear()
+
+        channel.exchange_declare(exchange=_AMQP_EXCHANGE, exchange_type='topic', durable=True, callback=declared)
+
+    def _channel_closed(self, lease: 'PooledBrokerClient', state: _AMQPChannel, channel: Any, reason: Exception) -> None:
+        if self._channels.get(lease) is not state or self._closing:
+            return
+        # a channel only closes on a protocol error, start over like the SDK does
+        logger.error(f'AMQP channel closed unexpectedly ({reason}), reconnecting')
+        self._connection.close()
+
+    def _consume(self, lease: 'PooledBrokerClient', topic: str, persist: bool, channel: Any, deliver: Any, _properties: Any, body: bytes) -> None:
+        self._on_message(lease, topic, body)
+        if persist:
+            channel.basic_ack(deliver.delivery_tag)
+
+    def _close_connection(self) -> None:
+        if self._connection.is_open:
+            self._connection.close()
+        elif not self._connection.is_closing:
+            self._connection.ioloop.stop()
+
+    def _handle_open_error(self, connection: Any, error: Exception) -> None:
+        self._error = error
+        connection.ioloop.stop()
+        self._opened.set()
+
+    def _handle_closed(self, connection: Any, reason: Exception) -> None:
+        connection.ioloop.stop()
+        lost = self._opened.is_set() and self._error is None and not self._closing
+        self._closing = True
+        if lost:
+            self._on_lost(self, str(reason))
+
+
+TRANSPORTS = {
+    'mqtt3.1.1': MQTTTransport,
+    'amqp0.9.1': AMQPTransport,
+}
+
+_ids = itertools.count(1)
+
+
+class SharedConnection:
+    """One broker connection, leased by up to max_channels PooledBrokerClients, with one failover state machine."""
+
+    def __init__(
+        self,
+        protocol: str,
+        brokers: List[Tuple[str, int]],
+        username: str,
+        password: str,
+        transport_factory: Callable[..., Any],
+        max_channels: int = 64,
+        connect_timeout: float = 10.0,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 10.0,
+        max_rounds: int = 10,
+    ) -> None:
+        """Create the connection, the first lease to connect() opens it.
+
+        Params:
+          protocol: 'mqtt3.1.1' or 'amqp0.9.1'
+          brokers: (host, port) of every node to try, in order
+          username, password: the broker credentials
+          transport_factory: builds a transport like MQTTTransport for one node
+          max_channels: leases the connection takes
+          connect_timeout: seconds one node gets to accept the connection
+          retry_delay: seconds between the first and the second round over the brokers
+          max_retry_delay: the longest wait between two rounds
+          max_rounds: rounds over every broker before the connection gives up for good
+        """
+        self.protocol = protocol
+        self.brokers = list(brokers)
+        self.username = username
+        self.password = password
+        self.max_channels = max_channels
+        self.connect_timeout = connect_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_rounds = max_rounds
+        self.name = f'pooled {protocol} connection {next(_ids)}'
+        self.client_id = f'intersect-pool-{uuid.uuid4()}'
+
+        self.state = ConnectionState.DISCONNECTED
+        self.broker: Optional[Tuple[str, int]] = None
+        self.connects = 0
+        self.failovers = 0
+        self.last_failover_seconds: Optional[float] = None
+        self.leases: List['PooledBrokerClient'] = []
+
+        self._transport_factory = transport_factory
+        self._transport: Any = None
+        # leases with their channel and subscriptions on the current transport
+        self._opened: Set['PooledBrokerClient'] = set()
+        # topic -> lease -> persist, for handing MQTT messages to every lease subscribed to the topic
+        self._subscriptions: Dict[str, Dict['PooledBrokerClient', bool]] = {}
+        self._next_broker = 0
+        self._lost_at: Optional[float] = None
+        self._changed = threading.Condition(threading.RLock())
+
+    def reserve(self, lease: 'PooledBrokerClient') -> bool:
+        """Take a lease if there is room for it."""
+        with self._changed:
+            if len(self.leases) >= self.max_channels or self.state in (ConnectionState.FAILED, ConnectionState.CLOSED):
+                return False
+            self.leases.append(lease)
+            return True
+
+    def connect(self, lease: 'PooledBrokerClient') -> None:
+        """Open the connection if nobody has, and wait until it is up or failed for good."""
+        with self._changed:
+            if self.state is ConnectionState.DISCONNECTED:
+                self.state = ConnectionState.CONNECTING
+                threading.Thread(target=self._establish, daemon=True, name='broker_pool_connect').start()
+            elif self.state is ConnectionState.CONNECTED and lease not in self._opened:
+                self._open_lease(lease)
+            self._changed.wait_for(lambda: self.state is not ConnectionState.CONNECTING)
+
+    def release(self, lease: 'PooledBrokerClient') -> int:
+        """Give a lease back.
+
+        Returns:
+            The number of leases left
+        """
+        with self._changed:
+            if lease in self.leases:
+                self.leases.remove(lease)
+            if lease in self._opened:
+                self._opened.discard(lease)
+                for topic in [topic for topic, subscribers in self._subscriptions.items() if lease in subscribers]:
+                    self._unsubscribe_locked(lease, topic)
+                self._transport.close_channel(lease)
+            return len(self.leases)
+
+    def close(self) -> None:
+        with self._changed:
+            self.state = ConnectionState.CLOSED
+            transport, self._transport = self._transport, None
+            self._opened.clear()
+            self._changed.notify_all()
+        if transport is not None:
+            transport.close()
+
+    def is_open_for(self, lease: 'PooledBrokerClient') -> bool:
+        return self.state is ConnectionState.CONNECTED and lease in self._opened
+
+    def publish(self, lease: 'PooledBrokerClient', topic: str, payload: bytes, persist: bool) -> None:
+        # no lock, a reply published from a message handler must not wait for a failover in progress
+        transport = self._transport
+        if transport is None or self.state is not ConnectionState.CONNECTED:
+            logger.error(f'Cannot send message on {topic}, {self.name} is {self.state.value}')
+            return
+        transport.publish(lease, topic, payload, persist)
+
+    def subscribe(self, lease: 'PooledBrokerClient', topic: str, persist: bool) -> None:
+        with self._changed:
+            if lease in self._opened:
+                self._subscribe_locked(lease, topic, persist)
+
+    def unsubscribe(self, lease: 'PooledBrokerClient', topic: str) -> None:
+        with self._changed:
+            if lease in self._opened:
+                self._unsubscribe_locked(lease, topic)
+
+    def _open_lease(self, lease: 'PooledBrokerClient') -> None:
+        self._opened.add(lease)
+        self._transport.open_channel(lease)
+        for topic, handler in lease.topics().items():
+            self._subscribe_locked(lease, topic, handler.topic_persist)
+
+    def _subscribe_locked(self, lease: 'PooledBrokerClient', topic: str, persist: bool) -> None:
+        subscribers = self._subscriptions.setdefault(topic, {})
+        # the session needs the subscription once, with QoS 1 as soon as one lease wants its messages kept
+        already = any(subscribers.values()) if persist else bool(subscribers)
+        subscribers[lease] = persist
+        if self._transport.channel_per_lease:
+            self._transport.subscribe(lease, topic, persist)
+        elif not already:
+            self._transport.subscribe(None, topic, persist)
+
+    def _unsubscribe_locked(self, lease: 'PooledBrokerClient', topic: str) -> None:
+        subscribers = self._subscriptions.get(topic, {})
+        if subscribers.pop(lease, None) is None:
+            return
+        if self._transport.channel_per_lease:
+            self._transport.unsubscribe(lease, topic)
+        elif not subscribers:
+            self._transport.unsubscribe(None, topic)
+        if not subscribers:
+            del self._subscriptions[topic]
+
+    def _on_message(self, lease: Optional['PooledBrokerClient'], topic: str, payload: bytes) -> None:
+        if lease is not None:
+            lease.deliver(topic, payload)
+            return
+        for subscriber in list(self._subscriptions.get(topic, ())):
+            subscriber.deliver(topic, payload)
+
+    def _on_lost(self, transport: Any, reason: str) -> None:
+        with self._changed:
+            if transport is not self._transport or self.state is not ConnectionState.CONNECTED:
+                return
+            self._transport = None
+            self._opened.clear()
+            self._subscriptions.clear()
+            self.state = ConnectionState.CONNECTING
+            self._lost_at = time.monotonic()
+            self._next_broker = (self._next_broker + 1) % len(self.brokers)
+            logger.warning(f'{self.name} lost {self.broker[0]}:{self.broker[1]} ({reason}), failing over for {len(self.leases)} lease(s)')
+        threading.Thread(target=self._establish, args=(transport,), daemon=True, name='broker_pool_failover').start()
+
+    def _establish(self, lost: Any = None) -> None:
+        """Connect to the first broker which accepts, in rounds with a growing pause between them."""
+        if lost is not None:
+            try:
+                lost.close()
+            except Exception as e:
+                logger.debug(f'Closing the lost transport: {e}')
+        delay = self.retry_delay
+        for round_number in range(1, self.max_rounds + 1):
+            for offset in range(len(self.brokers)):
+                index = (self._next_broker + offset) % len(self.brokers)
+                host, port = self.brokers[index]
+                if self.state is ConnectionState.CLOSED:
+                    return
+                transport = self._transport_factory(
+                    host, port, self.username, self.password, self.client_id, self._on_message, self._on_lost, self.max_channels,
+                )
+                try:
+                    transport.open(self.connect_timeout)
+                except Exception as e:
+                    logger.warning(f'{self.name} could not connect to {host}:{port}: {e}')
+                    continue
+                if self._connected(transport, index):
+                    return
+                transport.close()
+                return
+            with self._changed:
+                if round_number < self.max_rounds and self.state is not ConnectionState.CLOSED:
+                    self._changed.wait(delay)
+            delay = min(self.max_retry_delay, delay * 2)
+        with self._changed:
+            if self.state is not ConnectionState.CLOSED:
+                logger.error(f'{self.name} gave up after {self.max_rounds} rounds over {len(self.brokers)} broker(s)')
+                self.state = ConnectionState.FAILED
+                self._changed.notify_all()
+
+    def _connected(self, transport: Any, index: int) -> bool:
+        """Switch to a transport which just opened, unless the connection was closed meanwhile."""
+        with self._changed:
+            if self.state is ConnectionState.CLOSED:
+                return False
+            self._transport = transport
+            self.broker = self.brokers[index]
+            self._next_broker = index
+            self.state = ConnectionState.CONNECTED
+            self.connects += 1
+            for lease in self.leases:
+                self._open_lease(lease)
+            if self._lost_at is not None:
+                self.failovers += 1
+                self.last_failover_seconds = time.monotonic() - self._lost_at
+                self._lost_at = None
+                logger.info(f'{self.name} failed over to {self.broker[0]}:{self.broker[1]} in {self.last_failover_seconds:.2f}s')
+            self._changed.notify_all()
+            return True
+
+
+class PooledBrokerClient:
+    """The broker client the SDK gets from the pool, a lease on a SharedConnection.
+
+    Has the methods of the SDK's BrokerClient protocol, so a ControlPlaneManager uses it like its
+    own MQTTClient or AMQPClient. The lease is taken on connect() and given back on disconnect().
+    """
+
+    def __init__(self, pool: 'ConnectionPool', key: Tuple[Any, ...], topics_to_handlers: Callable[[], Dict[str, Any]]) -> None:
+        self.pool = pool
+        self.key = key
+        self.topics = topics_to_handlers
+        self.connection: Optional[SharedConnection] = None
+
+    def connect(self) -> None:
+        if self.connection is None:
+            self.connection = self.pool.lease(self)
+        self.connection.connect(self)
+
+    def disconnect(self) -> None:
+        if self.connection is not None:
+            self.pool.release(self)
+            self.connection = None
+
+    @property
+    def host(self) -> Optional[str]:
+        """The broker the connection is on, like the SDK clients' host, e.g. for telemetry."""
+        connection = self.connection
+        return connection.broker[0] if connection is not None and connection.broker is not None else None
+
+    def is_connected(self) -> bool:
+        connection = self.connection
+        return connection is not None and connection.is_open_for(self)
+
+    def considered_unrecoverable(self) -> bool:
+        connection = self.connection
+        return connection is not None and connection.state is ConnectionState.FAILED
+
+    def publish(self, topic: str, payload: bytes, persist: bool) -> None:
+        if self.connection is not None:
+            self.connection.publish(self, topic, payload, persist)
+
+    def subscribe(self, topic: str, persist: bool) -> None:
+        if self.connection is not None:
+            self.connection.subscribe(self, topic, persist)
+
+    def unsubscribe(self, topic: str) -> None:
+        if self.connection is not None:
+            self.connection.unsubscribe(self, topic)
+
+    def deliver(self, topic: str, payload: bytes) -> None:
+        """Hand an incoming message to the SDK's handlers for its topic."""
+        handler = self.topics().get(topic)
+        if handler is not None:
+            for callback in handler.callbacks:
+                callback(payload)
+
+
+class ConnectionPool:
+    """Hands out leases on shared broker connections, see the module docstring."""
+
+    def __init__(
+        self,
+        max_channels: int = 64,
+        transport_factory: Optional[Callable[..., Any]] = None,
+        connect_timeout: float = 10.0,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 10.0,
+        max_rounds: int = 10,
+    ) -> None:
+        """
+        Params:
+          max_channels: leases per connection, 1 gives every service and client its own connection
+          transport_factory: builds the transport of every connection from (protocol, host, port,
+            username, password, client_id, on_message, on_lost, max_channels), the default picks
+            MQTTTransport or AMQPTransport by protocol
+          connect_timeout, retry_delay, max_retry_delay, max_rounds: see SharedConnection
+        """
+        self.max_channels = max_channels
+        self.connect_timeout = connect_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_rounds = max_rounds
+        self._transport_factory = transport_factory or (lambda protocol, *args: TRANSPORTS[protocol](*args))
+        self._connections: Dict[Tuple[Any, ...], List[SharedConnection]] = {}
+        self._lock = threading.Lock()
+
+    def install(self) -> 'ConnectionPool':
+        """Make the SDK take its broker clients from this pool, for every service and client constructed afterwards."""
+        from intersect_sdk._internal.control_plane import control_plane_manager
+
+        control_plane_manager.create_control_provider = self.provider
+        return self
+
+    def provider(self, config: Any, topics_to_handlers: Callable[[], Dict[str, Any]]) -> PooledBrokerClient:
+        """The SDK's create_control_provider(), for a ControlPlaneConfig."""
+        default_port = DEFAULT_PORTS.get(config.protocol, 1883)
+        brokers = getattr(config, 'brokers', None) or [config]
+        key = (
+            config.protocol,
+            config.username,
+            config.password,
+            tuple((broker.host, broker.port or default_port) for broker in brokers),
+        )
+        return PooledBrokerClient(self, key, topics_to_handlers)
+
+    def lease(self, client: PooledBrokerClient) -> SharedConnection:
+        """A connection with room for client, a new one if every connection for its key is full."""
+        with self._lock:
+            connections = self._connections.setdefault(client.key, [])
+            for connection in connections:
+                if connection.reserve(client):
+                    return connection
+            protocol, username, password, brokers = client.key
+            connection = SharedConnection(
+                protocol,
+                list(brokers),
+                username,
+                password,
+                functools.partial(self._transport_factory, protocol),
+                max_channels=self.max_channels,
+                connect_timeout=self.connect_timeout,
+                retry_delay=self.retry_delay,
+                max_retry_delay=self.max_retry_delay,
+                max_rounds=self.max_rounds,
+            )
+            connection.reserve(client)
+            connections.append(connection)
+            return connection
+
+    def release(self, client: PooledBrokerClient) -> None:
+        """Give a lease back, and close its connection once nobody else holds one."""
+        with self._lock:
+            connection = client.connection
+            if connection.release(client):
+                return
+            self._connections[client.key].remove(connection)
+        connection.close()
+
+    def connections(self) -> List[SharedConnection]:
+        with self._lock:
+            return [connection for connections in self._connections.values() for connection in connections]
+
+    def connection_count(self) -> int:
+        """Connections which are up right now."""
+        return sum(1 for connection in self.connections() if connection.state is ConnectionState.CONNECTED)
+
+    def close(self) -> None:
+        """Close every connection, e.g. at the end of a benchmark."""
+        with self._lock:
+            connections = [connection for connections in self._connections.values() for connection in connections]
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
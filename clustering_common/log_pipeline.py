@@ -0,0 +1,173 @@
+"""
+Non-blocking logging for the service and client.
+
+logging.basicConfig writes every record to stderr on the thread which logged it, so a slow stream
+(Docker capturing container output) adds its latency to whatever was logging, a request or the
+counter thread. configure_logging sets the root logger up like basicConfig does, but:
+
+- The handler only puts the record on a bounded queue. A background thread formats and writes
+  it. If the queue is full the record is dropped, the caller never waits.
+- Formatting is lazy. Call sites on hot paths pass %-style arguments
+  (``logger.info("Count: %d", count)``), which are only applied on the writer thread. Only pass
+  values which won't change before they are written, i.e. not mutable state objects.
+- Each message type, a logger name plus its unformatted message, may log ``rate`` records per
+  second. Past that, only every ``sample_every``-th record is kept. The next record of that type to
+  get through says how many were suppressed. Errors are never rate limited.
+
+Dropped records are counted in the log_records_dropped metric.
+"""
+
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, TextIO, Tuple
+
+from clustering_common.metrics import REGISTRY
+
+DROPPED = REGISTRY.counter('log_records_dropped', 'Log records dropped before being written, by reason', ['reason'])
+RATE_LIMITED = DROPPED.labels('rate_limited')
+QUEUE_FULL = DROPPED.labels('queue_full')
+
+# past this many message types, forget the ones with nothing suppressed
+_MAX_MESSAGE_TYPES = 4096
+
+
+class _MessageType:
+    __slots__ = ('tokens', 'updated', 'over', 'suppressed')
+
+    def __init__(self, tokens: float, now: float) -> None:
+        self.tokens = tokens
+        self.updated = now
+        # records over the limit since the bucket last had a token, for sampling
+        self.over = 0
+        # records dropped since one of this type was last let through
+        self.suppressed = 0
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message type, with 1 in sample_every records over the limit let through."""
+
+    def __init__(self, rate: float, sample_every: int) -> None:
+        """
+        Params:
+          rate: records per second per message type, a burst of up to one second's worth is allowed
+          sample_every: once over the limit keep every sample_every-th record, 0 drops them all
+        """
+        super().__init__()
+        self.rate = rate
+        self.sample_every = sample_every
+        self._types: Dict[Tuple[str, str], _MessageType] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        # msg is the unformatted template, which is why hot paths must not log f-strings
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            kind = self._types.get(key)
+            if kind is None:
+                if len(self._types) >= _MAX_MESSAGE_TYPES:
+                    self._types = {k: v for k, v in self._types.items() if v.suppressed}
+                kind = self._types[key] = _MessageType(self.rate, now)
+            else:
+                kind.tokens = min(self.rate, kind.tokens + (now - kind.updated) * self.rate)
+                kind.updated = now
+            if kind.tokens >= 1.0:
+                kind.tokens -= 1.0
+                kind.over = 0
+            else:
+                kind.over += 1
+                if not self.sample_every or kind.over % self.sample_every:
+                    kind.suppressed += 1
+                    RATE_LIMITED.inc()
+                    return False
+            # picked up by _Formatter on the writer thread
+            record.suppressed = kind.suppressed
+            kind.suppressed = 0
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the writer thread as they are, dropping them if the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler formats here, on the caller's thread, so the record can cross a process
+        # boundary. Ours stays in this process, so the writer thread does it.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            QUEUE_FULL.inc()
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += f' ({suppressed} similar message(s) suppressed)'
+        return text
+
+
+class _Writer(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # the base class uses put_nowait, which fails if the queue is full at exit
+        self.queue.put(self._sentinel)
+
+
+def build_handler(
+    stream: TextIO, rate: float = 10.0, sample_every: int = 100, queue_size: int = 10000,
+) -> Tuple[logging.Handler, QueueListener]:
+    """A handler which queues records, and the started writer thread which writes them to stream.
+
+    Params are as for configure_logging.
+    """
+    writer = logging.StreamHandler(stream)
+    writer.setFormatter(_Formatter(logging.BASIC_FORMAT))
+    records: 'queue.Queue[logging.LogRecord]' = queue.Queue(queue_size)
+    handler = _NonBlockingQueueHandler(records)
+    if rate > 0:
+        handler.addFilter(RateLimitFilter(rate, sample_every))
+    listener = _Writer(records, writer)
+    listener.start()
+    return handler, listener
+
+
+def configure_logging(
+    level: int = logging.INFO,
+    rate: float = 10.0,
+    sample_every: int = 100,
+    queue_size: int = 10000,
+    stream: Optional[TextIO] = None,
+) -> Optional[QueueListener]:
+    """Send the root logger's output through a bounded queue to a writer thread.
+
+    Like logging.basicConfig this does nothing if the root logger already has handlers.
+
+    Params:
+      level: root logger level
+      rate: records per second per message type, 0 turns rate limiting off
+      sample_every: once a message type is over its rate keep every sample_every-th record, 0 drops them all
+      queue_size: records waiting to be written before new ones are dropped
+      stream: where to write, stderr like basicConfig by default
+
+    Returns:
+        The running writer, or None if logging was already configured. It is stopped, flushing
+        what's queued, at interpreter exit.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    handler, listener = build_handler(stream if stream is not None else sys.stderr, rate, sample_every, queue_size)
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,318 @@
+"""
+A small metrics registry for the counting service and client, served in Prometheus text format.
+
+Neither image ships prometheus_client, and the demo only needs three metric types:
+
+- Counter: a value which only goes up (requests, reconnects, skipped counts)
+- Gauge: a value which goes up and down, or is read from a function at scrape time (in-flight requests)
+- Histogram: observations sorted into fixed cumulative buckets, plus their sum and count (latencies)
+
+Every metric can have labels. ``registry.counter(name, help, ['operation'])`` returns a family,
+``family.labels('get_count')`` the child which records. Resolving a child is a dict lookup, so hot
+paths resolve it once and keep it. A metric without labels is returned as its only child.
+
+Recording takes one uncontended lock per call, a histogram also does a bisect over its bucket
+bounds. That costs around a microsecond, against tens of microseconds for the SDK to handle a
+single request (see benchmarks/bench_metrics.py).
+
+``serve(registry, port)`` exposes ``/metrics`` on a background HTTP server thread.
+"""
+
+import bisect
+import logging
+import math
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prometheus' default buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# For code paths measured in microseconds, like a capability function or a lock wait
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    """A value which only goes up."""
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        return [f'{name}_total{labels} {_format_value(self._value)}']
+
+
+class Gauge:
+    """A value which goes up and down, or is read from a function at scrape time."""
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Read the value from function whenever the gauge is scraped, which costs nothing in between."""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception as e:
+                logger.warning(f"Gauge function failed: {e}")
+                return math.nan
+        return self._value
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        return [f'{name}{labels} {_format_value(self.value)}']
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, plus their sum."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._bounds = tuple(buckets)
+        # one slot per bound plus one for +Inf, made cumulative at scrape time
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> '_Timer':
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def _samples(self, name: str, labels: str) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        # the le label goes after any other labels
+        prefix = labels[:-1] + ',' if labels else '{'
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._bounds + (math.inf,), counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{prefix}le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f'{name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self) -> '_Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class MetricFamily:
+    """All children of one metric name, one per combination of label values."""
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: Sequence[str], factory: Callable[[], object]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """The child for these label values, in the order the label names were given."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} takes labels {self.label_names}, got {values}')
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def render(self) -> List[str]:
+        with self._lock:
+            children = sorted(self._children.items(), key=lambda item: item[0])
+        # in the text format a counter's HELP and TYPE lines use the name of its sample
+        exposed = f'{self.name}_total' if self.kind == 'counter' else self.name
+        lines = [f'# HELP {exposed} {self.help_text}', f'# TYPE {exposed} {self.kind}']
+        for values, child in children:
+            lines.extend(child._samples(self.name, _format_labels(self.label_names, values)))
+        return lines
+
+
+class Registry:
+    """A set of metric families, rendered together."""
+
+    def __init__(self) -> None:
+        self._families: Dict[str, MetricFamily] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        """Register a counter, name without the _total suffix Prometheus adds."""
+        return self._register(name, help_text, 'counter', label_names, Counter)
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        return self._register(name, help_text, 'gauge', label_names, Gauge)
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        return self._register(name, help_text, 'histogram', label_names, lambda: Histogram(buckets))
+
+    def render(self) -> str:
+        """Every metric in Prometheus text exposition format."""
+        with self._lock:
+            families = list(self._families.values())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, name: str, help_text: str, kind: str, label_names: Sequence[str], factory: Callable[[], object]):
+        with self._lock:
+            if name in self._families:
+                raise ValueError(f'metric {name} is already registered')
+            family = self._families[name] = MetricFamily(name, help_text, kind, label_names, factory)
+        # a metric without labels has exactly one child, hand that out directly
+        return family if label_names else family.labels()
+
+
+REGISTRY = Registry()
+"""
+The process-wide registry the service and client record into
+"""
+
+
+class TimedLock:
+    """A lock which records how long each acquire() waited.
+
+    Drop-in for threading.Lock where it is used as a context manager or with acquire()/release().
+    """
+
+    def __init__(self, wait_histogram: Histogram, lock: Optional[threading.Lock] = None) -> None:
+        self.wait_histogram = wait_histogram
+        self._lock = lock if lock is not None else threading.Lock()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        self.wait_histogram.observe(time.perf_counter() - started)
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc_info) -> None:
+        self._lock.release()
+
+
+class _ReusePortHTTPServer(ThreadingHTTPServer):
+    def server_bind(self) -> None:
+        # lets a replacement process bind while the one it replaces still holds the port
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def serve(registry: Registry, port: int, host: str = '127.0.0.1', reuse_port: bool = False) -> ThreadingHTTPServer:
+    """Serve the registry at http://host:port/metrics from a daemon thread.
+
+    Params:
+      registry: what to serve
+      port: TCP port to listen on
+      host: address to bind, the default only accepts local connections. The endpoint has no
+        authentication, bind '0.0.0.0' only where the network is trusted, e.g. inside a container.
+      reuse_port: allow several processes to listen on the same port (SO_REUSEPORT), e.g. during a
+        rolling restart of the service's workers
+
+    Returns:
+        The running server, call shutdown() on it to stop serving
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            # a scrape every few seconds would drown out the demo's own output
+            pass
+
+    server_class = _ReusePortHTTPServer if reuse_port else ThreadingHTTPServer
+    server = server_class((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics_http').start()
+    logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,165 @@
+"""
+Readiness gate for startup, and timing of the startup phases.
+
+docker-compose used to start the service and the client after a fixed sleep, long enough for a
+slow cluster most of the time and too long every other time. Instead, wait_for_brokers probes the
+brokers of a config (see broker_probe.py) until one of them accepts a session:
+
+- every round probes all brokers at once and ends as soon as one is healthy, so a node which is
+  down or black-holed doesn't hold up the one which is ready
+- between rounds it backs off exponentially, from initial_delay up to max_delay, so a cluster which
+  comes up quickly is noticed quickly and a slow one isn't hammered
+
+StartupTimer records how long each phase of a process's startup took (importing, waiting for the
+brokers, connecting, ...) and logs them in one line once the SDK has connected.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .broker_probe import ProbeResult, probe_broker
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Times consecutive startup phases. Each mark() ends the phase running since the previous one."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._last = self.started
+        self._reported = False
+
+    def mark(self, phase: str) -> float:
+        """End a phase.
+
+        Params:
+          phase: the name of the phase which just ended
+
+        Returns:
+            Seconds the phase took
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.phases.append((phase, elapsed))
+        return elapsed
+
+    @property
+    def total(self) -> float:
+        """Seconds from creating the timer to the last mark()."""
+        return self._last - self.started
+
+    def report(self, name: str) -> Dict[str, float]:
+        """Log every phase in one line.
+
+        Params:
+          name: what started up, for the log line
+
+        Returns:
+            Phase -> seconds, in order
+        """
+        phases = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in self.phases)
+        logger.info(f"{name} started in {self.total:.2f}s: {phases}")
+        return dict(self.phases)
+
+    def watch(self, gateway: Any, name: str, gauge: Optional[Any] = None) -> None:
+        """End the 'connect' phase and report the first time a service or client finishes startup().
+
+        Works for an IntersectService or IntersectClient and for the hot standby wrappers.
+
+        Params:
+          gateway: the service or client, its startup() is replaced on the instance
+          name: what started up, for the log line
+          gauge: a metrics gauge family with a 'phase' label, set to every phase's seconds
+        """
+        startup = gateway.startup
+
+        def timed_startup(*args: Any, **kwargs: Any) -> Any:
+            result = startup(*args, **kwargs)
+            # reconnects call startup() again, only the first one is part of starting up
+            if not self._reported:
+                self._reported = True
+                self.mark('connect')
+                for phase, seconds in self.report(name).items():
+                    if gauge is not None:
+                        gauge.labels(phase).set(seconds)
+            return result
+
+        gateway.startup = timed_startup
+
+
+def _probe_round(brokers: List[Tuple[Any, Any]], timeout: float) -> Tuple[Optional[ProbeResult], List[ProbeResult]]:
+    """Probe every broker in parallel, return the first healthy result as soon as there is one."""
+    results: 'queue.Queue[ProbeResult]' = queue.Queue()
+    for control_plane, broker in brokers:
+        threading.Thread(
+            target=lambda c=control_plane, b=broker: results.put(
+                probe_broker(b.host, b.port, c.protocol, c.username, c.password, timeout=timeout)
+            ),
+            daemon=True,
+            name='readiness_probe',
+        ).start()
+    failed = []
+    for _ in brokers:
+        result = results.get()
+        if result.healthy:
+            return result, failed
+        failed.append(result)
+    return None, failed
+
+
+def wait_for_brokers(
+    config: Any,
+    timeout: float = 300.0,
+    initial_delay: float = 0.1,
+    max_delay: float = 5.0,
+    multiplier: float = 2.0,
+    probe_timeout: float = 2.0,
+) -> ProbeResult:
+    """Block until a broker of an IntersectServiceConfig or IntersectClientConfig accepts a session.
+
+    Params:
+      config: the config whose brokers are probed, every broker of every control plane counts
+      timeout: seconds to wait in total, 0 waits forever
+      initial_delay: seconds between the first and the second round of probes
+      max_delay: the longest wait between two rounds
+      multiplier: factor the wait grows by after every round
+      probe_timeout: connect and handshake timeout of one probe
+
+    Returns:
+        The probe of the first broker which was ready
+
+    Raises:
+      TimeoutError: no broker was ready within timeout
+    """
+    brokers = [(control_plane, broker) for control_plane in config.brokers for broker in control_plane.brokers]
+    started = time.monotonic()
+    delay = initial_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        round_started = time.monotonic()
+        ready, failed = _probe_round(brokers, probe_timeout)
+        if ready is not None:
+            logger.info(
+                f"Broker {ready.host}:{ready.port} ready after {time.monotonic() - started:.2f}s "
+                f"({attempt} probe round{'s' if attempt > 1 else ''})"
+            )
+            return ready
+        errors = '; '.join(f'{result.host}:{result.port} {result.error}' for result in failed)
+        now = time.monotonic()
+        if timeout and now - started >= timeout:
+            raise TimeoutError(f'no broker ready after {now - started:.1f}s ({errors})')
+        if attempt == 1 or delay >= max_delay:
+            logger.info(f"Waiting for a broker: {errors}")
+        # rounds start every delay seconds however long the probes took, the last one at the timeout
+        pause = delay - (now - round_started)
+        if timeout:
+            pause = min(pause, started + timeout - now)
+        time.sleep(max(0.0, pause))
+        delay = min(max_delay, delay * multiplier)
@@ -1,19 +1,31 @@
 import logging
 import threading
 import time
+import uuid
 from dataclasses import dataclass
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
-from typing_extensions import Annotated
+from typing_extensions import Annotated, Literal
 
+import contextlib
+import functools
 import sys
 import os
 sys.path.append('/opt')
+# the shared clustering_common package lives next to service/ when running outside docker
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from clustering_common.readiness import StartupTimer, wait_for_brokers
+
+# Started before the SDK is imported, so the import is the first startup phase
+startup_timer = StartupTimer()
+
 from intersect_sdk import (
     IntersectBaseCapabilityImplementation,
+    IntersectEventDefinition,
     IntersectService,
     default_intersect_lifecycle_loop,
+    intersect_event,
     intersect_message,
     intersect_status,
 )
@@ -21,8 +33,25 @@ from intersect_sdk import (
 # Import our clustering configuration
 import config
 import config_amqp
+from hot_standby_service import HotStandbyService, split_service_config
+from multi_counter import MultiCounterCapabilityImplementation
+from worker_pool import MUTATING_OPERATIONS, SharedCounterState, WorkerIntersectService, WorkerSupervisor
+from state_snapshot import Checkpointer, SavedCounter, SnapshotFile, restore_counter
+from schema_cache import SchemaCacheMismatch, cached_schema, read_artifact
+from sampling_profiler import PROFILER
+from service_metrics import BROKER_CONNECTIONS, EVENTS, STARTUP_SECONDS, STATE_LOCK_WAIT, instrument_service
+from clustering_common.broker_selector import select_config_brokers
+from clustering_common.connection_pool import ConnectionPool
+from clustering_common.log_pipeline import configure_logging
+from clustering_common.metrics import REGISTRY, TimedLock, serve
 
-logging.basicConfig(level=logging.INFO)
+# Log records per second per message type before only a sample is kept, 0 turns the limit off
+LOG_RATE = float(os.environ.get("LOG_RATE", "10"))
+# Once a message type is over LOG_RATE, keep one record in LOG_SAMPLE, 0 drops the rest
+LOG_SAMPLE = int(os.environ.get("LOG_SAMPLE", "100"))
+
+# Records are written by a background thread, logging never blocks a request or the counter thread
+configure_logging(logging.INFO, rate=LOG_RATE, sample_every=LOG_SAMPLE)
 logger = logging.getLogger(__name__)
 
 # Determine which config to use based on environment variable
@@ -34,6 +63,54 @@ else:
     SERVICE_CONFIG = config.SERVICE_CONFIG
     logger.info("Using MQTT configuration")
 
+# Hierarchy name this instance serves under, run several under different names for the scatter-gather client
+SERVICE_NAME = os.environ.get("SERVICE_NAME", SERVICE_CONFIG.hierarchy.service)
+if SERVICE_NAME != SERVICE_CONFIG.hierarchy.service:
+    # validated, so a name the SDK can't route to fails here
+    hierarchy = SERVICE_CONFIG.hierarchy.model_validate({**SERVICE_CONFIG.hierarchy.model_dump(), 'service': SERVICE_NAME})
+    SERVICE_CONFIG = SERVICE_CONFIG.model_copy(update={'hierarchy': hierarchy})
+    logger.info(f"Serving as {SERVICE_CONFIG.hierarchy.hierarchy_string('.')}")
+
+# If set, keep a connected service on every broker node and promote a standby when the active one drops
+HOT_STANDBY = os.environ.get("HOT_STANDBY", "0") == "1"
+
+# If set, also host the MultiCounter capability with any number of named counters
+MULTI_COUNTER = os.environ.get("MULTI_COUNTER", "0") == "1"
+
+# Number of worker processes consuming requests as competing consumers (AMQP only), 1 runs in-process
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", "1"))
+
+# "latency" probes the brokers and tries the fastest healthy one first, "static" keeps the configured order
+BROKER_SELECTION = os.environ.get("BROKER_SELECTION", "static")
+# Seconds between background re-ranking probes when BROKER_SELECTION=latency
+BROKER_PROBE_INTERVAL = float(os.environ.get("BROKER_PROBE_INTERVAL", "30"))
+
+# Port serving Prometheus metrics at /metrics, 0 turns the endpoint off. Worker N uses METRICS_PORT + N.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+# Address the metrics endpoint listens on, the default only accepts local connections
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# File the counter's state is checkpointed to and restored from at startup, empty (the default) turns it off.
+# One file per service, it isn't locked against other processes.
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "")
+# Seconds between periodic checkpoints, start_count/stop_count/reset_count are also saved right away
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", "1"))
+
+# Load the capability schema schema_cache.py precomputed instead of generating it at startup, "0" generates it
+SCHEMA_CACHE = os.environ.get("SCHEMA_CACHE", "1") == "1"
+# A stale or missing precomputed schema stops the service, "0" generates the schema at startup with a warning instead
+SCHEMA_CACHE_STRICT = os.environ.get("SCHEMA_CACHE_STRICT", "1") == "1"
+
+# Seconds to wait at startup for a broker to accept a session before giving up, 0 waits forever
+STARTUP_TIMEOUT = float(os.environ.get("STARTUP_TIMEOUT", "300"))
+
+# Every IntersectService of the process shares its broker connections (connection_pool.py), "0" gives each its own
+CONNECTION_POOL = os.environ.get("CONNECTION_POOL", "0") == "1"
+# Services per pooled connection (AMQP channels on it), past that another connection is opened
+POOL_MAX_CHANNELS = int(os.environ.get("POOL_MAX_CHANNELS", "64"))
+
+COUNT_TICKS = EVENTS.labels('count_tick')
+
 
 class CountingServiceCapabilityImplementationState(BaseModel):
     """We can't just use any class to represent state. This class either needs to extend Pydantic's BaseModel class, or be a dataclass. Both the Python standard library's dataclass and Pydantic's dataclass are valid."""
@@ -68,12 +145,220 @@ class CountingServiceCapabilityImplementationResponse:
     """
 
 
+@dataclass
+class CountingServiceTaggedCount:
+    """Reply to a tagged count request.
+
+    The request ID is echoed back unchanged so that clients with several requests in flight
+    can match each reply to the request which produced it.
+    """
+
+    request_id: int
+    """
+    The correlation ID the client sent with the request
+    """
+    count: int
+    """
+    The current count value, same as get_count would return
+    """
+
+
+@dataclass
+class CountingServiceTick:
+    """Payload of the count_tick event, pushed by the counter thread every time the count increases."""
+
+    count: int
+    """
+    The count value at this tick
+    """
+    timestamp: float
+    """
+    Service wall clock time (seconds since the epoch) when the tick was emitted
+    """
+    instance_id: str
+    """
+    Identifies this service process and count epoch, so clients with a clock lease notice a restart or reset_count
+    """
+
+
+@dataclass
+class CountingServiceClock:
+    """Reply to get_clock: everything a client needs to compute the count on its own.
+
+    The count is always int(server_time - start_time), so a client which knows start_time and the
+    offset between its clock and ours does not need to ask for the count at all.
+    """
+
+    request_id: int
+    """
+    The correlation ID the client sent with the request, a late reply must not be mistaken for a fast one
+    """
+    instance_id: str
+    """
+    Identifies this service process and count epoch, changes when the service restarts or the count is reset
+    """
+    start_time: float
+    """
+    Wall clock time (seconds since the epoch) the count is measured from
+    """
+    server_time: float
+    """
+    Service wall clock time when the request was handled
+    """
+
+
+SnapshotQuery = Literal['count', 'state', 'uptime', 'counter_thread']
+"""
+The sub-queries get_snapshot can answer in a single reply
+"""
+
+
+class CountingServiceSnapshot(BaseModel):
+    """Reply to get_snapshot. Only the fields which were asked for are filled in, the rest stay None."""
+
+    count: Optional[int] = None
+    """
+    The current count value, same as get_count would return
+    """
+    state: Optional[CountingServiceCapabilityImplementationState]
+    """
+    The capability state, same as the status function would return
+
+    No default on purpose: the SDK validates field defaults against the field's schema, and it
+    can't resolve the reference to the state model while doing so. It's still None if not asked for.
+    """
+    uptime: Optional[float] = None
+    """
+    Seconds since this service process created the capability
+    """
+    counter_thread_alive: Optional[bool] = None
+    """
+    True if the background counter thread exists and is running
+    """
+
+
+@dataclass
+class ProfilingRequest:
+    """Parameters of start_profiling."""
+
+    interval: Annotated[float, Field(ge=0.001, le=1.0)]
+    """
+    Seconds between two samples, 0.01 (100 samples per second) is a good start
+    """
+    max_duration: Annotated[float, Field(ge=0)]
+    """
+    Stop sampling after this many seconds even if stop_profiling never arrives, 0 for no limit
+    """
+
+
+@dataclass
+class CountingServiceProfilerState:
+    """What the sampling profiler is doing and what the current profile covers."""
+
+    running: bool
+    """
+    True while samples are being taken
+    """
+    interval: float
+    """
+    Seconds between two samples
+    """
+    samples: int
+    """
+    Samples in the current profile, each covers every thread
+    """
+    duration: float
+    """
+    Seconds the current profile covers
+    """
+
+
+@dataclass
+class CountingServiceProfilerResponse:
+    """Reply to start_profiling and stop_profiling."""
+
+    profiler: CountingServiceProfilerState
+    """
+    The profiler after the operation
+    """
+    success: bool
+    """
+    If true: message caused a change. If false: it did not.
+    """
+
+
+ProfileOutput = Literal['collapsed', 'functions']
+"""
+The formats get_profile can return a profile in
+"""
+
+
+@dataclass
+class ProfileQuery:
+    """Parameters of get_profile."""
+
+    output: ProfileOutput
+    """
+    'collapsed' for flamegraph input, 'functions' for a table of the busiest functions
+    """
+    limit: Annotated[int, Field(ge=0)]
+    """
+    Return at most this many stacks or functions, 0 for all of them
+    """
+
+
+@dataclass
+class ProfiledFunction:
+    """Samples attributed to one function."""
+
+    function: str
+    """
+    'name (file:first line)'
+    """
+    self_samples: int
+    """
+    Samples where this function was running, i.e. on top of the stack
+    """
+    total_samples: int
+    """
+    Samples where this function was anywhere on the stack
+    """
+
+
+class CountingServiceProfile(BaseModel):
+    """Reply to get_profile. Only the output which was asked for is filled in."""
+
+    profiler: CountingServiceProfilerState
+    """
+    Which samples the profile is made of
+    """
+    collapsed: Optional[List[str]] = None
+    """
+    One 'thread;outer;...;inner count' line per distinct stack, most frequent first
+    """
+    functions: Optional[List[ProfiledFunction]] = None
+    """
+    Functions ordered by self samples
+    """
+
+
+def _profiler_state() -> CountingServiceProfilerState:
+    return CountingServiceProfilerState(
+        running=PROFILER.running,
+        interval=PROFILER.interval,
+        samples=PROFILER.samples,
+        duration=PROFILER.duration(),
+    )
+
+
 class CountingServiceCapabilityImplementation(IntersectBaseCapabilityImplementation):
     """This example is meant to showcase that your implementation is able to track state if you want it to.
 
-    Please note that this is not an especially robust implementation, as in the instance
-    the service gets two messages at the same time, it may manage to create
-    two threads at once.
+    start_count, stop_count and reset_count each make their whole transition under state_lock, so
+    concurrent messages see them one after the other: two start_count messages can't both start a
+    thread, and every reply reports the state its own transition left behind. The counter thread
+    sleeps on an event, which stop_count and reset_count set to wake it up and make it exit, so
+    neither waits for the thread's current second to run out.
     """
 
     intersect_sdk_capability_name = 'CountingExample'
@@ -85,24 +370,52 @@ class CountingServiceCapabilityImplementation(IntersectBaseCapabilityImplementat
         do whatever you like in the constructor. In this instance, we just initialize our state.
         """
         super().__init__()
+        # Guards start_time, state.counting and counter_thread, timed for the metrics.
+        # Created first, the counter thread started below takes it.
+        self.state_lock = TimedLock(STATE_LOCK_WAIT)
+
         self.state = CountingServiceCapabilityImplementationState()
         self.counter_thread: Optional[threading.Thread] = None
+        # Set to wake the current counter thread and make it exit, every thread gets a new one
+        self._counter_stop = threading.Event()
         
         # Track when we started and use this to calculate the count
         self.start_time = time.time()
+
+        # Unlike start_time, this is never moved and is only used to report uptime
+        self.service_start_time = self.start_time
+
+        # Lets clients holding a clock lease tell a restarted service from the one they synced with,
+        # unless the restart restored this from a snapshot along with start_time (see state_snapshot.py).
+        # reset_count replaces it along with start_time.
+        self.instance_id = uuid.uuid4().hex
         
         # Start the counter automatically when the service starts
         logger.info("Starting counter automatically at service startup")
-        self.state.counting = True
+        with self.state_lock:
+            self.state.counting = True
+            self._start_counter_thread()
+
+    def _start_counter_thread(self) -> None:
+        """Start the background counter thread, the caller holds state_lock and has set state.counting."""
+        self._counter_stop = threading.Event()
         self.counter_thread = threading.Thread(
             target=self._run_count,
+            args=(self._counter_stop,),
             daemon=True,
             name='counter_thread',
         )
         self.counter_thread.start()
-        
-        # Add a thread lock to prevent race conditions when reading count
-        self.state_lock = threading.Lock()
+
+    def _stop_counter_thread(self) -> Optional[threading.Thread]:
+        """Wake the counter thread and make it exit, the caller holds state_lock.
+
+        Returns:
+            The thread, if there was one, for the caller to join after releasing state_lock
+        """
+        thread, self.counter_thread = self.counter_thread, None
+        self._counter_stop.set()
+        return thread
 
     @intersect_status()
     def status(self) -> CountingServiceCapabilityImplementationState:
@@ -124,22 +437,18 @@ class CountingServiceCapabilityImplementation(IntersectBaseCapabilityImplementat
             True - if counter was started successfully
             False - if counter was already running and this was called
         """
-        if self.state.counting:
+        with self.state_lock:
+            if self.state.counting:
+                return CountingServiceCapabilityImplementationResponse(
+                    state=self.state.model_copy(),
+                    success=False,
+                )
+            self.state.counting = True
+            self._start_counter_thread()
             return CountingServiceCapabilityImplementationResponse(
-                state=self.state,
-                success=False,
+                state=self.state.model_copy(),
+                success=True,
             )
-        self.state.counting = True
-        self.counter_thread = threading.Thread(
-            target=self._run_count,
-            daemon=True,
-            name='counter_thread',
-        )
-        self.counter_thread.start()
-        return CountingServiceCapabilityImplementationResponse(
-            state=self.state,
-            success=True,
-        )
 
     @intersect_message()
     def stop_count(self) -> CountingServiceCapabilityImplementationResponse:
@@ -150,19 +459,53 @@ class CountingServiceCapabilityImplementation(IntersectBaseCapabilityImplementat
             True - if counter was stopped successfully
             False - if counter was already not running and this was called
         """
-        if not self.state.counting:
-            return CountingServiceCapabilityImplementationResponse(
-                state=self.state,
-                success=False,
-            )
-        self.state.counting = False
-        self.counter_thread.join()
-        self.counter_thread = None
+        with self.state_lock:
+            if not self.state.counting:
+                return CountingServiceCapabilityImplementationResponse(
+                    state=self.state.model_copy(),
+                    success=False,
+                )
+            self.state.counting = False
+            thread = self._stop_counter_thread()
+            state = self.state.model_copy()
+        # The thread is awake and exits right away, joining means no count_tick follows this reply
+        if thread is not None:
+            thread.join()
         return CountingServiceCapabilityImplementationResponse(
-            state=self.state,
+            state=state,
             success=True,
         )
 
+    @intersect_message()
+    def reset_count(self, start_again: bool) -> CountingServiceCapabilityImplementationState:
+        """Set the counter back to 0.
+
+        Params
+          start_again: if True, start the counter again; if False, the
+            counter will remain off.
+
+        Returns:
+          the state BEFORE the counter was reset
+        """
+        with self.state_lock:
+            now = time.time()
+            before = CountingServiceCapabilityImplementationState(
+                count=max(0, int(now - self.start_time)),
+                counting=self.state.counting,
+            )
+            # a running thread is replaced, so the ticks line up with the new start time
+            thread = self._stop_counter_thread()
+            self.start_time = now
+            # clock leases computed from the old start time must end
+            self.instance_id = uuid.uuid4().hex
+            self.state.counting = start_again
+            if start_again:
+                self._start_counter_thread()
+        if thread is not None:
+            thread.join()
+        logger.info(f"Counter reset at {before.count}, counting: {start_again}")
+        return before
+
     @intersect_message()
     def get_count(self) -> int:
         """Return the current count value based on elapsed time.
@@ -176,36 +519,336 @@ class CountingServiceCapabilityImplementation(IntersectBaseCapabilityImplementat
         with self.state_lock:
             # Calculate seconds elapsed (round down to get a stable integer)
             elapsed_seconds = int(time.time() - self.start_time)
-            
-            # Log occasionally to avoid flooding logs
-            if elapsed_seconds % 10 == 0:
-                logger.info(f"Client requested count: {elapsed_seconds}")
-            
-            return elapsed_seconds
 
-    def _run_count(self) -> None:
+        # Log occasionally to avoid flooding logs, outside the lock and formatted by the log writer
+        if elapsed_seconds % 10 == 0:
+            logger.info("Client requested count: %d", elapsed_seconds)
+
+        return elapsed_seconds
+
+    @intersect_message()
+    def get_count_tagged(self, request_id: int) -> CountingServiceTaggedCount:
+        """Return the current count value together with the caller's correlation ID.
+
+        The SDK does not hand the client any message ID in its response callback, so pipelined
+        clients put their own ID in the payload and we echo it back here.
+
+        Params:
+          request_id: an opaque correlation ID chosen by the client
+
+        Returns:
+            A CountingServiceTaggedCount with the echoed ID and the current count
+        """
+        return CountingServiceTaggedCount(
+            request_id=request_id,
+            count=self.get_count(),
+        )
+
+    @intersect_message()
+    def get_clock(self, request_id: int) -> CountingServiceClock:
+        """Return our count epoch and current wall clock time, for clients estimating the count locally.
+
+        Clients sample this a few times, NTP style, to work out the offset between their clock and
+        ours. Reading the clock as late as possible keeps the sample close to the middle of the
+        round trip.
+
+        Params:
+          request_id: an opaque correlation ID chosen by the client
+
+        Returns:
+            A CountingServiceClock with the instance ID, start time and current time
+        """
+        with self.state_lock:
+            start_time = self.start_time
+        return CountingServiceClock(
+            request_id=request_id,
+            instance_id=self.instance_id,
+            start_time=start_time,
+            server_time=time.time(),
+        )
+
+    @intersect_message()
+    def get_snapshot(self, queries: List[SnapshotQuery]) -> CountingServiceSnapshot:
+        """Answer several queries in one round trip.
+
+        Clients polling at a high rate can ask for everything they need at once, which costs
+        one broker round trip and one serialization instead of one per value.
+
+        Params:
+          queries: which values to include. An empty list includes all of them.
+
+        Returns:
+            A CountingServiceSnapshot where every field which was not asked for is None
+        """
+        wanted = set(queries) if queries else {'count', 'state', 'uptime', 'counter_thread'}
+        snapshot = CountingServiceSnapshot(state=None)
+        now = time.time()
+        with self.state_lock:
+            if 'count' in wanted:
+                snapshot.count = int(now - self.start_time)
+            if 'state' in wanted:
+                snapshot.state = self.state.model_copy()
+            if 'counter_thread' in wanted:
+                snapshot.counter_thread_alive = self.counter_thread is not None and self.counter_thread.is_alive()
+        if 'uptime' in wanted:
+            snapshot.uptime = now - self.service_start_time
+        return snapshot
+
+    @intersect_message()
+    def start_profiling(self, request: ProfilingRequest) -> CountingServiceProfilerResponse:
+        """Start sampling every thread of this process, discarding the previous profile.
+
+        The samples are taken by a separate thread, so requests keep being handled at full speed
+        while a profile is recorded. With SERVICE_WORKERS this profiles whichever worker received
+        the request.
+
+        Params:
+          request: sampling interval and time limit
+
+        Returns:
+          A CountingServiceProfilerResponse. The success value will be:
+            True - if the profiler was started
+            False - if it was already running, in which case it keeps its settings
+        """
+        success = PROFILER.start(request.interval, request.max_duration)
+        return CountingServiceProfilerResponse(profiler=_profiler_state(), success=success)
+
+    @intersect_message()
+    def stop_profiling(self) -> CountingServiceProfilerResponse:
+        """Stop sampling. The profile is kept until the next start_profiling.
+
+        Returns:
+          A CountingServiceProfilerResponse. The success value will be:
+            True - if the profiler was stopped
+            False - if it was not running
+        """
+        success = PROFILER.stop()
+        return CountingServiceProfilerResponse(profiler=_profiler_state(), success=success)
+
+    @intersect_message()
+    def get_profile(self, query: ProfileQuery) -> CountingServiceProfile:
+        """Return the current profile, which keeps growing if the profiler is still running.
+
+        Params:
+          query: output format and how many entries to return
+
+        Returns:
+            A CountingServiceProfile with either collapsed stacks or a function table
+        """
+        profile = CountingServiceProfile(profiler=_profiler_state())
+        if query.output == 'collapsed':
+            stacks = PROFILER.collapsed()
+            profile.collapsed = stacks[:query.limit] if query.limit else stacks
+        else:
+            profile.functions = [
+                ProfiledFunction(function=function, self_samples=own, total_samples=total)
+                for function, own, total in PROFILER.functions(query.limit)
+            ]
+        return profile
+
+    @intersect_event(events={'count_tick': IntersectEventDefinition(event_type=CountingServiceTick)})
+    def _run_count(self, stop: threading.Event) -> None:
         """This is an example of a function which will NOT be exposed to INTERSECT.
 
-        This just keeps track of the basic state and logs periodically based on elapsed time.
+        This keeps track of the basic state, logs periodically based on elapsed time, and
+        pushes a count_tick event every time the count increases so clients don't have to poll.
         The actual count is determined by elapsed seconds in the get_count method.
+
+        The function is decorated with @intersect_event because it runs in its own thread,
+        so there is no @intersect_message function on the stack to register the event on.
+
+        Params:
+          stop: this thread's event, set when it should exit
         """
         logger.info("Counter thread started")
         
         # Keep the thread alive but don't rely on it for the actual count
-        while self.state.counting:
-            time.sleep(1.0)
+        while True:
+            # Wake up just after the next count boundary rather than every 1.0 seconds,
+            # so the tick goes out as soon as the count has changed
+            with self.state_lock:
+                start_time = self.start_time
+            now = time.time()
+            next_boundary = start_time + int(now - start_time) + 1
+            # True as soon as stop_count or reset_count sets it, without waiting for the boundary
+            if stop.wait(max(0.0, next_boundary - now) + 0.001):
+                break
             
             # Periodically log the count based on elapsed time
             with self.state_lock:
-                elapsed_seconds = int(time.time() - self.start_time)
-                if elapsed_seconds % 10 == 0:
-                    logger.info(f"Counter reached: {elapsed_seconds}")
+                # in worker mode another worker may have stopped the counter, see WorkerIntersectService.reconcile
+                if stop.is_set() or not self.state.counting:
+                    break
+                now = time.time()
+                elapsed_seconds = int(now - self.start_time)
+            if elapsed_seconds % 10 == 0:
+                logger.info("Counter reached: %d", elapsed_seconds)
+
+            self.intersect_sdk_emit_event(
+                'count_tick',
+                CountingServiceTick(count=elapsed_seconds, timestamp=now, instance_id=self.instance_id),
+            )
+            COUNT_TICKS.inc()
+
+def capability_types(multi_counter: bool) -> List[type]:
+    """The capability classes the service hosts, in the order IntersectService gets them."""
+    if multi_counter:
+        return [CountingServiceCapabilityImplementation, MultiCounterCapabilityImplementation]
+    return [CountingServiceCapabilityImplementation]
+
+
+def schema_artifact(multi_counter: bool) -> str:
+    """The precomputed schema of capability_types(multi_counter), written by schema_cache.py."""
+    name = 'counting_service_multi_counter_schema.json' if multi_counter else 'counting_service_schema.json'
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+
+
+@functools.lru_cache(maxsize=None)
+def check_schema_artifact(multi_counter: bool) -> bool:
+    """Return True if SCHEMA_CACHE is on and the precomputed schema is up to date.
+
+    A stale or missing artifact exits the process right away, rather than once the brokers are up.
+    With SCHEMA_CACHE_STRICT=0 it's logged and the schema is generated at startup instead.
+    """
+    if not SCHEMA_CACHE:
+        return False
+    try:
+        read_artifact(schema_artifact(multi_counter), capability_types(multi_counter), SERVICE_CONFIG.data_stores.get_missing_data_store_types())
+    except SchemaCacheMismatch as e:
+        if SCHEMA_CACHE_STRICT:
+            logger.error(f"{e}, or set SCHEMA_CACHE_STRICT=0 to generate the schema at startup")
+            sys.exit(1)
+        logger.warning(f"{e}, generating the schema at startup instead")
+        return False
+    return True
+
+
+def schema_source(multi_counter: bool):
+    """Context in which IntersectServices load the precomputed schema, unless it is off or stale."""
+    return cached_schema(schema_artifact(multi_counter)) if check_schema_artifact(multi_counter) else contextlib.nullcontext()
+
+
+def select_brokers(background: bool) -> None:
+    """Put the fastest broker first if BROKER_SELECTION=latency, optionally keep re-ranking in the background."""
+    if BROKER_SELECTION != "latency":
+        return
+    select_config_brokers(SERVICE_CONFIG, probe_interval=BROKER_PROBE_INTERVAL, background=background)
+
+
+def install_connection_pool() -> None:
+    """Hand the SDK pooled broker clients if CONNECTION_POOL is set, before any IntersectService is constructed."""
+    if not CONNECTION_POOL:
+        return
+    pool = ConnectionPool(max_channels=POOL_MAX_CHANNELS).install()
+    BROKER_CONNECTIONS.set_function(pool.connection_count)
+    logger.info(f"Sharing broker connections, up to {POOL_MAX_CHANNELS} services each")
+
+
+def wait_for_cluster() -> None:
+    """Block until a broker accepts a session, rather than sleeping a fixed time first. Exits if none does in time."""
+    startup_timer.mark('import')
+    try:
+        wait_for_brokers(SERVICE_CONFIG, timeout=STARTUP_TIMEOUT)
+    except TimeoutError as e:
+        logger.error(f"Giving up on startup: {e}")
+        sys.exit(1)
+    startup_timer.mark('brokers')
+
+
+def run_worker(index: int, shared_name: str, lock, ready) -> None:
+    """Entry point of one worker process in SERVICE_WORKERS mode, started by WorkerSupervisor."""
+    # the supervisor waited for the brokers, this process only imported the module
+    startup_timer.mark('import')
+    select_brokers(background=True)
+    install_connection_pool()
+    shared = SharedCounterState.attach(shared_name, lock)
+    with schema_source(multi_counter=False):
+        service = WorkerIntersectService(
+            CountingServiceCapabilityImplementation(),
+            SERVICE_CONFIG,
+            shared,
+            publishes_events=index == 0,
+        )
+    instrument_service(service)
+    startup_timer.mark('setup')
+    startup_timer.watch(service, f"Worker {index}", STARTUP_SECONDS)
+    if METRICS_PORT:
+        # a replacement binds while the worker it replaces still holds the port during a rolling restart
+        serve(REGISTRY, METRICS_PORT + index, host=METRICS_HOST, reuse_port=True)
+    logger.info(f"Worker {index} consuming requests")
+    try:
+        default_intersect_lifecycle_loop(
+            service,
+            # Follow start/stop requests other workers handled
+            delay=1.0,
+            post_startup_callback=ready.set,
+            waiting_callback=service.reconcile,
+        )
+    finally:
+        shared.close()
 
 
 if __name__ == '__main__':
-    capability = CountingServiceCapabilityImplementation()
-    service = IntersectService([capability], SERVICE_CONFIG)
+    if SERVICE_WORKERS > 1:
+        if PROTOCOL != "amqp":
+            # MQTT sessions each get their own copy of every request, so every worker would answer
+            logger.error("SERVICE_WORKERS needs PROTOCOL=amqp, where workers share one request queue")
+            sys.exit(1)
+        if HOT_STANDBY or MULTI_COUNTER:
+            logger.warning("HOT_STANDBY and MULTI_COUNTER are ignored with SERVICE_WORKERS")
+        check_schema_artifact(multi_counter=False)
+        wait_for_cluster()
+        logger.info(f"Starting counting_service with {SERVICE_WORKERS} workers, use Ctrl+C to exit.")
+        WorkerSupervisor(
+            SERVICE_WORKERS,
+            run_worker,
+            snapshot=SnapshotFile(SNAPSHOT_PATH) if SNAPSHOT_PATH else None,
+            snapshot_interval=SNAPSHOT_INTERVAL,
+        ).run()
+        sys.exit(0)
+
+    check_schema_artifact(MULTI_COUNTER)
+    wait_for_cluster()
+    capabilities = [CountingServiceCapabilityImplementation()]
+    checkpointer = None
+    if SNAPSHOT_PATH:
+        counter = capabilities[0]
+        snapshot = SnapshotFile(SNAPSHOT_PATH)
+        if restore_counter(snapshot, counter):
+            logger.info(f"Restored the counter from {SNAPSHOT_PATH}, counting: {counter.state.counting}")
+        checkpointer = Checkpointer(
+            snapshot,
+            lambda: SavedCounter(start_time=counter.start_time, counting=counter.state.counting, instance_id=counter.instance_id),
+            SNAPSHOT_INTERVAL,
+        ).start()
+    if MULTI_COUNTER:
+        capabilities.append(MultiCounterCapabilityImplementation())
+        logger.info("Hosting the MultiCounter capability")
+    # with hot standby this decides which broker the active service uses
+    select_brokers(background=not HOT_STANDBY)
+    install_connection_pool()
+    with schema_source(MULTI_COUNTER):
+        if HOT_STANDBY:
+            service = HotStandbyService(
+                capabilities,
+                split_service_config(SERVICE_CONFIG),
+                competing_consumers=PROTOCOL == "amqp",
+            )
+            logger.info(f"Hot standby enabled with {len(service.services)} broker connection(s)")
+        else:
+            service = IntersectService(capabilities, SERVICE_CONFIG)
+    instrument_service(service)
+    if checkpointer is not None:
+        checkpointer.watch(service, MUTATING_OPERATIONS)
+    if METRICS_PORT:
+        serve(REGISTRY, METRICS_PORT, host=METRICS_HOST)
+    startup_timer.mark('setup')
+    startup_timer.watch(service, 'counting_service', STARTUP_SECONDS)
     logger.info('Starting counting_service with RabbitMQ clustering support, use Ctrl+C to exit.')
-    default_intersect_lifecycle_loop(
-        service,
-    )
\ No newline at end of file
+    try:
+        default_intersect_lifecycle_loop(
+            service,
+        )
+    finally:
+        if checkpointer is not None:
+            checkpointer.stop()
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Hot-standby broker connections for the counting service.
+
+Normally the service has one IntersectService, and when its broker node goes away the SDK has to
+connect, authenticate and subscribe again on the next node before requests are answered.
+
+HotStandbyService opens one IntersectService per broker node up front, all hosting the same
+capability objects and all already subscribed to the request channel. How they share the work
+depends on the protocol:
+
+- AMQP: service request queues are durable and named after the topic, so every connected service
+  consumes from the same cluster queue as a competing consumer. All of them serve, each request is
+  answered once, and losing a node just means the survivors pick up its share.
+- MQTT: every session gets its own copy of each request, so only the active service answers. The
+  standbys drop requests until a heartbeat on the active one is missed, then one is promoted.
+
+In both cases only the active service publishes the capabilities' events, so clients see each
+count_tick once. HotStandbyService has the same lifecycle methods as IntersectService, so it
+can be handed to default_intersect_lifecycle_loop.
+"""
+
+import copy
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from intersect_sdk import (
+    IntersectBaseCapabilityImplementation,
+    IntersectService,
+    IntersectServiceConfig,
+)
+
+from service_metrics import FAILOVER_SECONDS, FAILOVERS
+
+logger = logging.getLogger(__name__)
+
+
+def split_service_config(service_config: IntersectServiceConfig) -> List[IntersectServiceConfig]:
+    """Return one copy of the service config per broker node, each listing only that node."""
+    configs = []
+    for control_plane in service_config.brokers:
+        for broker in control_plane.brokers:
+            # ControlPlaneConfig is a dataclass rather than a model, so copy it by hand
+            pinned = copy.copy(control_plane)
+            pinned.brokers = [broker]
+            configs.append(service_config.model_copy(update={'brokers': [pinned]}))
+    return configs
+
+
+class StandbyIntersectService(IntersectService):
+    """An IntersectService which can be told to ignore incoming requests while it is on standby."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.serving = True
+
+    def _handle_service_message_raw(self, raw: bytes) -> None:
+        if not self.serving:
+            return
+        super()._handle_service_message_raw(raw)
+
+
+class HotStandbyService:
+    """One pre-connected IntersectService per broker node, with failover by promotion."""
+
+    def __init__(
+        self,
+        capabilities: List[IntersectBaseCapabilityImplementation],
+        configs: List[IntersectServiceConfig],
+        competing_consumers: bool,
+        heartbeat_interval: float = 0.25,
+    ) -> None:
+        """Create the services, call startup() to connect them.
+
+        Params:
+          capabilities: the capability objects, shared by every service
+          configs: one config per node (see split_service_config), the first one starts as active
+          competing_consumers: True if the broker shares one request queue between the services
+            (AMQP), False if every service gets its own copy of each request (MQTT)
+          heartbeat_interval: how often to check that the active service is still connected
+        """
+        if not configs:
+            raise ValueError('need at least one service config')
+        self.capabilities = capabilities
+        self.competing_consumers = competing_consumers
+        self.heartbeat_interval = heartbeat_interval
+        self.active_index = 0
+        self.failovers = 0
+
+        self.services = [StandbyIntersectService(capabilities, config) for config in configs]
+        for index, service in enumerate(self.services):
+            service.serving = competing_consumers or index == 0
+            if index > 0:
+                self._stop_events(service)
+
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> StandbyIntersectService:
+        """The service currently publishing events (and, for MQTT, answering requests)."""
+        return self.services[self.active_index]
+
+    def startup(self) -> 'HotStandbyService':
+        for index, service in enumerate(self.services):
+            try:
+                service.startup()
+            except Exception as e:
+                logger.error(f"Could not start service for broker node {index}: {e}")
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._monitor_loop, daemon=True, name='hot_standby_monitor')
+        self._monitor.start()
+        return self
+
+    def shutdown(self, reason: Optional[str] = None) -> 'HotStandbyService':
+        self._stop.set()
+        for service in self.services:
+            service.shutdown(reason)
+        return self
+
+    def is_connected(self) -> bool:
+        return self.active.is_connected()
+
+    def considered_unrecoverable(self) -> bool:
+        return all(service.considered_unrecoverable() for service in self.services)
+
+    def _monitor_loop(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            if not self.active.is_connected():
+                self._promote()
+
+    def _promote(self) -> None:
+        candidates = [
+            i for i, service in enumerate(self.services)
+            if i != self.active_index and service.is_connected()
+        ]
+        if not candidates:
+            return
+        started = time.perf_counter()
+        previous = self.services[self.active_index]
+        self.active_index = candidates[0]
+        self.active.serving = True
+        if not self.competing_consumers:
+            previous.serving = False
+        self._stop_events(previous)
+        self._start_events(self.active)
+        self.failovers += 1
+        duration = time.perf_counter() - started
+        FAILOVERS.inc()
+        FAILOVER_SECONDS.observe(duration)
+        logger.warning(
+            f"Broker node of the active service went away, promoted hot standby node {self.active_index} "
+            f"in {duration * 1000:.2f}ms"
+        )
+
+    # The SDK has no public switch for which service publishes a capability's events,
+    # so we move the service in and out of each capability's observer list directly.
+
+    def _stop_events(self, service: IntersectService) -> None:
+        for capability in self.capabilities:
+            observers = capability.__intersect_sdk_observers__
+            if service in observers:
+                observers.remove(service)
+
+    def _start_events(self, service: IntersectService) -> None:
+        for capability in self.capabilities:
+            observers = capability.__intersect_sdk_observers__
+            if service not in observers:
+                observers.append(service)
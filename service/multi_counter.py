@@ -0,0 +1,361 @@
+"""
+A capability hosting many named counters in one service.
+
+CountingServiceCapabilityImplementation hosts exactly one counter with its own start_time, lock and
+counter thread. That doesn't scale to thousands of counters, so here:
+
+- Counter state lives in CounterColumns: one typed array per field (start epoch, offset, running
+  flag, wheel slot, last ticked count) indexed by row, plus a name -> row dict. A counter costs about 200 bytes,
+  mostly its name and dict entry, instead of a Python object, a lock and a thread.
+- One TimerWheel thread replaces the per-counter threads. A running counter crosses a count
+  boundary once per second, always at the same fraction of the second, so it sits in a fixed slot
+  of a one second wheel until it is stopped. Each wheel tick handles one slot and emits a single
+  batched counters_tick event for every counter in it.
+
+Memory grows by a few array entries per counter and the thread count stays at one, however many
+counters there are.
+"""
+
+import logging
+import math
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set
+
+from pydantic import Field
+from typing_extensions import Annotated
+
+from intersect_sdk import (
+    IntersectBaseCapabilityImplementation,
+    IntersectEventDefinition,
+    intersect_event,
+    intersect_message,
+)
+
+from service_metrics import EVENTS
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_TICKS = EVENTS.labels('counters_tick')
+
+CounterName = Annotated[str, Field(min_length=1, max_length=128)]
+"""
+Counters are addressed by name
+"""
+
+
+@dataclass
+class CounterValue:
+    """The current value of one named counter."""
+
+    name: str
+    """
+    The counter's name
+    """
+    count: int
+    """
+    Whole seconds the counter has been running, summed over all of its runs
+    """
+    running: bool
+    """
+    True if the counter is currently counting
+    """
+
+
+@dataclass
+class MultiCounterResponse:
+    """Reply to create_counter, start_counter and stop_counter."""
+
+    counter: CounterValue
+    """
+    The counter after the operation
+    """
+    success: bool
+    """
+    If true: message caused a change. If false: it did not.
+    """
+
+
+@dataclass
+class MultiCounterTick:
+    """Payload of the counters_tick event, one per wheel slot with at least one running counter."""
+
+    counts: Dict[str, int]
+    """
+    New count of every counter which crossed a count boundary in this slot, by name
+    """
+    timestamp: float
+    """
+    Service wall clock time (seconds since the epoch) when the tick was emitted
+    """
+
+
+class CounterColumns:
+    """Counter state stored column-wise in typed arrays, one row per counter.
+
+    Not thread-safe on its own, callers hold the capability's lock.
+    """
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.rows: Dict[str, int] = {}
+        # wall clock time the current run started, only meaningful while running
+        self.start_time = array('d')
+        # seconds counted by all earlier runs
+        self.offset = array('d')
+        self.running = array('b')
+        # timer wheel slot while running, -1 otherwise
+        self.slot = array('h')
+        # count in the last counters_tick, or when the current run started
+        self.ticked = array('q')
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str) -> int:
+        """Append a stopped counter at zero and return its row."""
+        row = len(self.names)
+        self.names.append(name)
+        self.rows[name] = row
+        self.start_time.append(0.0)
+        self.offset.append(0.0)
+        self.running.append(0)
+        self.slot.append(-1)
+        self.ticked.append(0)
+        return row
+
+    def row(self, name: str) -> int:
+        """Row of a named counter, raises ValueError for unknown names."""
+        row = self.rows.get(name)
+        if row is None:
+            raise ValueError(f"No counter named '{name}'")
+        return row
+
+    def elapsed(self, row: int, now: float) -> float:
+        """Fractional seconds counted so far."""
+        if self.running[row]:
+            return self.offset[row] + now - self.start_time[row]
+        return self.offset[row]
+
+    def value(self, row: int, now: float) -> CounterValue:
+        return CounterValue(
+            name=self.names[row],
+            count=int(self.elapsed(row, now)),
+            running=bool(self.running[row]),
+        )
+
+    def phase(self, row: int) -> float:
+        """Fraction of the wall clock second at which this running counter crosses a count boundary."""
+        return (self.start_time[row] - self.offset[row]) % 1.0
+
+
+class TimerWheel:
+    """A one second timer wheel served by a single thread.
+
+    Every entry recurs once per second in the same slot, which is exactly what a running counter
+    needs. Each tick sleeps until the end of the next slot's window and hands the rows in that slot
+    to ``on_expire``. If a sleep overshoots by more than a slot, the slots it overslept are handed
+    over too, in order, up to one second's worth.
+    """
+
+    def __init__(self, on_expire: Callable[[List[int], float], None], slots: int = 20) -> None:
+        """Create a stopped wheel.
+
+        Params:
+          on_expire: called from the wheel thread with the rows of the slot which just ended and the current time
+          slots: number of slots per second, i.e. how late after its boundary a row may fire at most
+        """
+        self.slots = slots
+        self.on_expire = on_expire
+        self._entries: List[Set[int]] = [set() for _ in range(slots)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def slot_for(self, phase: float) -> int:
+        """The slot covering a fraction of a second."""
+        return int(phase * self.slots) % self.slots
+
+    def schedule(self, row: int, slot: int) -> None:
+        with self._lock:
+            self._entries[slot].add(row)
+
+    def cancel(self, row: int, slot: int) -> None:
+        with self._lock:
+            self._entries[slot].discard(row)
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='timer_wheel')
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        # windows are numbered since the epoch, window w belongs to slot w % slots
+        handled = int(time.time() * self.slots) - 1
+        while not self._stop.is_set():
+            now = time.time()
+            next_edge = (math.floor(now * self.slots) + 1) / self.slots
+            time.sleep(max(0.0, next_edge - now) + 0.001)
+
+            now = time.time()
+            # the window which ended at the edge we just passed, and any we slept through before it
+            ended = int(now * self.slots) - 1
+            for window in range(max(handled + 1, ended - self.slots + 1), ended + 1):
+                self._expire(window % self.slots, now)
+            handled = max(handled, ended)
+
+    def _expire(self, slot: int, now: float) -> None:
+        with self._lock:
+            rows = list(self._entries[slot])
+        if rows:
+            try:
+                self.on_expire(rows, now)
+            except Exception as e:
+                logger.error(f"Timer wheel callback failed: {e}")
+
+
+class MultiCounterCapabilityImplementation(IntersectBaseCapabilityImplementation):
+    """Hosts any number of named counters, each of which can be started and stopped on its own.
+
+    A counter's count is the number of whole seconds it has been running, like the count of
+    CountingExample, but summed over every run.
+    """
+
+    intersect_sdk_capability_name = 'MultiCounter'
+
+    def __init__(self) -> None:
+        """Constructors are never exposed to INTERSECT."""
+        super().__init__()
+        self.columns = CounterColumns()
+        # one lock for every counter, operations on a counter are a handful of array accesses
+        self.lock = threading.Lock()
+        self.wheel = TimerWheel(self._on_wheel_tick)
+        self.wheel.start()
+
+    @intersect_message()
+    def create_counter(self, name: CounterName) -> MultiCounterResponse:
+        """Create a stopped counter at zero. "Fails" if a counter with this name already exists.
+
+        Params:
+          name: the new counter's name
+
+        Returns:
+          A MultiCounterResponse with the counter. The success value will be:
+            True - if the counter was created
+            False - if it already existed, it is left as it was
+        """
+        with self.lock:
+            row = self.columns.rows.get(name)
+            success = row is None
+            if success:
+                row = self.columns.add(name)
+            return MultiCounterResponse(counter=self.columns.value(row, time.time()), success=success)
+
+    @intersect_message()
+    def start_counter(self, name: CounterName) -> MultiCounterResponse:
+        """Start a counter, continuing from its current count. "Fails" if it is already running.
+
+        Params:
+          name: the counter's name
+
+        Returns:
+          A MultiCounterResponse with the counter. The success value will be:
+            True - if the counter was started
+            False - if it was already running
+        """
+        now = time.time()
+        with self.lock:
+            columns = self.columns
+            row = columns.row(name)
+            if columns.running[row]:
+                return MultiCounterResponse(counter=columns.value(row, now), success=False)
+            columns.start_time[row] = now
+            columns.running[row] = 1
+            # the slot may end right after the start, the first tick waits for the count to change
+            columns.ticked[row] = int(columns.offset[row])
+            columns.slot[row] = self.wheel.slot_for(columns.phase(row))
+            self.wheel.schedule(row, columns.slot[row])
+            return MultiCounterResponse(counter=columns.value(row, now), success=True)
+
+    @intersect_message()
+    def stop_counter(self, name: CounterName) -> MultiCounterResponse:
+        """Stop a counter, keeping its count. "Fails" if it is not running.
+
+        Params:
+          name: the counter's name
+
+        Returns:
+          A MultiCounterResponse with the counter. The success value will be:
+            True - if the counter was stopped
+            False - if it was not running
+        """
+        now = time.time()
+        with self.lock:
+            columns = self.columns
+            row = columns.row(name)
+            if not columns.running[row]:
+                return MultiCounterResponse(counter=columns.value(row, now), success=False)
+            columns.offset[row] = columns.elapsed(row, now)
+            columns.running[row] = 0
+            self.wheel.cancel(row, columns.slot[row])
+            columns.slot[row] = -1
+            return MultiCounterResponse(counter=columns.value(row, now), success=True)
+
+    @intersect_message()
+    def get_counter(self, name: CounterName) -> CounterValue:
+        """Return the current value of one counter.
+
+        Params:
+          name: the counter's name
+
+        Returns:
+            The counter's CounterValue
+        """
+        with self.lock:
+            return self.columns.value(self.columns.row(name), time.time())
+
+    @intersect_message()
+    def get_counters(self, names: List[CounterName]) -> List[CounterValue]:
+        """Return the current values of several counters in one round trip.
+
+        Every value is read at the same instant, so counters which run together report consistent counts.
+
+        Params:
+          names: the counters to read. An empty list reads every counter.
+
+        Returns:
+            A CounterValue per requested counter, in the order asked for
+        """
+        now = time.time()
+        with self.lock:
+            columns = self.columns
+            rows = [columns.row(name) for name in names] if names else range(len(columns))
+            return [columns.value(row, now) for row in rows]
+
+    @intersect_event(events={'counters_tick': IntersectEventDefinition(event_type=MultiCounterTick)})
+    def _on_wheel_tick(self, rows: List[int], now: float) -> None:
+        """Emit one counters_tick event for every counter in the wheel slot which just ended and whose count changed.
+
+        Not exposed to INTERSECT. It runs on the wheel thread, hence the @intersect_event.
+        """
+        counts = {}
+        with self.lock:
+            columns = self.columns
+            for row in rows:
+                if not columns.running[row]:
+                    continue
+                count = int(columns.elapsed(row, now))
+                if count != columns.ticked[row]:
+                    columns.ticked[row] = count
+                    counts[columns.names[row]] = count
+        if counts:
+            self.intersect_sdk_emit_event('counters_tick', MultiCounterTick(counts=counts, timestamp=now))
+            COUNTERS_TICKS.inc()
@@ -0,0 +1,319 @@
+"""
+Precomputed capability schema, so the service doesn't generate it every time it starts.
+
+IntersectService's constructor introspects the capability classes and generates the AsyncAPI
+schema it advertises. Generating the JSON schema of every request, reply and event type, and
+checking it against the JSON Schema meta-schema, is most of the constructor's time. The schema only
+changes when the capabilities' code does, so it is generated once by a build step and checked in:
+
+    python service/schema_cache.py          # regenerate the artifacts
+    python service/schema_cache.py --check  # exit with status 1 if one is stale
+
+An artifact is the schema as the SDK generates it, plus an "x-schema-cache" entry with a hash of
+what the schema is generated from (source_hash): each capability's name and docstring, the
+decorators, signature and docstring of each of its operations and events (not their bodies), the
+source of every class they take, return or emit, and the SDK version. Pydantic also shapes the
+schema, the service image pins it (service/requirements.txt) instead of hashing its version.
+
+While cached_schema() is active, constructing an IntersectService (or a subclass, or the services of
+a HotStandbyService) loads the artifact instead of introspecting. The operation and event mappings
+are still built from the classes, with a TypeAdapter per request, reply and event type: Pydantic's
+validators and serializers live in memory and can't be stored. If the hash doesn't match, or the
+artifact is missing, SchemaCacheMismatch is raised before anything connects, rather than advertising
+a schema the service doesn't implement.
+"""
+
+import argparse
+import dataclasses
+import functools
+import hashlib
+import inspect
+import json
+import linecache
+import os
+import re
+import sys
+import tokenize
+import typing
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from pydantic import BaseModel, TypeAdapter
+
+import intersect_sdk.service
+from intersect_sdk._internal.constants import EVENT_ATTR_KEY
+from intersect_sdk._internal.event_metadata import EventMetadata
+from intersect_sdk._internal.function_metadata import FunctionMetadata
+from intersect_sdk._internal.schema import _get_functions, get_schema_and_functions_from_capability_implementations
+from intersect_sdk.version import version_string
+
+CACHE_KEY = 'x-schema-cache'
+"""
+Top-level key of the artifact's cache metadata, removed before the schema is advertised
+"""
+
+
+class SchemaCacheMismatch(Exception):
+    """The artifact was not generated from the capabilities being hosted."""
+
+
+_LIBRARIES = {'builtins', 'typing', 'typing_extensions', 'collections', 'datetime', 'decimal', 'enum', 'uuid', 'pydantic', 'pydantic_core', 'intersect_sdk'}
+
+
+def _describe(annotation: Any, classes: Dict[str, type]) -> str:
+    """A description of an annotation which doesn't depend on the module it was imported as.
+
+    Adds every class it refers to, and the classes their fields refer to, to classes by name.
+    """
+    metadata = getattr(annotation, '__metadata__', None)
+    if metadata is not None:
+        # Annotated, its metadata holds the constraints, e.g. Field(min_length=1)
+        return f'Annotated[{_describe(annotation.__origin__, classes)}, {metadata!r}]'
+    origin = typing.get_origin(annotation)
+    if origin is not None:
+        args = ', '.join(_describe(arg, classes) for arg in typing.get_args(annotation))
+        return f"{getattr(origin, '__qualname__', repr(origin))}[{args}]"
+    if not inspect.isclass(annotation):
+        # None, Literal values, forward references
+        return repr(annotation)
+    if annotation.__module__.split('.')[0] not in _LIBRARIES and annotation.__qualname__ not in classes:
+        classes[annotation.__qualname__] = annotation
+        if dataclasses.is_dataclass(annotation) or issubclass(annotation, (BaseModel, tuple, dict)):
+            for hint in typing.get_type_hints(annotation, include_extras=True).values():
+                _describe(hint, classes)
+    return annotation.__qualname__
+
+
+_LAYOUT = {tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT, tokenize.COMMENT}
+
+
+def _interface(lines: List[str], start: int) -> str:
+    """The decorators, signature and docstring of the function defined at lines[start], without its body.
+
+    Tokenizes only as far as the docstring, inspect.getsource would read the whole body.
+    """
+    parts = []
+    depth = 0
+    signature = False
+    body = False
+    for token in tokenize.generate_tokens(iter(lines[start:]).__next__):
+        if token.type in _LAYOUT:
+            continue
+        if body:
+            if token.type == tokenize.STRING:
+                parts.append(token.string)
+            break
+        parts.append(token.string)
+        if token.type == tokenize.OP and token.string in '([{':
+            depth += 1
+        elif token.type == tokenize.OP and token.string in ')]}':
+            depth -= 1
+        elif depth == 0 and token.string == 'def':
+            signature = True
+        elif depth == 0 and signature and token.string == ':':
+            body = True
+    return ' '.join(parts)
+
+
+_CLASS = re.compile(r'\s*class\s+(\w+)')
+
+
+def _class_source(cls: type, starts: Dict[str, Dict[str, int]]) -> str:
+    """Source of a class, found by name in its file. starts caches the line each class of a file starts on.
+
+    inspect.getsource parses the whole file again for every class it's asked about.
+    """
+    path = inspect.getsourcefile(cls)
+    lines = linecache.getlines(path)
+    if path not in starts:
+        starts[path] = {}
+        for i, line in enumerate(lines):
+            match = _CLASS.match(line)
+            if match:
+                starts[path].setdefault(match.group(1), i)
+    start = starts[path].get(cls.__name__)
+    if start is None:
+        raise SchemaCacheMismatch(f'cannot find the source of {cls.__qualname__}')
+    return ''.join(inspect.getblock(lines[start:]))
+
+
+def _functions(capability_type: type) -> List[Any]:
+    status_func, response_funcs, event_funcs = _get_functions(capability_type)
+    return list(response_funcs) + list(event_funcs) + ([status_func] if status_func else [])
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(capability_types: Tuple[type, ...]) -> str:
+    """Hash of everything a capability schema is generated from, see the module docstring.
+
+    Cached, the service checks the artifact at startup and again when it loads it.
+    """
+    digest = hashlib.sha256(f'intersect-sdk {version_string}\n'.encode())
+    classes: Dict[str, type] = {}
+    for capability_type in capability_types:
+        digest.update(f'{capability_type.intersect_sdk_capability_name}\n{inspect.getdoc(capability_type)}\n'.encode())
+        for function in _functions(capability_type):
+            code = inspect.unwrap(function.method).__code__
+            # co_firstlineno is the first decorator's line
+            digest.update(_interface(linecache.getlines(code.co_filename), code.co_firstlineno - 1).encode() + b'\n')
+            signature = inspect.signature(function.method)
+            annotations = [parameter.annotation for parameter in signature.parameters.values()]
+            annotations.append(signature.return_annotation)
+            annotations.extend(definition.event_type for definition in getattr(function.method, EVENT_ATTR_KEY, {}).values())
+            for annotation in annotations:
+                digest.update(_describe(annotation, classes).encode() + b'\n')
+    starts: Dict[str, Dict[str, int]] = {}
+    for name in sorted(classes):
+        digest.update(_class_source(classes[name], starts).encode())
+    return digest.hexdigest()
+
+
+def _metadata(capability_types: Sequence[type], excluded_data_handlers: Set[Any]) -> Dict[str, Any]:
+    return {
+        'source_hash': source_hash(tuple(capability_types)),
+        'capabilities': [c.intersect_sdk_capability_name for c in capability_types],
+        'excluded_data_handlers': sorted(str(handler.value) for handler in excluded_data_handlers),
+    }
+
+
+def build_schema(path: str, capability_types: Sequence[type], hierarchy: Any, excluded_data_handlers: Set[Any]) -> bool:
+    """Generate the schema the SDK's way and write it, with its cache metadata, to path.
+
+    Returns:
+        True if the file changed
+    """
+    schema = get_schema_and_functions_from_capability_implementations(
+        list(capability_types), service_name=hierarchy, excluded_data_handlers=excluded_data_handlers,
+    )[0]
+    schema[CACHE_KEY] = _metadata(capability_types, excluded_data_handlers)
+    text = json.dumps(schema, indent=2) + '\n'
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, 'w') as f:
+        f.write(text)
+    return True
+
+
+def _adapter(annotation: Any, adapters: Dict[str, TypeAdapter]) -> TypeAdapter:
+    # operations often share a type, e.g. start_count and stop_count
+    key = repr(annotation)
+    if key not in adapters:
+        adapters[key] = TypeAdapter(annotation)
+    return adapters[key]
+
+
+def read_artifact(path: str, capability_types: Sequence[type], excluded_data_handlers: Set[Any]) -> Dict[str, Any]:
+    """The schema in the artifact at path, without its cache metadata.
+
+    Raises:
+      SchemaCacheMismatch: path is missing or was generated from other capabilities, code or versions
+    """
+    try:
+        with open(path) as f:
+            schema = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SchemaCacheMismatch(f'cannot read the schema artifact {path}: {e}') from e
+    expected = _metadata(capability_types, excluded_data_handlers)
+    found = schema.pop(CACHE_KEY, None)
+    if found != expected:
+        differences = [key for key in expected if (found or {}).get(key) != expected[key]]
+        raise SchemaCacheMismatch(
+            f"{path} is stale ({', '.join(differences)} changed), regenerate it with python service/schema_cache.py"
+        )
+    return schema
+
+
+def load_schema(path: str, capability_types: Sequence[type], hierarchy: Any, excluded_data_handlers: Set[Any]) -> Tuple[Any, ...]:
+    """What get_schema_and_functions_from_capability_implementations returns, with the schema read from path.
+
+    Raises:
+      SchemaCacheMismatch: see read_artifact, or the artifact lists other operations than the classes have
+    """
+    schema = read_artifact(path, capability_types, excluded_data_handlers)
+    # the hierarchy comes from the config, not the code
+    schema['info']['title'] = hierarchy.hierarchy_string('.')
+
+    function_map: Dict[str, FunctionMetadata] = {}
+    event_map: Dict[str, EventMetadata] = {}
+    status_capability: Optional[type] = None
+    status_name: Optional[str] = None
+    status_adapter: Optional[TypeAdapter] = None
+    adapters: Dict[str, TypeAdapter] = {}
+    for capability_type in capability_types:
+        capability_name = capability_type.intersect_sdk_capability_name
+        status_func, response_funcs, event_funcs = _get_functions(capability_type)
+        for _, name, method, min_params in response_funcs:
+            signature = inspect.signature(method)
+            parameters = list(signature.parameters.values())
+            request_adapter = _adapter(parameters[-1].annotation, adapters) if len(parameters) == min_params + 1 else None
+            function_map[f'{capability_name}.{name}'] = FunctionMetadata(
+                capability_type, method, request_adapter, _adapter(signature.return_annotation, adapters),
+            )
+        for _, name, method, _ in list(response_funcs) + list(event_funcs):
+            for event_key, definition in getattr(method, EVENT_ATTR_KEY).items():
+                if event_key in event_map:
+                    event_map[event_key].operations.add(name)
+                else:
+                    event_map[event_key] = EventMetadata(
+                        type=definition.event_type,
+                        type_adapter=_adapter(definition.event_type, adapters),
+                        operations={name},
+                        content_type=definition.content_type,
+                        data_transfer_handler=definition.data_handler,
+                    )
+        if status_func is not None:
+            status_capability = capability_type
+            status_name = status_func.method_name
+            status_adapter = _adapter(inspect.signature(status_func.method).return_annotation, adapters)
+            function_map[f'{capability_name}.{status_name}'] = FunctionMetadata(capability_type, status_func.method, None, status_adapter)
+
+    operations = {f'{name}.{channel}' for name, capability in schema['capabilities'].items() for channel in capability['channels']}
+    if status_name:
+        operations.add(f'{status_capability.intersect_sdk_capability_name}.{status_name}')
+    if operations != set(function_map):
+        raise SchemaCacheMismatch(f'{path} advertises other operations than the capabilities implement')
+    return schema, function_map, event_map, status_capability, status_name, status_adapter
+
+
+@contextmanager
+def cached_schema(path: str) -> Iterator[None]:
+    """Construct IntersectServices from the artifact at path instead of introspecting, within the block."""
+    original = intersect_sdk.service.get_schema_and_functions_from_capability_implementations
+
+    def load(capabilities: List[type], service_name: Any, excluded_data_handlers: Set[Any]) -> Tuple[Any, ...]:
+        return load_schema(path, capabilities, service_name, excluded_data_handlers)
+
+    intersect_sdk.service.get_schema_and_functions_from_capability_implementations = load
+    try:
+        yield
+    finally:
+        intersect_sdk.service.get_schema_and_functions_from_capability_implementations = original
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate the counting service\'s precomputed schemas.')
+    parser.add_argument('--check', action='store_true', help='only check, exit with status 1 if an artifact is stale')
+    args = parser.parse_args()
+
+    import counting_service
+
+    stale = []
+    config = counting_service.SERVICE_CONFIG
+    excluded = config.data_stores.get_missing_data_store_types()
+    for multi_counter in (False, True):
+        path = counting_service.schema_artifact(multi_counter)
+        capability_types = counting_service.capability_types(multi_counter)
+        if args.check:
+            try:
+                read_artifact(path, capability_types, excluded)
+            except SchemaCacheMismatch as e:
+                stale.append(str(e))
+        elif build_schema(path, capability_types, config.hierarchy, excluded):
+            print(f'Wrote {os.path.relpath(path)}')
+    for message in stale:
+        print(message, file=sys.stderr)
+    sys.exit(1 if stale else 0)
@@ -0,0 +1,74 @@
+"""
+Metrics recorded by the counting service, served at http://<host>:METRICS_PORT/metrics.
+
+See clustering_common/metrics.py for the registry. Request metrics are recorded around the SDK's
+call into the capability, which covers request validation, the capability function and response
+serialization, but not the broker round trip.
+"""
+
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from clustering_common.metrics import FAST_BUCKETS, REGISTRY
+
+REQUESTS = REGISTRY.counter(
+    'counting_service_requests', 'Requests handled, by operation and outcome', ['operation', 'outcome'],
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'counting_service_request_seconds', 'Time to validate, handle and serialize a request, by operation', ['operation'],
+    buckets=FAST_BUCKETS,
+)
+IN_FLIGHT = REGISTRY.gauge('counting_service_requests_in_flight', 'Requests being handled right now')
+STATE_LOCK_WAIT = REGISTRY.histogram(
+    'counting_service_state_lock_wait_seconds', "Time spent waiting for the CountingExample capability's state_lock",
+    buckets=FAST_BUCKETS,
+)
+EVENTS = REGISTRY.counter('counting_service_events', 'Events emitted, by event name', ['event'])
+STARTUP_SECONDS = REGISTRY.gauge('counting_service_startup_seconds', 'Time each startup phase took', ['phase'])
+FAILOVERS = REGISTRY.counter('counting_service_failovers', 'Hot standby promotions')
+FAILOVER_SECONDS = REGISTRY.histogram(
+    'counting_service_failover_seconds', 'Time to promote a hot standby once the active service lost its broker',
+    buckets=FAST_BUCKETS,
+)
+BROKER_CONNECTIONS = REGISTRY.gauge('counting_service_broker_connections', 'Pooled broker connections which are up (CONNECTION_POOL=1)')
+
+
+def instrument_service(service: Any) -> None:
+    """Record request metrics for every request the service handles.
+
+    Works for an IntersectService or any subclass, and for each service of a HotStandbyService.
+    """
+    for inner in getattr(service, 'services', [service]):
+        # the SDK calls self._call_user_function, so an instance attribute takes its place
+        inner._call_user_function = _timed(inner._call_user_function)
+
+
+def _timed(call_user_function: Callable[..., bytes]) -> Callable[..., bytes]:
+    # (ok, error, seconds) children per operation, resolved once
+    children: Dict[Tuple[str, str], Tuple[Any, Any, Any]] = {}
+
+    def timed_call_user_function(fn_cap: Any, fn_name: str, fn_meta: Any, fn_params: bytes) -> bytes:
+        key = (fn_cap.intersect_sdk_capability_name, fn_name)
+        metrics = children.get(key)
+        if metrics is None:
+            operation = f'{key[0]}.{fn_name}'
+            metrics = children[key] = (
+                REQUESTS.labels(operation, 'ok'),
+                REQUESTS.labels(operation, 'error'),
+                REQUEST_SECONDS.labels(operation),
+            )
+        ok, error, seconds = metrics
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = call_user_function(fn_cap, fn_name, fn_meta, fn_params)
+        except Exception:
+            error.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+            IN_FLIGHT.dec()
+        ok.inc()
+        return response
+
+    return timed_call_user_function
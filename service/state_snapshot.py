@@ -0,0 +1,252 @@
+"""
+A memory-mapped snapshot of the counter's state, so a restarted service carries on counting.
+
+The count is the time elapsed since the counter's start epoch, and the epoch used to be reset
+every time the process started. Now the epoch, the counting flag and the instance ID are written
+to a small local file, and a new process picks them up before it serves its first request. Clients
+see the count continue, and clock-synced clients keep their lease because the instance ID doesn't
+change.
+
+The file is SnapshotFile: a header and two fixed-size slots, written alternately. Every save goes
+to the slot which doesn't hold the newest snapshot, payload first, then the slot header with a
+sequence number and a CRC32 of the payload. A crash in the middle of a save leaves a torn slot that
+fails its checksum, and the other slot is still whole. Loading reads both slot headers and the
+newer valid payload, a constant amount of work.
+
+The payload is a list of tagged sections. Only the CountingExample counter has one (COUNTER_SECTION),
+other state, e.g. MultiCounter's counters, can add its own tag without changing the file format.
+
+Checkpointer keeps the snapshot current: right after every start_count/stop_count/reset_count, and every
+interval seconds from a background thread, which also msyncs the file. Between saves the file is
+only written if something changed.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CSNP'
+VERSION = 1
+# magic, version, slot size, padding to 16 bytes
+_FILE_HEADER = struct.Struct('<4sHI6x')
+# sequence number, payload length, CRC32 of the payload
+_SLOT_HEADER = struct.Struct('<QII')
+# tag, length
+_SECTION = struct.Struct('<4sI')
+
+COUNTER_SECTION = b'CNTR'
+# start_time, counting, instance_id
+_COUNTER = struct.Struct('<d?16s')
+
+
+@dataclass
+class SavedCounter:
+    """The part of the CountingExample capability which survives a restart."""
+
+    start_time: float
+    """
+    Wall clock time the count is measured from
+    """
+    counting: bool
+    """
+    True if the counter was running
+    """
+    instance_id: str
+    """
+    The instance ID clients saw, kept so clock leases stay valid across the restart
+    """
+
+
+class SnapshotFile:
+    """Tagged sections of bytes in a memory-mapped file, saved crash-safely. Thread-safe."""
+
+    def __init__(self, path: str, slot_size: int = 2048) -> None:
+        """Open the file, creating it (and its directory) if needed.
+
+        A file with a different layout is treated as empty and overwritten by the next save.
+
+        Params:
+          path: the snapshot file
+          slot_size: bytes per slot, the largest payload is slot_size minus a 16 byte header
+        """
+        self.path = path
+        self.slot_size = slot_size
+        self._lock = threading.Lock()
+        self._sequence = 0
+        # the slot holding the newest valid snapshot, the next save goes to the other one
+        self._newest_slot = 1
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = _FILE_HEADER.size + 2 * slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        if _FILE_HEADER.unpack_from(self._map, 0)[:3] != (MAGIC, VERSION, slot_size):
+            self._map[:] = bytes(size)
+            _FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, slot_size)
+        else:
+            self._sequence, self._newest_slot = max((self._read_slot(slot)[0], slot) for slot in (0, 1))
+
+    def load(self) -> Dict[bytes, bytes]:
+        """The sections of the newest valid snapshot, empty if there is none."""
+        with self._lock:
+            slots = [self._read_slot(0), self._read_slot(1)]
+        sequence, payload = max(slots, key=lambda slot: slot[0])
+        sections = {}
+        offset = 0
+        while sequence and offset < len(payload):
+            tag, length = _SECTION.unpack_from(payload, offset)
+            offset += _SECTION.size
+            sections[tag] = payload[offset:offset + length]
+            offset += length
+        return sections
+
+    def save(self, sections: Dict[bytes, bytes]) -> None:
+        """Replace the snapshot with these sections.
+
+        Raises:
+          ValueError: the sections don't fit in a slot
+        """
+        payload = b''.join(_SECTION.pack(tag, len(data)) + data for tag, data in sections.items())
+        if len(payload) > self.slot_size - _SLOT_HEADER.size:
+            raise ValueError(f'snapshot of {len(payload)} bytes does not fit in a {self.slot_size} byte slot')
+        with self._lock:
+            sequence = self._sequence + 1
+            slot = 1 - self._newest_slot
+            offset = self._slot_offset(slot)
+            # payload first, the header which makes it valid last
+            self._map[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + len(payload)] = payload
+            _SLOT_HEADER.pack_into(self._map, offset, sequence, len(payload), zlib.crc32(payload))
+            self._sequence = sequence
+            self._newest_slot = slot
+
+    def sync(self) -> None:
+        """Flush the file to disk, so a snapshot also survives the machine going down."""
+        self._map.flush()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def _slot_offset(self, slot: int) -> int:
+        return _FILE_HEADER.size + slot * self.slot_size
+
+    def _read_slot(self, slot: int) -> tuple:
+        """(sequence, payload) of a slot, (0, b'') if it is empty or torn."""
+        offset = self._slot_offset(slot)
+        sequence, length, crc = _SLOT_HEADER.unpack_from(self._map, offset)
+        if not sequence or length > self.slot_size - _SLOT_HEADER.size:
+            return 0, b''
+        payload = self._map[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + length]
+        if zlib.crc32(payload) != crc:
+            return 0, b''
+        return sequence, payload
+
+
+def load_counter(snapshot: SnapshotFile) -> Optional[SavedCounter]:
+    """The counter saved in the snapshot, None if there isn't one."""
+    data = snapshot.load().get(COUNTER_SECTION)
+    if data is None or len(data) != _COUNTER.size:
+        return None
+    start_time, counting, instance_id = _COUNTER.unpack(data)
+    return SavedCounter(start_time=start_time, counting=counting, instance_id=instance_id.hex())
+
+
+def restore_counter(snapshot: SnapshotFile, capability: Any) -> bool:
+    """Give a freshly constructed CountingExample capability the saved epoch, flag and instance ID.
+
+    Returns:
+        False if there was nothing to restore, the capability keeps its fresh state
+    """
+    saved = load_counter(snapshot)
+    if saved is None:
+        return False
+    with capability.state_lock:
+        capability.start_time = saved.start_time
+        capability.instance_id = saved.instance_id
+        # the running thread's ticks are timed for the fresh start time
+        thread = capability._stop_counter_thread()
+        capability.state.counting = saved.counting
+        if saved.counting:
+            capability._start_counter_thread()
+    if thread is not None:
+        thread.join()
+    return True
+
+
+class Checkpointer:
+    """Keeps the counter section of a SnapshotFile up to date."""
+
+    def __init__(self, snapshot: SnapshotFile, read_counter: Callable[[], SavedCounter], interval: float = 1.0) -> None:
+        """
+        Params:
+          snapshot: where to save
+          read_counter: returns the current values, called on the checkpoint thread and after mutating requests
+          interval: seconds between periodic checkpoints
+        """
+        self.snapshot = snapshot
+        self.read_counter = read_counter
+        self.interval = interval
+        self._saved: Optional[bytes] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def checkpoint(self) -> None:
+        """Save the current values if they changed since the last save."""
+        counter = self.read_counter()
+        data = _COUNTER.pack(counter.start_time, counter.counting, bytes.fromhex(counter.instance_id))
+        if data != self._saved:
+            self.snapshot.save({COUNTER_SECTION: data})
+            self._saved = data
+
+    def start(self) -> 'Checkpointer':
+        """Checkpoint now and then every interval seconds from a daemon thread."""
+        self.checkpoint()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='snapshot_checkpointer')
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the thread after a last checkpoint."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.checkpoint()
+        self.snapshot.sync()
+
+    def watch(self, service: Any, operations: Collection[str]) -> None:
+        """Checkpoint right after a service (or each of a HotStandbyService's services) handles one of operations."""
+        for inner in getattr(service, 'services', [service]):
+            inner._call_user_function = self._checkpointing(inner._call_user_function, operations)
+
+    def _checkpointing(self, call_user_function: Callable[..., bytes], operations: Collection[str]) -> Callable[..., bytes]:
+        def checkpointing_call_user_function(fn_cap: Any, fn_name: str, fn_meta: Any, fn_params: bytes) -> bytes:
+            try:
+                return call_user_function(fn_cap, fn_name, fn_meta, fn_params)
+            finally:
+                if fn_name in operations:
+                    self.checkpoint()
+
+        return checkpointing_call_user_function
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+                self.snapshot.sync()
+            except Exception as e:
+                logger.error(f"Could not checkpoint the counter to {self.snapshot.path}: {e}")
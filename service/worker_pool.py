@@ -0,0 +1,384 @@
+"""
+Multi-process worker mode for the counting service.
+
+A single IntersectService handles every request on one core. In worker mode a supervisor process
+starts K worker processes, each running its own IntersectService for the same hierarchy. With AMQP
+the request queue is named after the topic and shared, so the workers are competing consumers and
+the broker hands every request to exactly one of them.
+
+Each worker has its own capability object, so the parts of the counter which requests can change
+(the start epoch and the counting flag) live in a small shared memory block, SharedCounterState:
+
+- reads are lock-free: the block carries a sequence number which writers bump before and after
+  writing (a seqlock), readers retry if it changed underneath them
+- start_count, stop_count and reset_count run under a cross-process lock, so "already running" answers are
+  consistent no matter which worker gets the request
+
+Before every call the worker copies the shared values into its capability and after a mutating
+call copies them back, so the capability code is the same as in single-process mode. Only worker 0
+publishes the capability's events, so clients see each count_tick once.
+
+The supervisor restarts workers which die, stops them all gracefully on SIGTERM/SIGINT, and on
+SIGHUP replaces them one at a time, starting each replacement and waiting for it to connect
+before stopping the worker it replaces.
+"""
+
+import logging
+import multiprocessing
+import signal
+import struct
+import time
+import uuid
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable, Optional, Tuple
+
+from intersect_sdk import IntersectService
+
+from state_snapshot import Checkpointer, SavedCounter, SnapshotFile, load_counter
+
+logger = logging.getLogger(__name__)
+
+# sequence number, start_time, service_start_time, counting, instance_id
+_LAYOUT = struct.Struct('<QddB16s')
+
+# operations which change the shared values and so must not interleave across workers
+MUTATING_OPERATIONS = {'start_count', 'stop_count', 'reset_count'}
+
+
+@dataclass
+class SharedCounterValues:
+    """One consistent read of a SharedCounterState."""
+
+    start_time: float
+    """
+    Wall clock time the count is measured from
+    """
+    service_start_time: float
+    """
+    Wall clock time the supervisor started, used to report uptime
+    """
+    counting: bool
+    """
+    True if the counter is running
+    """
+    instance_id: str
+    """
+    Identifies the worker pool as a whole and its count epoch, every worker reports the same one
+    """
+
+
+class SharedCounterState:
+    """The counter's epoch, running flag and identity in a shared memory block."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, lock: Any, owner: bool) -> None:
+        """Use create() or attach() instead."""
+        self.shm = shm
+        self.lock = lock
+        self.owner = owner
+
+    @classmethod
+    def create(cls, context: Any, start_time: float, counting: bool, instance_id: Optional[str] = None) -> 'SharedCounterState':
+        """Allocate and initialize the block (supervisor side).
+
+        Params:
+          context: the multiprocessing context the workers will be started from
+          start_time: the initial count epoch
+          counting: whether the counter starts out running
+          instance_id: the pool's identity, a new one if None
+        """
+        shm = shared_memory.SharedMemory(create=True, size=_LAYOUT.size)
+        instance = uuid.UUID(hex=instance_id) if instance_id else uuid.uuid4()
+        _LAYOUT.pack_into(shm.buf, 0, 0, start_time, time.time(), counting, instance.bytes)
+        return cls(shm, context.Lock(), owner=True)
+
+    @classmethod
+    def attach(cls, name: str, lock: Any) -> 'SharedCounterState':
+        """Open a block created by the supervisor (worker side)."""
+        return cls(shared_memory.SharedMemory(name=name), lock, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def read(self) -> SharedCounterValues:
+        """Lock-free consistent read, retries while a write is in progress."""
+        while True:
+            sequence, start_time, service_start_time, counting, instance_id = _LAYOUT.unpack_from(self.shm.buf, 0)
+            if sequence % 2 == 0 and _LAYOUT.unpack_from(self.shm.buf, 0)[0] == sequence:
+                return SharedCounterValues(
+                    start_time=start_time,
+                    service_start_time=service_start_time,
+                    counting=bool(counting),
+                    instance_id=uuid.UUID(bytes=instance_id).hex,
+                )
+
+    def write(self, start_time: float, counting: bool, instance_id: Optional[str] = None) -> None:
+        """Update the epoch, the flag and (if given) the identity, the caller must hold self.lock."""
+        sequence, _, service_start_time, _, current_id = _LAYOUT.unpack_from(self.shm.buf, 0)
+        instance = uuid.UUID(hex=instance_id).bytes if instance_id else current_id
+        struct.pack_into('<Q', self.shm.buf, 0, sequence + 1)
+        _LAYOUT.pack_into(self.shm.buf, 0, sequence + 1, start_time, service_start_time, counting, instance)
+        struct.pack_into('<Q', self.shm.buf, 0, sequence + 2)
+
+    def load_into(self, capability: Any) -> None:
+        """Copy the shared values into a CountingExample capability."""
+        values = self.read()
+        capability.start_time = values.start_time
+        capability.state.counting = values.counting
+        # reset_count on another worker replaces it
+        capability.instance_id = values.instance_id
+
+    def store_from(self, capability: Any) -> None:
+        """Copy a CountingExample capability's values back, the caller must hold self.lock."""
+        self.write(capability.start_time, capability.state.counting, capability.instance_id)
+
+    def adopt(self, capability: Any) -> None:
+        """Give a freshly constructed capability the pool's identity and current values."""
+        values = self.read()
+        capability.service_start_time = values.service_start_time
+        self.load_into(capability)
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class WorkerIntersectService(IntersectService):
+    """An IntersectService which keeps its CountingExample capability in sync with SharedCounterState."""
+
+    def __init__(self, capability: Any, config: Any, shared: SharedCounterState, publishes_events: bool) -> None:
+        """Create one worker's service.
+
+        Params:
+          capability: this worker's CountingExample capability
+          config: the worker's IntersectConfig
+          shared: the pool's shared counter state
+          publishes_events: True for the one worker whose events are published
+        """
+        super().__init__([capability], config)
+        self.capability = capability
+        self.shared = shared
+        shared.adopt(capability)
+        # The SDK has no public switch for which service publishes a capability's events
+        if not publishes_events and self in capability.__intersect_sdk_observers__:
+            capability.__intersect_sdk_observers__.remove(self)
+
+    def _call_user_function(self, fn_cap: Any, fn_name: str, fn_meta: Any, fn_params: bytes) -> bytes:
+        if fn_cap is not self.capability:
+            return super()._call_user_function(fn_cap, fn_name, fn_meta, fn_params)
+        if fn_name not in MUTATING_OPERATIONS:
+            self.shared.load_into(fn_cap)
+            return super()._call_user_function(fn_cap, fn_name, fn_meta, fn_params)
+        with self.shared.lock:
+            # start the transition from what other workers left behind
+            self.reconcile()
+            try:
+                return super()._call_user_function(fn_cap, fn_name, fn_meta, fn_params)
+            finally:
+                self.shared.store_from(fn_cap)
+
+    def reconcile(self, _gateway: Any = None) -> None:
+        """Follow changes made by other workers (passed to the lifecycle loop as waiting_callback).
+
+        Starts or stops the local counter thread to match the shared flag, and replaces a running
+        one after a reset elsewhere so its ticks line up with the new start time.
+        """
+        capability = self.capability
+        with capability.state_lock:
+            start_time = capability.start_time
+            self.shared.load_into(capability)
+            thread = capability.counter_thread
+            running = thread is not None and thread.is_alive()
+            if running and (not capability.state.counting or capability.start_time != start_time):
+                capability._stop_counter_thread()
+                running = False
+            if capability.state.counting and not running:
+                capability._start_counter_thread()
+
+
+@dataclass
+class WorkerSlot:
+    """Supervisor bookkeeping for one worker position."""
+
+    index: int
+    """
+    Worker number, 0 is the one which publishes events
+    """
+    process: Optional[multiprocessing.process.BaseProcess] = None
+    """
+    The process currently filling this slot
+    """
+    started_at: float = 0.0
+    """
+    Monotonic time the current process was started
+    """
+    restarts: int = 0
+    """
+    How often the process in this slot had to be replaced after dying
+    """
+    crashes_in_a_row: int = 0
+    """
+    Deaths without a healthy run in between, drives the restart backoff
+    """
+    restart_at: Optional[float] = None
+    """
+    Monotonic time a replacement is due, while the slot is empty
+    """
+    ready: Optional[Any] = None
+    """
+    Event the current process sets once connected. The parent has to keep it alive until the child has
+    unpickled it, or the semaphore behind it is gone.
+    """
+
+
+class WorkerSupervisor:
+    """Starts, watches and restarts the worker processes."""
+
+    def __init__(
+        self,
+        workers: int,
+        worker_main: Callable[..., None],
+        restart_delay: float = 1.0,
+        stop_timeout: float = 10.0,
+        ready_timeout: float = 30.0,
+        snapshot: Optional[SnapshotFile] = None,
+        snapshot_interval: float = 1.0,
+    ) -> None:
+        """Create a supervisor, nothing runs until run() is called.
+
+        Params:
+          workers: number of worker processes
+          worker_main: module level function run in each worker as
+            worker_main(index, shared_name, lock, ready_event), see counting_service.run_worker
+          restart_delay: seconds to wait before replacing a worker which died, doubled for every
+            consecutive crash of the same slot up to 30 seconds. A worker which ran for a minute
+            counts as healthy and resets the backoff.
+          stop_timeout: seconds a worker gets to shut down gracefully before it is killed
+          ready_timeout: seconds a replacement gets to connect during a rolling restart
+          snapshot: restore the shared values from it at startup and keep it up to date, see state_snapshot.py
+          snapshot_interval: seconds between checkpoints to snapshot
+        """
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.context = multiprocessing.get_context('spawn')
+        self.worker_main = worker_main
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.ready_timeout = ready_timeout
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        self.slots = [WorkerSlot(index=i) for i in range(workers)]
+        self.shared: Optional[SharedCounterState] = None
+        self._stopping = False
+        self._rolling_restart = False
+
+    def run(self) -> None:
+        """Run until SIGTERM or SIGINT, then stop every worker gracefully."""
+        saved = load_counter(self.snapshot) if self.snapshot is not None else None
+        if saved is None:
+            self.shared = SharedCounterState.create(self.context, time.time(), counting=True)
+        else:
+            self.shared = SharedCounterState.create(self.context, saved.start_time, saved.counting, saved.instance_id)
+            logger.info(f"Restored the counter from {self.snapshot.path}, counting: {saved.counting}")
+        checkpointer = None
+        if self.snapshot is not None:
+            # workers change the shared values, so the supervisor checkpoints what it reads there
+            checkpointer = Checkpointer(self.snapshot, self._saved_counter, self.snapshot_interval).start()
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        signal.signal(signal.SIGHUP, self._on_restart_signal)
+        try:
+            for slot in self.slots:
+                self._fill(slot, *self._spawn(slot.index))
+            logger.info(f"Started {len(self.slots)} workers, send SIGHUP for a rolling restart")
+            while not self._stopping:
+                if self._rolling_restart:
+                    self._rolling_restart = False
+                    self.rolling_restart()
+                self._check_workers()
+                time.sleep(0.5)
+        finally:
+            for slot in self.slots:
+                self._stop_process(slot.process)
+            if checkpointer is not None:
+                checkpointer.stop()
+            self.shared.close()
+            logger.info('All workers stopped')
+
+    def rolling_restart(self) -> None:
+        """Replace every worker in turn without ever leaving the queue without consumers."""
+        logger.info('Rolling restart of all workers')
+        for slot in self.slots:
+            if self._stopping:
+                return
+            replacement, ready = self._spawn(slot.index)
+            if not ready.wait(self.ready_timeout):
+                logger.error(f"Replacement for worker {slot.index} did not connect, keeping the old one")
+                self._stop_process(replacement)
+                continue
+            old = slot.process
+            self._fill(slot, replacement, ready)
+            self._stop_process(old)
+        logger.info('Rolling restart done')
+
+    def _saved_counter(self) -> SavedCounter:
+        values = self.shared.read()
+        return SavedCounter(start_time=values.start_time, counting=values.counting, instance_id=values.instance_id)
+
+    def _spawn(self, index: int) -> Tuple[multiprocessing.process.BaseProcess, Any]:
+        """Start a worker, returns the process and the event it sets once connected."""
+        ready = self.context.Event()
+        process = self.context.Process(
+            target=self.worker_main,
+            args=(index, self.shared.name, self.shared.lock, ready),
+            name=f'counting-worker-{index}',
+            daemon=False,
+        )
+        process.start()
+        logger.info(f"Worker {index} started with pid {process.pid}")
+        return process, ready
+
+    def _fill(self, slot: WorkerSlot, process: multiprocessing.process.BaseProcess, ready: Any) -> None:
+        slot.process = process
+        slot.ready = ready
+        slot.started_at = time.monotonic()
+        slot.restart_at = None
+
+    def _stop_process(self, process: Optional[multiprocessing.process.BaseProcess]) -> None:
+        """SIGTERM lets the worker's lifecycle loop shut its service down, SIGKILL if that takes too long."""
+        if process is None or not process.is_alive():
+            return
+        process.terminate()
+        process.join(self.stop_timeout)
+        if process.is_alive():
+            logger.warning(f"Worker pid {process.pid} did not stop within {self.stop_timeout}s, killing it")
+            process.kill()
+            process.join()
+
+    def _check_workers(self) -> None:
+        """Replace workers which died, with a growing delay if they keep dying."""
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.process is not None and not slot.process.is_alive():
+                if now - slot.started_at > 60.0:
+                    slot.crashes_in_a_row = 0
+                delay = min(30.0, self.restart_delay * 2 ** min(slot.crashes_in_a_row, 5))
+                logger.error(
+                    f"Worker {slot.index} (pid {slot.process.pid}) exited with code {slot.process.exitcode}, "
+                    f"restarting in {delay:.1f}s"
+                )
+                slot.process = None
+                slot.restarts += 1
+                slot.crashes_in_a_row += 1
+                slot.restart_at = now + delay
+            elif slot.process is None and slot.restart_at is not None and now >= slot.restart_at:
+                self._fill(slot, *self._spawn(slot.index))
+
+    def _on_stop_signal(self, signum: int, _frame: Any) -> None:
+        logger.info(f"Caught signal {signum}, stopping workers")
+        self._stopping = True
+
+    def _on_restart_signal(self, signum: int, _frame: Any) -> None:
+        self._rolling_restart = True
@@ -0,0 +1,33 @@
+"""
+Regression test for the counting capability's lifecycle races, a short run of
+benchmarks/stress_lifecycle.py (see there for the checks).
+
+Run from the repository root:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from repo_modules import load_service_module  # noqa: E402
+from stress_lifecycle import Stress  # noqa: E402
+
+# slowest stop_count/reset_count allowed, in ms, with room for a loaded CI machine
+MAX_STOP_LATENCY_MS = 500.0
+
+
+def test_lifecycle_stress_has_no_violations() -> None:
+    counting_service = load_service_module()
+    capability = counting_service.CountingServiceCapabilityImplementation()
+    try:
+        report = Stress(capability, duration=1.0, seed=1).run(threads=8)
+    finally:
+        capability.stop_count()
+
+    assert report['violation_count'] == 0, report['violations']
+    assert report['transitions'], 'no transitions ran'
+    for row in report['operations']:
+        if row['operation'] in ('stop_count', 'reset_count', 'reset_count_stopped') and row['max_ms'] is not None:
+            assert row['max_ms'] < MAX_STOP_LATENCY_MS, row
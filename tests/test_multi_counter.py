@@ -0,0 +1,140 @@
+"""
+MultiCounter's counters_tick events and the timer wheel behind them, on a fake clock.
+"""
+
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from repo_modules import load_service_module  # noqa: E402
+
+multi_counter = load_service_module('multi_counter')
+
+
+class FakeClock:
+    """Stands in for the time module, sleeping only advances the clock (by `overshoot` more than asked)."""
+
+    def __init__(self, now: float, overshoot: float = 0.0) -> None:
+        self.now = now
+        self.overshoot = overshoot
+        self.on_sleep = lambda: None
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds + self.overshoot
+        self.on_sleep()
+
+
+@pytest.fixture
+def clock(monkeypatch: Any) -> FakeClock:
+    fake = FakeClock(100.0)
+    monkeypatch.setattr(multi_counter, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def capability(monkeypatch: Any) -> Any:
+    capability = multi_counter.MultiCounterCapabilityImplementation()
+    # the tests drive the ticks themselves
+    capability.wheel.stop()
+    capability.wheel._thread.join()
+    return capability
+
+
+def ticks_of(capability: Any) -> List[Dict[str, int]]:
+    ticks: List[Dict[str, int]] = []
+    capability.intersect_sdk_emit_event = lambda name, payload: ticks.append(payload.counts)
+    return ticks
+
+
+def tick(capability: Any, clock: FakeClock, at: float) -> None:
+    """Expire the slot covering `at`'s fraction of a second, as the wheel would once that slot ends."""
+    clock.now = at
+    slot = capability.wheel.slot_for(at % 1.0)
+    capability._on_wheel_tick(sorted(capability.wheel._entries[slot]), at)
+
+
+def test_no_tick_right_after_start(capability: Any, clock: FakeClock) -> None:
+    ticks = ticks_of(capability)
+    capability.create_counter('a')
+    capability.start_counter('a')
+    tick(capability, clock, 100.027)
+    assert ticks == []
+
+
+def test_one_tick_per_count(capability: Any, clock: FakeClock) -> None:
+    ticks = ticks_of(capability)
+    capability.create_counter('a')
+    capability.start_counter('a')
+    for second in range(1, 4):
+        tick(capability, clock, 100.0 + second + 0.02)
+    assert ticks == [{'a': 1}, {'a': 2}, {'a': 3}]
+
+
+def test_restart_continues_from_the_stopped_count(capability: Any, clock: FakeClock) -> None:
+    ticks = ticks_of(capability)
+    capability.create_counter('a')
+    capability.start_counter('a')
+    clock.now = 101.5
+    assert capability.stop_counter('a').counter.count == 1
+    assert capability.wheel._entries[0] == set()
+
+    # 1.5s counted before, so the count ticks over 0.5s into the new run
+    clock.now = 200.25
+    capability.start_counter('a')
+    assert capability.columns.phase(0) == 0.75
+    assert capability.columns.slot[0] == 15
+    tick(capability, clock, 200.26)
+    tick(capability, clock, 200.76)
+    tick(capability, clock, 201.76)
+    assert ticks == [{'a': 2}, {'a': 3}]
+    assert capability.get_counter('a').count == 3
+
+
+def test_counters_in_one_slot_share_a_tick(capability: Any, clock: FakeClock) -> None:
+    ticks = ticks_of(capability)
+    for name in ('a', 'b'):
+        capability.create_counter(name)
+        capability.start_counter(name)
+    capability.create_counter('c')
+    tick(capability, clock, 101.01)
+    assert ticks == [{'a': 1, 'b': 1}]
+
+
+def run_wheel(clock: FakeClock, seconds: float) -> List[Tuple[int, float]]:
+    """Run a TimerWheel on the fake clock with one row in every slot, returns (slot, time) per expiry."""
+    expired: List[Tuple[int, float]] = []
+    wheel = multi_counter.TimerWheel(lambda rows, now: expired.append((rows[0], now)))
+    for slot in range(wheel.slots):
+        wheel.schedule(slot, slot)
+    end = clock.now + seconds
+
+    def stop_at_end() -> None:
+        if clock.now >= end:
+            wheel.stop()
+
+    clock.on_sleep = stop_at_end
+    wheel._run()
+    return expired
+
+
+def test_wheel_expires_every_slot_once_in_order(clock: FakeClock) -> None:
+    expired = run_wheel(clock, 2.0)
+    slots = [slot for slot, _ in expired]
+    assert len(slots) >= 39
+    assert slots == [(slots[0] + i) % 20 for i in range(len(slots))]
+
+
+def test_wheel_catches_up_on_overslept_slots(clock: FakeClock) -> None:
+    # every sleep runs 0.12s long, more than two slots
+    clock.overshoot = 0.12
+    expired = run_wheel(clock, 2.0)
+    slots = [slot for slot, _ in expired]
+    assert len(slots) >= 39
+    assert slots == [(slots[0] + i) % 20 for i in range(len(slots))]
@@ -0,0 +1,22 @@
+"""
+The checked-in schema artifacts match the capabilities, as the service checks at startup.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from repo_modules import load_service_module  # noqa: E402
+
+counting_service = load_service_module()
+schema_cache = load_service_module('schema_cache')
+
+
+@pytest.mark.parametrize('multi_counter', [False, True])
+def test_schema_artifact_is_current(multi_counter: bool) -> None:
+    excluded = counting_service.SERVICE_CONFIG.data_stores.get_missing_data_store_types()
+    # raises SchemaCacheMismatch, regenerate with python service/schema_cache.py
+    schema_cache.read_artifact(counting_service.schema_artifact(multi_counter), counting_service.capability_types(multi_counter), excluded)
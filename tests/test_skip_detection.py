@@ -0,0 +1,57 @@
+"""
+Skip detection of the counting client's orchestrators, fed counts directly.
+"""
+
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from repo_modules import load_client_module  # noqa: E402
+
+counting_client = load_client_module()
+async_runner = load_client_module('async_runner')
+client_metrics = load_client_module('client_metrics')
+request_pipeline = load_client_module('request_pipeline')
+
+
+def skipped_after(orchestrator, counts) -> float:
+    """Record each (count, request_id) and return how many counts were reported skipped."""
+    orchestrator.start_time = time.time()
+    before = client_metrics.SKIPPED.value
+    for count_value, request_id in counts:
+        orchestrator.record_count(count_value, None, request_id)
+    return client_metrics.SKIPPED.value - before
+
+
+def test_count_drop_then_skip_is_reported() -> None:
+    # the service restarted after 41, then 2 went missing
+    orchestrator = counting_client.SampleOrchestrator()
+    assert skipped_after(orchestrator, [(40, None), (41, None), (0, None), (1, None), (3, None)]) == 1
+    assert orchestrator.last_count == 3
+
+
+def test_pipelined_count_drop_then_skip_is_reported() -> None:
+    orchestrator = counting_client.SampleOrchestrator(request_pipeline.RequestPipeline(4))
+    assert skipped_after(orchestrator, [(40, 1), (41, 2), (0, 3), (1, 4), (3, 5)]) == 1
+
+
+def test_overtaken_pipelined_reply_is_not_a_skip() -> None:
+    # request 3's reply arrives after request 4's, with the count request 4 already reported
+    orchestrator = counting_client.SampleOrchestrator(request_pipeline.RequestPipeline(4))
+    assert skipped_after(orchestrator, [(5, 1), (6, 2), (7, 4), (6, 3), (8, 5)]) == 0
+    assert orchestrator.last_count == 8
+
+
+def test_async_count_drop_then_skip_is_reported() -> None:
+    orchestrator = async_runner.AsyncCountingOrchestrator(SimpleNamespace(recoveries=0), log_counts=False)
+    assert skipped_after(orchestrator, [(40, 1), (41, 2), (0, 3), (1, 4), (3, 5)]) == 1
+    assert orchestrator.skipped == 1
+
+
+def test_overtaken_async_reply_is_not_a_skip() -> None:
+    orchestrator = async_runner.AsyncCountingOrchestrator(SimpleNamespace(recoveries=0), log_counts=False)
+    assert skipped_after(orchestrator, [(5, 1), (6, 2), (7, 4), (6, 3), (8, 5)]) == 0
+    assert orchestrator.last_count == 8